@@ -1,11 +1,16 @@
 import os
-import pathlib
-import sqlite3
+import sys
+import time
+import multiprocessing
+from contextlib import contextmanager
 import nltk
-import json
 import pandas as pd
+import nltk_resources
+import storage
+import token_store
 
 DATABASE_TABLES = ["foxnews", "aljazeera", "bcc"]
+TAGGER = None  # PerceptronTagger of this process. Loaded once by get_tagger
 
 def get_all_articles():
     
@@ -14,7 +19,7 @@ def get_all_articles():
     Get all articles from the database.
     """
 
-    db = sqlite3.connect(os.path.join(os.path.dirname(pathlib.Path(__file__).parent.resolve()) , "dataA", "db.sqlite3"))  # Establish connection to database
+    db = storage.get_connection()  # Shared connection to the database
     
     fox_news_df = pd.read_sql("SELECT * FROM " + DATABASE_TABLES[0], db)  # Get all articles from the table fox_news
     aljazeera_df = pd.read_sql("SELECT * FROM " + DATABASE_TABLES[1], db)  # Get all articles from the table aljazeera
@@ -22,44 +27,132 @@ def get_all_articles():
 
     return [fox_news_df, aljazeera_df, bcc_df]
 
-def PoSTagger():
+def get_tagger():
+
+    """
+    Return the PerceptronTagger of this process, loading the model the first time.
+    nltk.pos_tag loads the model again on every call. Tagging with a kept tagger gives exactly the same tags.
+    """
+
+    global TAGGER
+    if TAGGER is None:
+        nltk_resources.use_resources()  # Also in spawned pool workers
+        TAGGER = nltk.tag.PerceptronTagger()
+    return TAGGER
+
+def tag_text(text):
+
+    """
+    Split the text into sentences and words and tag every word. Return a list of (word, tag).
+    """
+
+    tags = []
+    tagger = get_tagger()
+    text_sentences = nltk.sent_tokenize(text)  # Split the text into sentences
+
+    for sentence in text_sentences:
+        tokenized_sentence = nltk.word_tokenize(sentence)  # Split the sentence into words
+        tags.extend(tagger.tag(tokenized_sentence))  # Append tagged text to list as a tuple of (word, tag)
+    return tags
+
+def create_pool(workers):
+
+    """
+    Return a process pool of tagging workers, or None if workers <= 1 (serial tagging).
+    Every worker loads the tagger model once when it starts and keeps it.
+    """
+
+    if workers is None or workers <= 1:
+        return None
+    return multiprocessing.Pool(workers, initializer=get_tagger)
+
+@contextmanager
+def tagging_pool(workers):
+
+    """
+    Context manager around create_pool: yields the pool (None for serial tagging) and stops its workers on exit,
+    also when tagging fails, so no worker process outlives the run.
+    """
+
+    pool = create_pool(workers)
+    try:
+        yield pool
+    finally:
+        if pool is not None:
+            pool.terminate()  # Every result was read on success, pending tasks of a failed run are dropped
+            pool.join()
+
+def tag_texts(texts, pool=None, chunk_size=16):
+
+    """
+    Tag a list of texts. Return one list of (word, tag) per text, in the order of texts.
+    With a pool (create_pool), texts are sent to the workers in chunks of chunk_size. imap keeps the input order,
+    so the output is identical to the serial path.
+    """
+
+    if pool is None:
+        return [tag_text(text) for text in texts]
+    return list(pool.imap(tag_text, texts, chunksize=chunk_size))
+
+def PoSTagger(workers=1, chunk_size=16):
 
     """
     SYNTACTIC ANALYSIS SYSTEM.
     Run spiders first in order for the database to be populated.
     For every article in the database, get the article's text and tag it with PoS tags.
     Save the tagged text in the database.
+    Set workers > 1 to tag the articles with a process pool, chunk_size articles per task.
     """
 
-    # Download needed NLTK packages for PoS tagging
-    nltk.download('averaged_perceptron_tagger')
-    nltk.download('punkt')
+    nltk_resources.use_resources()  # NLTK packages are loaded from the shared data folder, never downloaded
 
     article_dfs = get_all_articles()  # Get all articles from the database
+    db = storage.get_connection()  # Shared connection to the database
+    store = token_store.TokenStore(db)  # Shared word and tag vocabularies
 
-    for df in article_dfs:
-        current_df_tags = []  # Each element is a json object containing a list of tagged words
-        for _, row in df.iterrows():
-            current_article_tags = []  # List to store the tagged words of the current article
-            text = row['content']  # Get the article's text
-            text_sentences = nltk.sent_tokenize(text)  # Split the text into sentences
-
-            for sentence in text_sentences:
-                tokenized_sentence = nltk.word_tokenize(sentence)  # Split the sentence into words
-                current_article_tags.extend(nltk.pos_tag(tokenized_sentence))  # Append tagged text to list as a tuple of (word, tag)
-            current_df_tags.append(json.dumps(current_article_tags))  # Append list of tagged words to the current_df_list
-        
-        assert len(current_df_tags) == len(df.index), "PoSTagger Error"  # Check that the list's length of tagged words is equal to the number of articles
-        df['PoSTags'] = current_df_tags  # Add the list of tagged words to the dataframe
-        # print(df)  # Print the dataframe to see the progress
+    with tagging_pool(workers) as pool:
+        for df in article_dfs:
+            current_df_tags = tag_texts(df['content'].tolist(), pool, chunk_size)  # Each element is a list of tagged words
+
+            assert len(current_df_tags) == len(df.index), "PoSTagger Error"  # Check that the list's length of tagged words is equal to the number of articles
+            with db:
+                df['PoSTags'] = store.encode(current_df_tags)  # Add the encoded lists of tagged words to the dataframe
+            # print(df)  # Print the dataframe to see the progress
     
     # Save the new dataframe to the database
-    db = sqlite3.connect(os.path.join(os.path.dirname(pathlib.Path(__file__).parent.resolve()) , "dataA", "db.sqlite3"))  # Establish connection to database
 
     for df, table in zip(article_dfs, DATABASE_TABLES):
         df.to_sql(table, db, if_exists='replace', index=False)  # Insert dataframe to database. Replace table if it exists
 
+def scaling_benchmark(worker_counts=(1, 2, 4, 8, 16), chunk_size=16):
+
+    """
+    Tag all articles of the database with every worker count and print the time and the speedup over the serial path.
+    Also checks that every worker count returns exactly the same tags as the serial path.
+    Return a dictionary {workers: seconds}.
+    """
+
+    nltk_resources.use_resources()
+    texts = [text for df in get_all_articles() for text in df['content'].tolist()]
+    timings = {}
+    serial_tags = None
+
+    for workers in worker_counts:
+        start_time = time.time()
+        with tagging_pool(workers) as pool:
+            tags = tag_texts(texts, pool, chunk_size)  # Pool start up (and model loading) is part of the measured time
+        timings[workers] = time.time() - start_time
+
+        if serial_tags is None:
+            serial_tags = tags
+        assert tags == serial_tags, "Parallel tagging differs from the serial path"
+        print("Workers: " + str(workers) + " | Articles: " + str(len(texts)) + " | Time: " + str(timings[workers]) + " seconds | Speedup: " + str(timings[worker_counts[0]] / timings[workers]))
+    return timings
+
 if __name__ == '__main__':
 
-    PoSTagger()
-    print("PoS Tagging finished successfully!")
+    if len(sys.argv) > 1 and sys.argv[1] == "benchmark":
+        scaling_benchmark()
+    else:
+        PoSTagger(workers=os.cpu_count())
+        print("PoS Tagging finished successfully!")
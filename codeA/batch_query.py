@@ -0,0 +1,109 @@
+import numpy as np
+import scipy.sparse as sp
+import storage
+
+class BatchQueryEngine:
+
+    """
+    BATCH QUERY SYSTEM.
+    Answer many queries at once with one sparse matrix product.
+    The tf-idf dictionary {lemma: {url: tf-idf, ...}} returned by inverted_index.lemmas_tf_idf is stored as a CSR lemma x document matrix.
+    A batch of queries is encoded as a CSR query x lemma matrix with a 1 for every query lemma, so (queries @ index)[q, d] is the
+    sum of the weights of the lemmas of query q in document d, which is exactly the total weight computed by query_answers.answer_query.
+    The lemmas of every query row are stored in query order (and duplicates are kept), so the floating point additions are done in
+    the same order as answer_query and the totals are bit for bit identical.
+    """
+
+    def __init__(self, tf_idf):
+        self.lemmas = sorted(tf_idf)
+        self.lemma_ids = {lemma: lemma_id for lemma_id, lemma in enumerate(self.lemmas)}
+        self.urls = sorted({url for postings in tf_idf.values() for url in postings})
+        url_to_doc_id = {url: doc_id for doc_id, url in enumerate(self.urls)}
+
+        # Build the lemma x document matrix row by row
+        indptr = np.zeros(len(self.lemmas) + 1, dtype=np.int64)
+        indices = []
+        data = []
+        for lemma_id, lemma in enumerate(self.lemmas):
+            postings = sorted((url_to_doc_id[url], weight) for url, weight in tf_idf[lemma].items())
+            indices.extend(doc_id for doc_id, _ in postings)
+            data.extend(weight for _, weight in postings)
+            indptr[lemma_id + 1] = len(indices)
+        self.matrix = sp.csr_matrix((np.array(data, dtype=np.float64), np.array(indices, dtype=np.int64), indptr), shape=(len(self.lemmas), len(self.urls)))
+
+        # IDF is <= 0 for lemmas found in (almost) every document. Scipy drops sums that are exactly 0 from a product,
+        # so in that case a second product with the sparsity pattern is needed to know which documents match a query
+        self.pattern = None
+        if (self.matrix.data <= 0).any():
+            self.pattern = self.matrix.copy()
+            self.pattern.data[:] = 1
+
+    @classmethod
+    def from_database(cls):
+
+        """
+        Build the engine from the postings tables saved by inverted_index.lemmas_tf_idf (see storage.save_postings).
+        """
+
+        return cls(storage.read_postings())
+
+    def encode_queries(self, queries):
+
+        """
+        Encode a list of queries (lists of lemmas) to a CSR query x lemma matrix. Lemmas that are not in the index are dropped.
+        Column indices are left in query order on purpose (see the class docstring).
+        """
+
+        indptr = np.zeros(len(queries) + 1, dtype=np.int64)
+        indices = []
+        for i, query in enumerate(queries):
+            indices.extend(self.lemma_ids[lemma] for lemma in (lemma.lower() for lemma in query) if lemma in self.lemma_ids)
+            indptr[i + 1] = len(indices)
+        data = np.ones(len(indices), dtype=np.float64)
+        return sp.csr_matrix((data, np.array(indices, dtype=np.int64), indptr), shape=(len(queries), len(self.lemmas)))
+
+    def score(self, queries):
+
+        """
+        Return the CSR query x document matrix of total weights.
+        Every document that contains a query lemma is stored, even if its total weight is 0.
+        """
+
+        encoded_queries = self.encode_queries(queries)
+        scores = (encoded_queries @ self.matrix).tocsr()
+        if self.pattern is None:
+            return scores
+
+        # Copy the scores into the structure of the pattern product. Missing entries are the zero sums
+        matches = (encoded_queries @ self.pattern).tocsr()
+        scores.sort_indices()
+        matches.sort_indices()
+        n_docs = len(self.urls)
+        score_keys = np.repeat(np.arange(len(queries), dtype=np.int64), np.diff(scores.indptr)) * n_docs + scores.indices
+        match_keys = np.repeat(np.arange(len(queries), dtype=np.int64), np.diff(matches.indptr)) * n_docs + matches.indices
+        positions = np.searchsorted(score_keys, match_keys)
+        found = positions < len(score_keys)
+        found[found] = score_keys[positions[found]] == match_keys[found]
+        matches.data = np.zeros(len(match_keys), dtype=np.float64)
+        matches.data[found] = scores.data[positions[found]]
+        return matches
+
+    def answer_queries(self, queries, top_k=None):
+
+        """
+        Answer a batch of queries. Return one list of (url, total weight) per query, in descending order of total weight.
+        Ties are broken by url, like query_answers.answer_query. If top_k is given only the top_k best urls of every query are kept.
+        The per row top-k is vectorized: all scores of the batch are sorted once by (query, -score, doc id).
+        """
+
+        scores = self.score(queries)
+        rows = np.repeat(np.arange(len(queries)), np.diff(scores.indptr))
+        order = np.lexsort((scores.indices, -scores.data, rows))
+        rank = np.arange(len(order)) - scores.indptr[rows[order]]  # Position of every entry inside its own row
+        if top_k is not None:
+            order = order[rank < top_k]
+
+        answers = [[] for _ in queries]
+        for row, doc_id, weight in zip(rows[order].tolist(), scores.indices[order].tolist(), scores.data[order].tolist()):
+            answers[row].append((self.urls[doc_id], weight))
+        return answers
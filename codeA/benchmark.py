@@ -0,0 +1,305 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+from itertools import accumulate
+import numpy as np
+import paths
+import storage
+import inverted_index
+import lemma_cache
+import instrumentation
+import main
+import query_answers
+
+STOP_WORDS = ["the", "of", "and", "to", "a", "in", "that", "is", "for", "on", "it", "with", "as", "was", "he", "be", "at", "by",
+              "this", "had", "from", "but", "not", "are", "or", "have", "they", "which", "his", "an", "were", "been", "has", "their", "said", "will"]
+CONSONANTS = "bcdfghjklmnprstvwz"
+VOWELS = "aeiou"
+
+"""
+BENCHMARK SUITE.
+Reproducible indexing and query benchmark that does not need a crawl:
+a synthetic news-like corpus (Zipfian vocabulary, sentences, log-normal article lengths) is generated offline in a scratch data folder
+and stored in the foxnews, aljazeera and bcc tables, the index is built stage by stage and queries of every length are timed.
+The result is a JSON document (build seconds per stage, query latency percentiles by query length) that can be compared across releases:
+    python benchmark.py run --documents 3000 --output results.json
+    python benchmark.py compare baseline.json results.json
+The same seed gives the same corpus and the same queries.
+"""
+
+def make_vocabulary(size, rng):
+
+    """
+    Return size distinct words, most frequent first: English stop words, then pronounceable made up words
+    (shorter ones tend to get the frequent ranks, like in real text).
+    """
+
+    words = list(STOP_WORDS[:size])
+    seen = set(words)
+
+    while len(words) < size:
+        syllables = 1 + min(4, int(rng.exponential(1.0 + len(words) / size * 2)))
+        word = "".join(rng.choice(list(CONSONANTS)) + rng.choice(list(VOWELS)) for _ in range(syllables))
+        if rng.random() < 0.3:
+            word += rng.choice(list(CONSONANTS))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+def generate_corpus(db_path, documents=3000, vocabulary_size=20000, zipf_exponent=1.1, mean_length=300, seed=0):
+
+    """
+    Generate a synthetic corpus and store it in the foxnews, aljazeera and bcc tables (title, url, content) of db_path,
+    like the crawlers do. Word ranks follow a Zipf law with zipf_exponent, article lengths (words) a log-normal law of mean mean_length.
+    Return a dictionary of corpus statistics.
+    """
+
+    rng = np.random.default_rng(seed)
+    words = np.array(make_vocabulary(vocabulary_size, rng), dtype=object)
+    cdf = np.cumsum(1.0 / np.arange(1, vocabulary_size + 1) ** zipf_exponent)
+    cdf /= cdf[-1]
+
+    lengths = np.maximum(20, rng.lognormal(np.log(mean_length) - 0.125, 0.5, documents)).astype(np.int64)  # sigma 0.5, mean mean_length
+    tokens = np.minimum(np.searchsorted(cdf, rng.random(int(lengths.sum()))), vocabulary_size - 1)  # Draw every word at once
+    ends = np.cumsum(lengths)
+    rows = {table: [] for table in inverted_index.DATABASE_TABLES}
+
+    for doc_id in range(documents):
+        doc_words = words[tokens[ends[doc_id] - lengths[doc_id]:ends[doc_id]]]
+        sentences, start = [], 0
+
+        while start < len(doc_words):
+            end = start + int(rng.integers(8, 26))  # Sentences of 8 to 25 words
+            sentence = " ".join(doc_words[start:end])
+            sentences.append(sentence[0].upper() + sentence[1:] + ".")
+            start = end
+
+        table = inverted_index.DATABASE_TABLES[doc_id % len(inverted_index.DATABASE_TABLES)]
+        title = " ".join(doc_words[:6]).capitalize()
+        rows[table].append((title, "https://synthetic.example/" + table + "/" + str(doc_id), " ".join(sentences)))
+
+    db = storage.connect(db_path)
+    with db:
+        for table in inverted_index.DATABASE_TABLES:
+            db.execute("DROP TABLE IF EXISTS " + table)
+            db.execute("CREATE TABLE " + table + " (title TEXT, url TEXT, content TEXT)")
+            db.executemany("INSERT INTO " + table + " VALUES (?, ?, ?)", rows[table])
+    db.close()
+
+    return {
+        'documents': documents,
+        'tokens': int(lengths.sum()),
+        'distinct_words': int(len(np.unique(tokens))),
+        'vocabulary_size': vocabulary_size,
+        'zipf_exponent': zipf_exponent,
+        'mean_length': mean_length,
+    }
+
+def benchmark_build(workers=1, chunk_size=500):
+
+    """
+    Build the index of the data folder with main.create_inverted_index, measuring every stage (see instrumentation.py).
+    Return {stage: seconds}, nested stages are named "<stage>.<nested stage>".
+    """
+
+    enabled_here = instrumentation.ACTIVE is None
+    run = instrumentation.enable() if enabled_here else instrumentation.ACTIVE
+    first_record = len(run.records)
+    try:
+        main.create_inverted_index(chunk_size=chunk_size, workers=workers)
+    finally:
+        if enabled_here:
+            instrumentation.disable()
+
+    stages = {}
+    for record in run.records[first_record:]:
+        for depth, stage_record in instrumentation.walk(record):
+            stages[record.name + "." + stage_record.name if depth else record.name] = stage_record.seconds
+    stages['total'] = sum(record.seconds for record in run.records[first_record:])
+    return stages
+
+def sample_queries(index, length, count, rng):
+
+    """
+    Return count queries of length distinct lemmas. Lemmas are drawn in proportion to their document frequency,
+    so queries hit common lemmas (long postings) as often as users do instead of the rare lemmas that dominate the lexicon.
+    """
+
+    lemmas_lexicon = index.lexicon
+    length = min(length, len(lemmas_lexicon))
+    cum_weights = list(accumulate(lemmas_lexicon.df))
+    queries = []
+
+    for _ in range(count):
+        query = []
+        while len(query) < length:
+            lemma = rng.choices(lemmas_lexicon.lemmas, cum_weights=cum_weights)[0]
+            if lemma not in query:
+                query.append(lemma)
+        queries.append(query)
+    return queries
+
+def latency_summary(latencies):
+
+    """
+    Percentiles, mean and throughput of a list of latencies in milliseconds.
+    """
+
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {
+        'queries': len(latencies),
+        'p50': float(p50),
+        'p95': float(p95),
+        'p99': float(p99),
+        'mean': float(np.mean(latencies)),
+        'queries_per_second': 1000 * len(latencies) / max(float(np.sum(latencies)), 1e-9),
+    }
+
+def benchmark_queries(index, query_lengths=(1, 2, 3, 4), queries_per_length=200, top_k=10, seed=0):
+
+    """
+    Time answer_query on the index for every query length, once ranking every matching url and once with top_k.
+    Return {query length: {"all": summary, "top_k": summary}}, latencies in milliseconds.
+    """
+
+    rng = random.Random(seed)
+    results = {}
+
+    for length in query_lengths:
+        queries = sample_queries(index, length, queries_per_length, rng)
+        results[str(length)] = {}
+
+        for mode, k in (("all", None), ("top_k", top_k)):
+            latencies = []
+            for query in queries:
+                start_time = time.perf_counter()
+                query_answers.answer_query(query, index, k, as_dataframe=False)
+                latencies.append((time.perf_counter() - start_time) * 1000)
+            results[str(length)][mode] = latency_summary(latencies)
+    return results
+
+def run_benchmark(data_dir=None, documents=3000, vocabulary_size=20000, zipf_exponent=1.1, mean_length=300, workers=1, chunk_size=500,
+                  query_lengths=(1, 2, 3, 4), queries_per_length=200, top_k=10, seed=0):
+
+    """
+    Generate a corpus in data_dir (a temporary folder, deleted afterwards, if None), build its index and time the queries.
+    Return the result dictionary.
+    """
+
+    temporary = data_dir is None
+    data_dir = tempfile.mkdtemp(prefix="nlp-benchmark-") if temporary else data_dir
+    os.makedirs(data_dir, exist_ok=True)
+    previous_data_dir = paths.DATA_DIR
+    paths.set_data_dir(data_dir)  # Every stage reads and writes the scratch folder, never dataA
+    lemma_cache.DEFAULT_CACHE = None  # Start cold, a cache warmed by an earlier run would make the runs incomparable
+
+    try:
+        corpus = generate_corpus(paths.data_path("db.sqlite3"), documents, vocabulary_size, zipf_exponent, mean_length, seed)
+        build = benchmark_build(workers, chunk_size)
+        index = main.read_binary_index()
+        queries = benchmark_queries(index, query_lengths, queries_per_length, top_k, seed)
+        corpus['lemmas'] = len(index.lexicon)
+    finally:
+        for snapshot_dir in [path for path in main.SNAPSHOTS if path.startswith(data_dir)]:
+            main.SNAPSHOTS.pop(snapshot_dir).close()
+        lemma_cache.DEFAULT_CACHE = None
+        storage.close_connections()  # The shared connections point to the scratch database
+        paths.set_data_dir(previous_data_dir)
+        if temporary:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    return {
+        'config': {'documents': documents, 'vocabulary_size': vocabulary_size, 'zipf_exponent': zipf_exponent, 'mean_length': mean_length,
+                   'workers': workers, 'chunk_size': chunk_size, 'query_lengths': list(query_lengths),
+                   'queries_per_length': queries_per_length, 'top_k': top_k, 'seed': seed},
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count(), 'numpy': np.__version__},
+        'corpus': corpus,
+        'build_seconds': build,
+        'query_latency_ms': queries,
+    }
+
+def flatten(result, prefix=""):
+
+    """
+    {"a": {"b": 1.0}} -> {"a.b": 1.0}, numbers only.
+    """
+
+    flat = {}
+    for key, value in result.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, prefix + key + "."))
+        elif isinstance(value, (int, float)):
+            flat[prefix + key] = value
+    return flat
+
+def compare_results(baseline, current, tolerance=0.10):
+
+    """
+    Compare two benchmark results. Return the regressions [(metric, baseline, current, relative change), ...]:
+    build times and latencies that grew, and throughputs that dropped, by more than tolerance.
+    """
+
+    old = flatten({'build_seconds': baseline['build_seconds'], 'query_latency_ms': baseline['query_latency_ms']})
+    new = flatten({'build_seconds': current['build_seconds'], 'query_latency_ms': current['query_latency_ms']})
+    regressions = []
+
+    for metric in sorted(old.keys() & new.keys()):
+        if metric.endswith(".queries") or old[metric] == 0:
+            continue
+        change = (new[metric] - old[metric]) / old[metric]
+        worse = change < -tolerance if metric.endswith("queries_per_second") else change > tolerance
+        if worse:
+            regressions.append((metric, old[metric], new[metric], change))
+    return regressions
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Indexing and query benchmark on a synthetic corpus")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="generate a corpus, build the index and time queries")
+    run_parser.add_argument("--documents", type=int, default=3000)
+    run_parser.add_argument("--vocabulary", type=int, default=20000)
+    run_parser.add_argument("--zipf", type=float, default=1.1)
+    run_parser.add_argument("--mean-length", type=int, default=300)
+    run_parser.add_argument("--workers", type=int, default=1)
+    run_parser.add_argument("--queries", type=int, default=200, help="queries per query length")
+    run_parser.add_argument("--top-k", type=int, default=10)
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--data-dir", default=None, help="keep the corpus and index in this folder instead of a temporary one")
+    run_parser.add_argument("--output", default=None, help="JSON file for the results (printed if not given)")
+
+    compare_parser = commands.add_parser("compare", help="list the regressions of a result against a baseline")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--tolerance", type=float, default=0.10)
+
+    args = parser.parse_args()
+
+    if args.command == "run":
+        result = run_benchmark(args.data_dir, args.documents, args.vocabulary, args.zipf, args.mean_length, args.workers,
+                               queries_per_length=args.queries, top_k=args.top_k, seed=args.seed)
+        if args.output is None:
+            print(json.dumps(result, indent=2, sort_keys=True))
+        else:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(result, f, indent=2, sort_keys=True)
+            print("Benchmark results saved to " + args.output)
+    else:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        with open(args.current, encoding="utf-8") as f:
+            current = json.load(f)
+
+        regressions = compare_results(baseline, current, args.tolerance)
+        for metric, old, new, change in regressions:
+            print(metric + ": " + str(round(old, 4)) + " -> " + str(round(new, 4)) + " (" + ("+" if change > 0 else "") + str(round(change * 100, 1)) + "%)")
+        print(str(len(regressions)) + " regressions")
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,344 @@
+import os
+import mmap
+import shutil
+import time
+import struct
+import numpy as np
+
+"""
+Binary on-disk format of the inverted index.
+All integers are little endian. Every section starts on an 8 byte boundary.
+
+    header              magic, format version, number of lemmas, number of documents, creation time (ns)
+    section table       byte offset of every section below
+    lemma offsets       uint64[n_lemmas + 1]  offsets of each lemma inside the lemma blob
+    lemma blob          utf-8 lemmas, sorted, concatenated
+    postings offsets    uint64[n_lemmas + 1]  offsets of each lemma's postings inside the postings arrays
+    doc offsets         uint64[n_docs + 1]    offsets of each url inside the doc blob
+    doc blob            utf-8 urls, concatenated. The position of a url is its doc id
+    postings doc ids    uint32[n_postings]    doc ids of every lemma, sorted by doc id
+    postings weights    float32[n_postings]   tf-idf weight of every posting
+    max weights         float32[n_lemmas]     highest weight of each lemma, upper bound used by top-k pruning
+"""
+
+MAGIC = b"NLPINDEX"
+FORMAT_VERSION = 2
+HEADER = struct.Struct("<8sIIIq")  # magic, version, n_lemmas, n_docs, created
+SECTIONS = ["lemma_offsets", "lemma_blob", "postings_offsets", "doc_offsets", "doc_blob", "doc_ids", "weights", "max_weights"]
+SECTION_TABLE = struct.Struct("<" + "Q" * len(SECTIONS))
+
+def _padding(position):
+
+    """
+    Number of bytes needed to move position to the next 8 byte boundary.
+    """
+
+    return (8 - position % 8) % 8
+
+def _strings_to_blob(strings):
+
+    """
+    Encode a list of strings to (offsets, blob). offsets[i]:offsets[i + 1] is the i-th string inside the blob.
+    """
+
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype="<u8")
+    offsets[1:] = np.cumsum([len(s) for s in encoded], dtype="<u8")
+    return offsets, b"".join(encoded)
+
+def write_binary_index(tf_idf, path, lexicon=None):
+
+    """
+    Save the inverted index {lemma: {url: tf-idf, ...}} to a binary file.
+    Lemmas are sorted so that a reader can binary search them, urls get integer doc ids and postings are stored as contiguous arrays.
+    If a lexicon.Lexicon is given, lemma ids are the lexicon's ids (the lexicon is sorted too) and its lemmas without postings get empty lists.
+    The file is written next to path and renamed at the end, so readers never see a half written index.
+    """
+
+    lemmas = lexicon.lemmas if lexicon is not None else sorted(tf_idf)
+    urls = sorted({url for postings in tf_idf.values() for url in postings})
+    url_to_doc_id = {url: doc_id for doc_id, url in enumerate(urls)}
+
+    writer = BinaryIndexWriter(path, urls)
+    for lemma in lemmas:
+        postings = sorted((url_to_doc_id[url], weight) for url, weight in tf_idf.get(lemma, {}).items())  # Postings sorted by doc id
+        writer.add(lemma, [doc_id for doc_id, _ in postings], [weight for _, weight in postings])
+    writer.close()
+
+class BinaryIndexWriter:
+
+    """
+    Streaming writer of a binary index, for indexes whose postings do not fit in memory (see spimi.py).
+    Call add() once per lemma, in sorted lemma order, then close(). Only the lemmas and urls are kept in memory: postings are
+    appended to two temporary files next to path and copied into the index when it is closed.
+    """
+
+    def __init__(self, path, urls):
+        self.path = path
+        self.urls = urls  # Sorted, the position of a url is its doc id
+        self.lemmas = []
+        self.postings_offsets = [0]
+        self.max_weights = []
+        self._doc_ids = open(path + ".doc_ids.tmp", "w+b")
+        self._weights = open(path + ".weights.tmp", "w+b")
+
+    def add(self, lemma, doc_ids, weights):
+
+        """
+        Append the postings of the next lemma: its doc ids, sorted, and their weights.
+        """
+
+        doc_ids = np.asarray(doc_ids, dtype="<u4")
+        weights = np.asarray(weights, dtype="<f4")
+        self.lemmas.append(lemma)
+        self.postings_offsets.append(self.postings_offsets[-1] + len(doc_ids))
+        self.max_weights.append(weights.max() if len(weights) else 0)
+        self._doc_ids.write(doc_ids.tobytes())
+        self._weights.write(weights.tobytes())
+
+    def close(self):
+
+        """
+        Write the index file and remove the temporary files.
+        """
+
+        lemma_offsets, lemma_blob = _strings_to_blob(self.lemmas)
+        doc_offsets, doc_blob = _strings_to_blob(self.urls)
+        sections = [
+            lemma_offsets.tobytes(),
+            lemma_blob,
+            np.array(self.postings_offsets, dtype="<u8").tobytes(),
+            doc_offsets.tobytes(),
+            doc_blob,
+            self._doc_ids,
+            self._weights,
+            np.array(self.max_weights, dtype="<f4").tobytes(),
+        ]
+
+        try:
+            write_sections(self.path, HEADER.pack(MAGIC, FORMAT_VERSION, len(self.lemmas), len(self.urls), time.time_ns()), sections)
+        finally:
+            for f in [self._doc_ids, self._weights]:
+                f.close()
+                os.remove(f.name)
+
+def _section_length(section):
+    if not hasattr(section, "read"):
+        return len(section)
+    section.flush()
+    return os.fstat(section.fileno()).st_size
+
+def write_sections(path, header, sections):
+
+    """
+    Write a file made of a header, a section table (uint64 offset of every section) and the sections, each starting on an 8 byte boundary.
+    A section is bytes or an open binary file, copied from its start.
+    The file is written next to path and renamed at the end.
+    """
+
+    # Compute the offset of every section
+    offsets = []
+    position = len(header) + 8 * len(sections)
+    for section in sections:
+        position += _padding(position)
+        offsets.append(position)
+        position += _section_length(section)
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(header)
+        f.write(struct.pack("<" + "Q" * len(offsets), *offsets))
+
+        for offset, section in zip(offsets, sections):
+            f.write(b"\0" * (offset - f.tell()))  # Alignment padding
+            if hasattr(section, "read"):
+                section.seek(0)
+                shutil.copyfileobj(section, f)
+            else:
+                f.write(section)
+    os.replace(tmp_path, path)  # Atomic rename
+
+class BinaryIndex:
+
+    """
+    Read only view of a binary inverted index. The file is memory mapped, only the pages that a query touches are read from disk.
+    Supports the subset of the dictionary interface that answer_query uses: lemma in index, index[lemma] -> {url: weight}.
+    If the lexicon.Lexicon written with the index is given, lemma ids are looked up in it (O(1)) instead of binary searched.
+    """
+
+    def __init__(self, path, lexicon=None):
+        self.path = path
+        self.lexicon = lexicon
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.n_lemmas, self.n_docs, self.created = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(path + " is not a binary inverted index")
+        if version != FORMAT_VERSION:
+            self.close()
+            raise ValueError("Unsupported index format version " + str(version) + ". Rebuild the inverted index")
+        if lexicon is not None and len(lexicon) != self.n_lemmas:
+            self.close()
+            raise ValueError("The lexicon does not belong to " + path)
+        offsets = dict(zip(SECTIONS, SECTION_TABLE.unpack_from(self._mm, HEADER.size)))
+
+        # Zero copy numpy views over the mapped file
+        self._lemma_offsets = np.frombuffer(self._mm, dtype="<u8", count=self.n_lemmas + 1, offset=offsets["lemma_offsets"])
+        self._lemma_blob = offsets["lemma_blob"]
+        self._postings_offsets = np.frombuffer(self._mm, dtype="<u8", count=self.n_lemmas + 1, offset=offsets["postings_offsets"])
+        self._doc_offsets = np.frombuffer(self._mm, dtype="<u8", count=self.n_docs + 1, offset=offsets["doc_offsets"])
+        self._doc_blob = offsets["doc_blob"]
+        n_postings = int(self._postings_offsets[-1])
+        self._doc_ids = np.frombuffer(self._mm, dtype="<u4", count=n_postings, offset=offsets["doc_ids"])
+        self._weights = np.frombuffer(self._mm, dtype="<f4", count=n_postings, offset=offsets["weights"])
+        self._max_weights = np.frombuffer(self._mm, dtype="<f4", count=self.n_lemmas, offset=offsets["max_weights"])
+
+    @property
+    def version(self):
+
+        """
+        Version of the index: its build time in nanoseconds. A rebuilt index always has a new version.
+        """
+
+        return self.created
+
+    def close(self):
+
+        """
+        Release the memory map. Arrays returned by postings() must not be used after closing.
+        """
+
+        self._lemma_offsets = self._postings_offsets = self._doc_offsets = self._doc_ids = self._weights = self._max_weights = None
+        if getattr(self, "_mm", None) is not None:
+            self._mm.close()
+            self._mm = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _lemma_bytes(self, lemma_id):
+        start = self._lemma_blob + int(self._lemma_offsets[lemma_id])
+        end = self._lemma_blob + int(self._lemma_offsets[lemma_id + 1])
+        return self._mm[start:end]
+
+    def _doc_bytes(self, doc_id):
+        start = self._doc_blob + int(self._doc_offsets[doc_id])
+        end = self._doc_blob + int(self._doc_offsets[doc_id + 1])
+        return self._mm[start:end]
+
+    def lemma(self, lemma_id):
+
+        """
+        Return the lemma with the given id.
+        """
+
+        return self._lemma_bytes(lemma_id).decode("utf-8")
+
+    def lemma_id(self, lemma):
+
+        """
+        Binary search the sorted lemma dictionary (or look up the lexicon). Return -1 if the lemma is not in the index.
+        """
+
+        if self.lexicon is not None:
+            return self.lexicon.id(lemma)
+
+        key = lemma.encode("utf-8")
+        low, high = 0, self.n_lemmas
+
+        while low < high:
+            middle = (low + high) // 2
+            if self._lemma_bytes(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low if low < self.n_lemmas and self._lemma_bytes(low) == key else -1
+
+    def url(self, doc_id):
+
+        """
+        Return the url of the given doc id.
+        """
+
+        return self._doc_bytes(doc_id).decode("utf-8")
+
+    def doc_id(self, url):
+
+        """
+        Binary search the doc table (urls are sorted). Return -1 if the url is not in the index.
+        """
+
+        key = url.encode("utf-8")
+        low, high = 0, self.n_docs
+
+        while low < high:
+            middle = (low + high) // 2
+            if self._doc_bytes(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low if low < self.n_docs and self._doc_bytes(low) == key else -1
+
+    def max_weight(self, lemma):
+
+        """
+        Return the highest weight in the postings of the lemma, 0 if the lemma is not in the index.
+        """
+
+        lemma_id = lemma if isinstance(lemma, (int, np.integer)) else self.lemma_id(lemma)
+        return float(self._max_weights[lemma_id]) if lemma_id >= 0 else 0.0
+
+    def weight(self, lemma, doc_id):
+
+        """
+        Return the weight of the lemma in the document, 0 if the document does not contain the lemma.
+        """
+
+        doc_ids, weights = self.postings(lemma)
+        position = int(np.searchsorted(doc_ids, doc_id))
+        return float(weights[position]) if position < len(doc_ids) and doc_ids[position] == doc_id else 0.0
+
+    def postings(self, lemma):
+
+        """
+        Return (doc_ids, weights) numpy arrays of the lemma, sorted by doc id. Both are empty if the lemma is not in the index.
+        """
+
+        lemma_id = lemma if isinstance(lemma, (int, np.integer)) else self.lemma_id(lemma)
+        if lemma_id < 0:
+            return self._doc_ids[:0], self._weights[:0]
+
+        start, end = int(self._postings_offsets[lemma_id]), int(self._postings_offsets[lemma_id + 1])
+        return self._doc_ids[start:end], self._weights[start:end]
+
+    def all_postings(self):
+
+        """
+        Return (postings offsets, doc ids, weights): the postings of every lemma, lemma_id's postings being
+        offsets[lemma_id]:offsets[lemma_id + 1]. Views of the mapped file, for whole index passes.
+        """
+
+        return self._postings_offsets, self._doc_ids, self._weights
+
+    def __contains__(self, lemma):
+        return self.lemma_id(lemma) >= 0
+
+    def __getitem__(self, lemma):
+        lemma_id = self.lemma_id(lemma)
+        if lemma_id < 0:
+            raise KeyError(lemma)
+
+        doc_ids, weights = self.postings(lemma_id)
+        return {self.url(doc_id): weight for doc_id, weight in zip(doc_ids.tolist(), weights.tolist())}
+
+    def __len__(self):
+        return self.n_lemmas
+
+    def __iter__(self):
+        return (self.lemma(lemma_id) for lemma_id in range(self.n_lemmas))
@@ -0,0 +1,279 @@
+import re
+import numpy as np
+import binary_index
+import storage
+
+OPERATORS = ["AND", "OR", "NOT"]  # Upper case only, lower case "and", "or" and "not" are ordinary (stop) words
+QUERY_TOKENS = re.compile(r"\(|\)|[^\s(),]+")  # Parenthesis or word. Commas only separate words
+
+"""
+BOOLEAN QUERIES.
+Queries with AND, OR, NOT and parentheses, for example
+    (election OR vote) AND minister NOT (sport OR football)
+NOT binds tighter than AND, AND binds tighter than OR. Words next to each other are ORed, like the lemmas of answer_query,
+and a NOT right after a word means AND NOT. Every word is analyzed with the query analyzer, a stop word matches everything (it is dropped).
+Queries are evaluated on the doc id sorted postings of the binary index. An AND starts from its shortest posting list and binary searches
+(numpy.searchsorted, the vectorized form of a galloping search) every candidate in the longer lists, so a selective conjunction
+costs about len(shortest list) * log(len(longest list)) and never builds the union. NOT is applied to the candidates the same way.
+Matching documents are ranked like answer_query: by the sum of the weights of the query lemmas that are not under a NOT.
+"""
+
+def has_operators(query):
+
+    """
+    Return True if the query text uses a boolean operator or parentheses.
+    """
+
+    return any(token in OPERATORS or token in "()" for token in QUERY_TOKENS.findall(query))
+
+class QueryParser:
+
+    """
+    Recursive descent parser of boolean queries. A parsed query is a tree of
+    ("term", lemma), ("and", [nodes]), ("or", [nodes]) and ("not", node) tuples, None for a query without lemmas.
+    """
+
+    def __init__(self, query, analyzer):
+        self.tokens = QUERY_TOKENS.findall(query)
+        self.position = 0
+        self.analyzer = analyzer
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def take(self):
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def parse(self):
+        node = self.parse_or()
+        if self.peek() is not None:
+            raise ValueError("Unexpected " + repr(self.peek()) + " in boolean query")
+        return node
+
+    def parse_or(self):
+        children = [self.parse_and()]
+        while self.peek() is not None and self.peek() != ")":
+            if self.peek() == "OR":
+                self.take()
+            children.append(self.parse_and())  # Words next to each other are ORed
+        return combine("or", children)
+
+    def parse_and(self):
+        children = [self.parse_not()]
+        while self.peek() in ("AND", "NOT"):
+            if self.peek() == "AND":
+                self.take()
+            children.append(self.parse_not())  # NOT right after a word means AND NOT
+        return combine("and", children)
+
+    def parse_not(self):
+        token = self.take()
+        if token is None or token in (")", "AND", "OR"):
+            raise ValueError("Missing word in boolean query")
+        if token == "NOT":
+            child = self.parse_not()
+            return ("not", child) if child is not None else None
+        if token == "(":
+            node = self.parse_or()
+            if self.take() != ")":
+                raise ValueError("Missing ) in boolean query")
+            return node
+        return combine("or", [("term", lemma) for lemma in self.analyzer.analyze(token)])
+
+def combine(operator, children):
+
+    """
+    Node of an AND or OR of children, without the children that have no lemmas (None if none is left).
+    """
+
+    children = [child for child in children if child is not None]
+    if not children:
+        return None
+    return children[0] if len(children) == 1 else (operator, children)
+
+def parse_query(query, analyzer):
+
+    """
+    Parse a boolean query text, every word is analyzed with analyzer (query_analyzer.QueryAnalyzer). Return the tree of QueryParser.
+    Raises ValueError if the query is malformed.
+    """
+
+    return QueryParser(query, analyzer).parse()
+
+def query_lemmas(node):
+
+    """
+    Lemmas of the query that are not under a NOT, in query order. These are the lemmas that rank the matching documents.
+    """
+
+    if node is None or node[0] == "not":
+        return []
+    if node[0] == "term":
+        return [node[1]]
+    return [lemma for child in node[1] for lemma in query_lemmas(child)]
+
+def intersect(doc_ids, other_doc_ids):
+
+    """
+    Intersection of two sorted doc id arrays, in O(len(shorter) * log(len(longer))).
+    """
+
+    if len(doc_ids) > len(other_doc_ids):
+        doc_ids, other_doc_ids = other_doc_ids, doc_ids
+    return doc_ids[contains(other_doc_ids, doc_ids)]
+
+def contains(doc_ids, candidates):
+
+    """
+    Boolean mask of the candidates (sorted) that are in doc_ids (sorted), found by binary search.
+    """
+
+    if len(doc_ids) == 0:
+        return np.zeros(len(candidates), dtype=bool)
+    positions = np.searchsorted(doc_ids, candidates)
+    return doc_ids[np.minimum(positions, len(doc_ids) - 1)] == candidates
+
+def sorted_postings(postings):
+
+    """
+    (urls, weights) arrays of a {url: weight} dictionary, sorted by url.
+    """
+
+    postings = sorted(postings.items())
+    return np.array([url for url, _ in postings], dtype=object), np.array([weight for _, weight in postings], dtype=np.float64)
+
+class PostingsDict(dict):
+
+    """
+    Dictionary index {lemma: {url: weight}} (main.read_xml) that sorts the postings of a lemma for boolean queries once, the first time
+    a query needs them, instead of in every query. Do not modify it once it is queried.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sorted = {}  # {lemma: (urls, weights)}
+
+    def sorted_postings(self, lemma):
+        if lemma not in self.sorted:
+            self.sorted[lemma] = sorted_postings(self.get(lemma, {}))
+        return self.sorted[lemma]
+
+class BooleanEvaluator:
+
+    """
+    Evaluates parsed queries on an index: a binary_index.BinaryIndex (doc ids), a dictionary {lemma: {url: weight}} (a PostingsDict
+    keeps its sorted postings between queries) or a storage.PostingsTable (urls, sorted).
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.binary = isinstance(index, binary_index.BinaryIndex)
+        self._all_docs = None
+        self._postings = {}  # {lemma: (doc ids, weights)} of the current query, every lemma is fetched once
+
+    def postings(self, lemma):
+
+        """
+        (doc ids, weights) of the lemma, sorted by doc id (by url on a dictionary index). Fetched once per query.
+        """
+
+        if lemma not in self._postings:
+            if self.binary:
+                self._postings[lemma] = self.index.postings(lemma)
+            elif isinstance(self.index, PostingsDict):
+                self._postings[lemma] = self.index.sorted_postings(lemma)
+            else:
+                self._postings[lemma] = sorted_postings(self.index.get(lemma, {}))
+        return self._postings[lemma]
+
+    def all_docs(self):
+
+        """
+        Every document of the index, needed only by a NOT without a positive side.
+        """
+
+        if self._all_docs is None:
+            if self.binary:
+                self._all_docs = np.arange(self.index.n_docs, dtype=np.uint32)
+            elif isinstance(self.index, storage.PostingsTable):
+                self._all_docs = np.array(self.index.urls(), dtype=object)  # One scan of the urls table
+            else:
+                self._all_docs = np.array(sorted({url for postings in self.index.values() for url in postings}), dtype=object)
+        return self._all_docs
+
+    def size(self, node):
+
+        """
+        Upper bound of the number of documents matching the node, known without evaluating it. Used to order AND operands.
+        """
+
+        if node[0] == "term":
+            if self.binary or node[1] in self._postings:
+                return len(self.postings(node[1])[0])  # A view of the mapped file, nothing is read
+            if isinstance(self.index, storage.PostingsTable):
+                return self.index.df(node[1])  # The postings are only read if the node is evaluated
+            return len(self.index.get(node[1], {}))
+        if node[0] == "and":
+            return min((self.size(child) for child in node[1] if child[0] != "not"), default=len(self.all_docs()))
+        if node[0] == "or":
+            return sum(self.size(child) for child in node[1])
+        return len(self.all_docs())
+
+    def evaluate(self, node):
+
+        """
+        Sorted array of the documents matching the node.
+        """
+
+        if node[0] == "term":
+            return self.postings(node[1])[0]
+        if node[0] == "not":
+            return self.exclude(self.all_docs(), self.evaluate(node[1]))
+        if node[0] == "or":
+            doc_ids = self.evaluate(node[1][0])
+            for child in node[1][1:]:
+                doc_ids = np.union1d(doc_ids, self.evaluate(child))
+            return doc_ids
+
+        # AND: start from the most selective operand, the candidates only shrink
+        positives = sorted((child for child in node[1] if child[0] != "not"), key=self.size)
+        negatives = [child[1] for child in node[1] if child[0] == "not"]
+        doc_ids = self.evaluate(positives[0]) if positives else self.all_docs()
+        for child in positives[1:]:
+            if len(doc_ids) == 0:
+                break
+            doc_ids = intersect(doc_ids, self.evaluate(child))
+        for child in negatives:
+            if len(doc_ids) == 0:
+                break
+            doc_ids = self.exclude(doc_ids, self.evaluate(child))
+        return doc_ids
+
+    def exclude(self, doc_ids, excluded):
+        return doc_ids[~contains(excluded, doc_ids)]
+
+    def answer(self, node, top_k=None):
+
+        """
+        Return the matching documents [(url, total weight), ...] by descending weight, only the top_k best if given.
+        """
+
+        if node is None:
+            return []
+
+        try:
+            doc_ids = self.evaluate(node)
+            scores = np.zeros(len(doc_ids))
+            for lemma in query_lemmas(node):
+                lemma_doc_ids, weights = self.postings(lemma)  # Already fetched by evaluate
+                found = contains(lemma_doc_ids, doc_ids)
+                scores[found] += weights[np.searchsorted(lemma_doc_ids, doc_ids[found])]
+        finally:
+            self._postings = {}  # The next query may run on a newer index
+
+        order = np.argsort(-scores, kind="stable")  # Ties stay in doc id (url) order
+        if top_k is not None:
+            order = order[:top_k]
+        return [(self.index.url(doc_ids[i]) if self.binary else doc_ids[i], float(scores[i])) for i in order]
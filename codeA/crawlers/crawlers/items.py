@@ -7,6 +7,11 @@ import scrapy
 
 
 class CrawlersItem(scrapy.Item):
-    # define the fields for your item here like:
-    # name = scrapy.Field()
-    pass
+
+    """
+    A crawled article. Saved to the table named after the spider by CrawlersPipeline.
+    """
+
+    title = scrapy.Field()
+    url = scrapy.Field()
+    content = scrapy.Field()
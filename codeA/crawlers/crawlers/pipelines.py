@@ -3,11 +3,108 @@
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 
-
-# useful for handling different item types with a single interface
+import os
+import sys
+import time
+import logging
 from itemadapter import ItemAdapter
+from twisted.internet import task
+
+CODE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # codeA, whatever the working directory
+if CODE_DIR not in sys.path:
+    sys.path.append(CODE_DIR)
+import paths
+import storage
+
+ARTICLE_COLUMNS = ["title", "url", "content"]
+logger = logging.getLogger(__name__)
 
 
 class CrawlersPipeline:
-    def process_item(self, item, spider):
+
+    """
+    Save the articles (CrawlersItem) of a spider to the table named after it, as they arrive.
+    Articles are buffered and written in one transaction per batch: when ARTICLES_BATCH_SIZE articles are waiting
+    and at least every ARTICLES_FLUSH_INTERVAL seconds. A crash loses at most one batch.
+    Writes are upserts keyed on the url: a crawled url is inserted once and updated when its title or content changed,
+    so the articles of earlier crawls stay in the table and the derived columns of unchanged articles are kept.
+    """
+
+    def __init__(self, batch_size=50, flush_interval=5.0, database_path=None, crawler=None):
+        self.crawler = crawler
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.database_path = database_path if database_path is not None else paths.data_path(storage.DATABASE_FILE)
+        self.pending = []  # Tuples of (title, url, content) not written yet
+        self.saved = 0
+        self.last_flush = time.time()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings.getint("ARTICLES_BATCH_SIZE", 50), crawler.settings.getfloat("ARTICLES_FLUSH_INTERVAL", 5.0), crawler.settings.get("ARTICLES_DATABASE"), crawler)
+
+    def open_spider(self, spider=None):  # Newer Scrapy versions no longer pass the spider
+        spider = spider if spider is not None else self.crawler.spider
+        os.makedirs(os.path.dirname(self.database_path), exist_ok=True)
+        self.table = spider.name
+        self.db = storage.connect(self.database_path)  # WAL and busy timeout: index builds can read and write while the spider writes
+
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS " + self.table + " (title TEXT, url TEXT, content TEXT)")
+            # Tables written before the upserts can hold the same url twice, keep the last one like the indexers do
+            self.db.execute("DELETE FROM " + self.table + " WHERE rowid NOT IN (SELECT MAX(rowid) FROM " + self.table + " GROUP BY url)")
+            self.db.execute("CREATE UNIQUE INDEX IF NOT EXISTS " + self.table + "_url ON " + self.table + " (url)")
+
+        self.start_timer()
+
+    def start_timer(self):
+
+        """
+        Flush every flush_interval seconds, so a slow crawl is saved even when no batch fills up.
+        """
+
+        self.timer = task.LoopingCall(self.flush)
+        self.timer.start(self.flush_interval, now=False).addErrback(self.flush_failed)
+
+    def flush_failed(self, failure):
+
+        """
+        A flush that raises stops its LoopingCall. Log the error and start a new timer: the articles stay pending for the next flush.
+        """
+
+        logger.error("Could not save the pending articles to " + self.table + ", retrying in " + str(self.flush_interval) + " seconds",
+                     exc_info=(failure.type, failure.value, failure.getTracebackObject()))
+        self.start_timer()
+
+    def close_spider(self, spider=None):
+        spider = spider if spider is not None else self.crawler.spider
+        if self.timer.running:
+            self.timer.stop()
+        self.flush()
+        self.db.close()
+        spider.logger.info("Saved " + str(self.saved) + " articles to " + self.table)
+
+    def process_item(self, item, spider=None):
+        adapter = ItemAdapter(item)
+        self.pending.append(tuple(adapter.get(column) for column in ARTICLE_COLUMNS))
+
+        if len(self.pending) >= self.batch_size or time.time() - self.last_flush >= self.flush_interval:
+            self.flush()
         return item
+
+    def flush(self):
+
+        """
+        Write the pending articles in one transaction.
+        """
+
+        self.last_flush = time.time()
+        if not self.pending:
+            return
+
+        with self.db:
+            self.db.executemany("INSERT INTO " + self.table + " (title, url, content) VALUES (?, ?, ?) "
+                                "ON CONFLICT (url) DO UPDATE SET title = excluded.title, content = excluded.content "
+                                "WHERE title IS NOT excluded.title OR content IS NOT excluded.content", self.pending)
+        self.saved += len(self.pending)
+        self.pending = []
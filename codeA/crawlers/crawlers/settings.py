@@ -62,9 +62,11 @@ ROBOTSTXT_OBEY = True
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
-#ITEM_PIPELINES = {
-#    'crawlers.pipelines.CrawlersPipeline': 300,
-#}
+ITEM_PIPELINES = {
+    'crawlers.pipelines.CrawlersPipeline': 300,
+}
+ARTICLES_BATCH_SIZE = 50  # Articles written per transaction
+ARTICLES_FLUSH_INTERVAL = 5.0  # Seconds, pending articles are written at least this often
 
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
@@ -1,8 +1,7 @@
 import os
 import errno
-import sqlite3
 import scrapy
-import pandas as pd
+from crawlers.items import CrawlersItem
 
 def clean_html(html_file):
 
@@ -33,7 +32,6 @@ class FoxNewsSpider(scrapy.Spider):
     """
 
     name = "foxnews"
-    cleaned_articles = []  # Tuples of (article_title, article_url, article_text) to save them in database
     start_urls = [
         'https://www.foxnews.com/',
     ]
@@ -60,7 +58,7 @@ class FoxNewsSpider(scrapy.Spider):
     def parse_article(self, respone):
 
         """
-        Save the article's html and append tuple of (article_title, article_url, article_text) to self.cleaned_articles.
+        Save the article's html and yield the article (CrawlersItem), saved to the database by crawlers.pipelines.CrawlersPipeline.
         """
         
         title = respone.meta.get('article_title')  # Title of the article
@@ -75,22 +73,7 @@ class FoxNewsSpider(scrapy.Spider):
         with open(os.path.join(filename, f"{count}.html"), "wb") as f:
             f.write(respone.body)
        
-        # Append tuple of (article_title, article_url, article_text) to list of cleaned articles only if title and content are not empty
+        # Yield the article only if title and content are not empty
         content = clean_html(respone)
         if title and content:
-            self.cleaned_articles.append((title, url, content))
-
-    def closed(self, reason):
-
-        """
-        Save tuples of (article_title, article_url, article_text) to database.
-        """
-
-        # Create folder if it doesn't exist and save the html file. Works for both Windows and Linux
-        filename = os.path.join(os.path.dirname(os.path.dirname(os.getcwd())), "dataA", "")
-        create_folder(filename)
-
-        db = sqlite3.connect(os.path.join(filename, "db.sqlite3"))  # Establish connection to database
-
-        df = pd.DataFrame(self.cleaned_articles, columns=['title', 'url', 'content'])  # Create dataframe of cleaned articles
-        df.to_sql('foxnews', db, if_exists='replace', index=False)  # Insert dataframe to database. Replace table if it exists
+            yield CrawlersItem(title=title, url=url, content=content)
@@ -0,0 +1,202 @@
+import re
+import zlib
+import numpy as np
+import storage
+import instrumentation
+
+DATABASE_TABLES = ["foxnews", "aljazeera", "bcc"]
+WORDS = re.compile(r"\w+")
+SHINGLE_SIZE = 5  # Words per shingle
+NUM_PERM = 128  # MinHash functions, the signature length
+BANDS = 16  # LSH bands of NUM_PERM // BANDS rows: articles agreeing on one whole band are compared
+THRESHOLD = 0.8  # Estimated Jaccard similarity of the shingles from which two articles are near-duplicates
+PRIME = 4294967291  # Largest prime below 2 ** 32, signatures fit in uint32
+SEED = 1  # Hash functions are fixed, signatures are the same on every run
+MAX_BUCKET = 64  # Larger LSH buckets are compared to their first article only instead of pairwise
+
+"""
+NEAR-DUPLICATE DETECTION.
+Wire-service stories are syndicated almost word for word across sources and the same page is crawled under several urls.
+Before tagging, find_duplicates compares every article of the crawl tables with MinHash signatures: the article's text is cut into
+shingles of SHINGLE_SIZE words, and for each of NUM_PERM hash functions h(x) = (a * x + b) mod PRIME the signature keeps the smallest
+hash of any shingle. Two signatures agree on a position with probability equal to the Jaccard similarity of the shingle sets.
+LSH banding splits the signatures into BANDS bands and groups the articles whose band is identical, so only articles sharing a
+bucket are compared (no pairwise pass over the collection). Pairs whose signatures agree on THRESHOLD of the positions are
+near-duplicates; clusters are their connected components.
+One canonical article per cluster is indexed (the longest, then the first crawled). The others are listed in the duplicates table
+    duplicates (url, source, canonical_url, similarity)
+which pipeline.run_pipeline and incremental_index.update_inverted_index skip.
+"""
+
+def shingle_hashes(content):
+
+    """
+    Distinct 32 bit hashes of the SHINGLE_SIZE word shingles of a text (one shingle if it is shorter). Return (hashes, number of words,
+    number of distinct words).
+    """
+
+    words = WORDS.findall(content.lower())
+    if not words:
+        return np.zeros(0, dtype=np.uint64), 0, 0
+
+    word_hashes = np.array([zlib.crc32(word.encode("utf-8")) for word in words], dtype=np.uint64)
+    size = min(SHINGLE_SIZE, len(word_hashes))
+    hashes = np.zeros(len(word_hashes) - size + 1, dtype=np.uint64)
+    for i in range(size):  # Polynomial hash of the words of each shingle, modulo 2 ** 32
+        hashes = (hashes * np.uint64(1000003) + word_hashes[i:len(word_hashes) - size + 1 + i]) & np.uint64(0xFFFFFFFF)
+    return np.unique(hashes), len(words), len(set(words))
+
+def hash_functions(num_perm=NUM_PERM, seed=SEED):
+
+    """
+    (a, b) uint64 arrays of the MinHash functions h(x) = (a * x + b) mod PRIME.
+    """
+
+    rng = np.random.RandomState(seed)
+    return rng.randint(1, PRIME, size=num_perm).astype(np.uint64), rng.randint(0, PRIME, size=num_perm).astype(np.uint64)
+
+def minhash(hashes, a, b):
+
+    """
+    MinHash signature (uint32[num_perm]) of a set of 32 bit shingle hashes. a * x + b stays below 2 ** 64, no overflow.
+    """
+
+    return ((a[:, None] * hashes[None, :] + b[:, None]) % np.uint64(PRIME)).min(axis=1).astype(np.uint32)
+
+def candidate_buckets(signatures, bands=BANDS):
+
+    """
+    Yield the arrays of row numbers of the signatures that share a whole band, for every band.
+    """
+
+    rows = signatures.shape[1] // bands
+    for band in range(bands):
+        keys = np.ascontiguousarray(signatures[:, band * rows:(band + 1) * rows]).view(np.dtype((np.void, rows * 4))).ravel()
+        _, bucket_of, bucket_sizes = np.unique(keys, return_inverse=True, return_counts=True)
+        bucket_of = bucket_of.ravel()
+        order = np.argsort(bucket_of, kind="stable")
+        ends = np.cumsum(bucket_sizes)
+        for bucket in np.flatnonzero(bucket_sizes > 1).tolist():
+            yield order[ends[bucket] - bucket_sizes[bucket]:ends[bucket]]
+
+def find_root(parents, i):
+    while parents[i] != i:
+        parents[i] = parents[parents[i]]  # Path halving
+        i = parents[i]
+    return i
+
+def cluster(signatures, threshold=THRESHOLD, bands=BANDS):
+
+    """
+    Cluster near-duplicate signatures with LSH banding and union find.
+    Return (parents, similarities): the cluster of row i is find_root(parents, i), similarities[i] the best similarity found for row i.
+    """
+
+    parents = list(range(len(signatures)))
+    similarities = np.zeros(len(signatures))
+
+    for members in candidate_buckets(signatures, bands):
+        if len(members) <= MAX_BUCKET:  # Every pair of the bucket
+            agreement = (signatures[members][:, None, :] == signatures[members][None, :, :]).mean(axis=2)
+            np.fill_diagonal(agreement, 0)
+            pairs = np.argwhere(np.triu(agreement) >= threshold)
+        else:  # Exact copies land in one big bucket, they all agree with its first article
+            agreement = (signatures[members] == signatures[members[0]]).mean(axis=1)[None, :]
+            pairs = np.array([(0, j) for j in np.flatnonzero(agreement[0] >= threshold).tolist() if j != 0], dtype=np.int64).reshape(-1, 2)
+
+        for i, j in pairs.tolist():
+            similarity = agreement[i, j]
+            first, second = int(members[i]), int(members[j])
+            similarities[first] = max(similarities[first], similarity)
+            similarities[second] = max(similarities[second], similarity)
+            root_first, root_second = find_root(parents, first), find_root(parents, second)
+            if root_first != root_second:
+                parents[max(root_first, root_second)] = min(root_first, root_second)
+    return parents, similarities
+
+def create_duplicates_table(db):
+
+    """
+    Create the duplicates table if it doesn't exist.
+    """
+
+    db.execute("CREATE TABLE IF NOT EXISTS duplicates (url TEXT PRIMARY KEY, source TEXT, canonical_url TEXT, similarity REAL)")
+
+def clear_duplicates(db=None):
+
+    """
+    Forget the duplicates of the last detection: every article is indexed again.
+    """
+
+    db = db if db is not None else storage.get_connection()
+    with db:
+        create_duplicates_table(db)
+        db.execute("DELETE FROM duplicates")
+
+def find_duplicates(threshold=THRESHOLD, bands=BANDS, num_perm=NUM_PERM):
+
+    """
+    Detect the near-duplicate articles of the crawl tables and save them to the duplicates table (replacing the previous detection).
+    Return a report {documents, clusters, duplicates, words, words_skipped, distinct_words_skipped}: words_skipped is the tagging
+    work saved (words that are not PoS tagged) and distinct_words_skipped estimates the postings that are not added to the index.
+    """
+
+    db = storage.get_connection()  # Shared connection to the database
+    a, b = hash_functions(num_perm)
+    articles = []  # (source, url, number of words, number of distinct words)
+    signatures = []  # Signatures of the articles with at least one word. Empty texts are never duplicates
+    signature_rows = []  # Article of every signature
+
+    with instrumentation.stage("minhash") as record:
+        for table in DATABASE_TABLES:
+            for url, content in db.execute("SELECT url, content FROM " + table + " ORDER BY rowid"):
+                hashes, words, distinct_words = shingle_hashes(content or "")
+                if len(hashes):
+                    signatures.append(minhash(hashes, a, b))
+                    signature_rows.append(len(articles))
+                articles.append((table, url, words, distinct_words))
+        record.add(documents=len(articles))
+    signatures = np.array(signatures, dtype=np.uint32).reshape(len(signature_rows), num_perm)
+
+    with instrumentation.stage("lsh"):
+        parents, signature_similarities = cluster(signatures, threshold, bands)
+
+    clusters = {}  # {root: [row, ...]}
+    similarities = np.zeros(len(articles))
+    for i, row in enumerate(signature_rows):
+        clusters.setdefault(find_root(parents, i), []).append(row)
+        similarities[row] = signature_similarities[i]
+
+    duplicates = []  # Rows of the duplicates table
+    canonical_urls = set()
+    for rows in clusters.values():
+        canonical = max(rows, key=lambda row: (articles[row][2], -row))  # Longest, then first crawled
+        canonical_urls.add(articles[canonical][1])
+        duplicates.extend((articles[row][1], articles[row][0], articles[canonical][1], float(similarities[row])) for row in rows if articles[row][1] != articles[canonical][1])
+    duplicates = {url: (url, source, canonical_url, similarity) for url, source, canonical_url, similarity in duplicates if url not in canonical_urls}  # A url indexed anywhere is never skipped
+
+    with db:
+        create_duplicates_table(db)
+        db.execute("DELETE FROM duplicates")
+        db.executemany("INSERT INTO duplicates VALUES (?, ?, ?, ?)", duplicates.values())
+
+    skipped_urls = set(duplicates)
+    return {
+        'documents': len(articles),
+        'clusters': sum(1 for rows in clusters.values() if len(rows) > 1),
+        'duplicates': sum(1 for article in articles if article[1] in skipped_urls),
+        'words': sum(article[2] for article in articles),
+        'words_skipped': sum(article[2] for article in articles if article[1] in skipped_urls),
+        'distinct_words_skipped': sum(article[3] for article in articles if article[1] in skipped_urls),
+    }
+
+def report(summary):
+
+    """
+    One line presentation of the report of find_duplicates.
+    """
+
+    share = summary['words_skipped'] / summary['words'] if summary['words'] else 0
+    return ("Near-duplicates: " + str(summary['duplicates']) + " of " + str(summary['documents']) + " articles skipped in " + str(summary['clusters'])
+            + " clusters | Words not tagged: " + str(summary['words_skipped']) + " (" + str(round(100 * share, 2)) + "%)"
+            + " | Postings not indexed (estimate): " + str(summary['distinct_words_skipped']))
@@ -0,0 +1,251 @@
+import hashlib
+import itertools
+import json
+import time
+import nltk_resources
+import PosTagger
+import preprocessing
+import inverted_index
+import pipeline
+import lemma_cache
+import lexicon
+import storage
+import token_store
+import dedup
+
+DATABASE_TABLES = ["foxnews", "aljazeera", "bcc"]
+
+"""
+INCREMENTAL INDEXING SYSTEM.
+The state of the last build is kept in three tables next to the articles:
+    index_documents (url, source, content_hash, length, PoSTags_cleaned, lemmas_count)  one row per indexed article (PoSTags_cleaned as a token_store blob)
+    index_postings (lemma, url, count)  raw lemma counts of every indexed article
+    index_lemmas (lemma, df, cf)  number of indexed articles containing the lemma and its number of occurrences
+After a crawl, update_inverted_index compares the urls and content hashes of the articles tables with index_documents.
+Only new and changed articles go through PoS tagging, preprocessing and lemmatization. Their postings and the document
+frequencies are updated in place, deleted articles are removed the same way.
+The postings tables store tf = count / length per posting and df per lemma, the idf = log(N / (1 + df)) is applied when they
+are read (see storage.py), so a change of N does not rewrite the weights: apply_changes writes the rows of the changed articles,
+of their lemmas and of their derived columns in the articles tables, nothing else.
+Two steps still read the whole corpus: find_changes hashes every article to find what changed, and the snapshot, whose binary
+index stores final float32 weights in url order (the MaxScore bounds and tie order rely on it), is written again from the
+postings tables, one lemma at a time (inverted_index.postings_to_binary).
+"""
+
+def content_hash(content):
+
+    """
+    Hash of an article's text. Used to find articles whose content changed since the last build.
+    """
+
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+def create_state_tables(db):
+
+    """
+    Create the state tables if they don't exist.
+    """
+
+    db.execute("CREATE TABLE IF NOT EXISTS index_documents (url TEXT PRIMARY KEY, source TEXT, content_hash TEXT, length INTEGER, PoSTags_cleaned BLOB, lemmas_count TEXT)")
+    db.execute("CREATE TABLE IF NOT EXISTS index_postings (lemma TEXT, url TEXT, count INTEGER, PRIMARY KEY (lemma, url))")
+    db.execute("CREATE INDEX IF NOT EXISTS index_postings_url ON index_postings (url)")
+    db.execute("CREATE TABLE IF NOT EXISTS index_lemmas (lemma TEXT PRIMARY KEY, df INTEGER, cf INTEGER)")
+    if "cf" not in [column for _, column, *_ in db.execute("PRAGMA table_info(index_lemmas)")]:  # State recorded before cf was kept
+        with db:
+            db.execute("ALTER TABLE index_lemmas ADD COLUMN cf INTEGER")
+            db.execute("UPDATE index_lemmas SET cf = (SELECT SUM(p.count) FROM index_postings p WHERE p.lemma = index_lemmas.lemma)")
+
+def add_document(db, url, source, article_hash, cleaned_postags_blob, lemmas):
+
+    """
+    Add an article to the state tables and increase the document and collection frequencies of its lemmas.
+    cleaned_postags_blob is its PoSTags_cleaned encoded by token_store.TokenStore.
+    """
+
+    db.execute("INSERT OR REPLACE INTO index_documents VALUES (?, ?, ?, ?, ?, ?)", (url, source, article_hash, token_store.length(cleaned_postags_blob), cleaned_postags_blob, json.dumps(lemmas)))
+    db.executemany("INSERT INTO index_postings VALUES (?, ?, ?)", [(lemma, url, count) for lemma, count in lemmas.items()])
+    db.executemany("INSERT INTO index_lemmas VALUES (?, 1, ?) ON CONFLICT (lemma) DO UPDATE SET df = df + 1, cf = cf + excluded.cf", lemmas.items())
+
+def remove_document(db, url):
+
+    """
+    Remove an article from the state tables and decrease the document and collection frequencies of its lemmas.
+    Return the list of its lemmas.
+    """
+
+    counts = db.execute("SELECT lemma, count FROM index_postings WHERE url = ?", (url,)).fetchall()
+    db.executemany("UPDATE index_lemmas SET df = df - 1, cf = cf - ? WHERE lemma = ?", [(count, lemma) for lemma, count in counts])
+    db.executemany("DELETE FROM index_lemmas WHERE lemma = ? AND df <= 0", [(lemma,) for lemma, _ in counts])
+    db.execute("DELETE FROM index_postings WHERE url = ?", (url,))
+    db.execute("DELETE FROM index_documents WHERE url = ?", (url,))
+    return [lemma for lemma, _ in counts]
+
+def record_state():
+
+    """
+    Record the state of a full build (main.create_inverted_index) from the derived columns of the articles tables,
+    so that the next update_inverted_index only processes what changed after it.
+    """
+
+    db = storage.get_connection()  # Shared connection to the database
+    create_state_tables(db)
+    articles_dfs = inverted_index.get_all_articles()  # Read before the write transaction starts
+
+    documents = {}  # {url: row of index_documents}. The same url can appear twice, keep the last one like lemmas_tf_idf does
+    for df, table in zip(articles_dfs, DATABASE_TABLES):
+        for url, content, cleaned_postags_blob, lemmas_count in zip(df['url'], df['content'], df['PoSTags_cleaned'], df['lemmas_count']):
+            if not isinstance(lemmas_count, str):  # Near-duplicate skipped by the build (see dedup.py)
+                continue
+            documents.pop(url, None)
+            documents[url] = (url, table, content_hash(content), token_store.length(cleaned_postags_blob), cleaned_postags_blob, lemmas_count)
+
+    with db:  # One transaction, the tables are bulk loaded and the document frequencies counted once
+        db.execute("DELETE FROM index_documents")
+        db.execute("DELETE FROM index_postings")
+        db.execute("DELETE FROM index_lemmas")
+        db.executemany("INSERT INTO index_documents VALUES (?, ?, ?, ?, ?, ?)", documents.values())
+        db.executemany("INSERT INTO index_postings VALUES (?, ?, ?)", ((lemma, url, count) for url, _, _, _, _, lemmas_count in documents.values()
+                                                                       for lemma, count in json.loads(lemmas_count).items()))
+        db.execute("INSERT INTO index_lemmas SELECT lemma, COUNT(*), SUM(count) FROM index_postings GROUP BY lemma")
+
+def find_changes(db):
+
+    """
+    Compare the articles tables with index_documents.
+    Return (current, new, changed, deleted). current is a dictionary {url: (table, content hash, rowid)} of all articles in the tables
+    but the near-duplicates of the duplicates table (see dedup.py), new, changed and deleted are lists of urls.
+    """
+
+    dedup.create_duplicates_table(db)
+    current = {}
+    for table in DATABASE_TABLES:
+        for rowid, url, content in db.execute("SELECT rowid, url, content FROM " + table + " WHERE url NOT IN (SELECT url FROM duplicates)"):
+            current[url] = (table, content_hash(content), rowid)
+
+    indexed = dict(db.execute("SELECT url, content_hash FROM index_documents"))
+    new = [url for url in current if url not in indexed]
+    changed = [url for url in current if url in indexed and indexed[url] != current[url][1]]
+    deleted = [url for url in indexed if url not in current]
+    return current, new, changed, deleted
+
+def restore_derived_columns(db, current, urls):
+
+    """
+    After a crawl (or a table replaced by an older crawler), the PoSTags_cleaned and lemmas_count columns of new and changed articles are
+    missing or stale. Copy them back from index_documents for the given urls (rows found by rowid, see find_changes), so that the tables
+    look like the ones of a full build. The rows of the other articles are not written.
+    """
+
+    for table in DATABASE_TABLES:
+        pipeline.ensure_columns(db, table, pipeline.OUTPUT_COLUMNS)
+    for url in urls:
+        table, _, rowid = current[url]
+        db.execute("UPDATE " + table + " SET " + ", ".join(column + " = (SELECT d." + column + " FROM index_documents d WHERE d.url = ?)" for column in pipeline.OUTPUT_COLUMNS) + " WHERE rowid = ?",
+                   [url] * len(pipeline.OUTPUT_COLUMNS) + [rowid])
+
+def document_tf(db, url):
+
+    """
+    Return {lemma: tf} of an indexed article, tf = count / length like the tf part of inverted_index.tf_idf_weight.
+    """
+
+    length = db.execute("SELECT length FROM index_documents WHERE url = ?", (url,)).fetchone()[0]
+    return {lemma: count / length for lemma, count in db.execute("SELECT lemma, count FROM index_postings WHERE url = ?", (url,))}
+
+def write_state_postings(db):
+
+    """
+    Rewrite the postings tables from the state tables, one scan of index_postings. Used when they do not store tf values yet
+    (first update, or tables saved by an older build), later updates only apply deltas (storage.update_postings).
+    """
+
+    urls = [url for url, in db.execute("SELECT url FROM index_documents WHERE url IN (SELECT url FROM index_postings) ORDER BY url")]
+    url_to_doc_id = {url: doc_id for doc_id, url in enumerate(urls)}
+    lemma_df = dict(db.execute("SELECT lemma, df FROM index_lemmas"))
+    query = "SELECT p.lemma, p.url, p.count, d.length FROM index_postings p JOIN index_documents d ON d.url = p.url ORDER BY p.lemma"
+
+    def lemma_postings():
+        for lemma, rows in itertools.groupby(db.execute(query), key=lambda row: row[0]):
+            yield lemma, lemma_df[lemma], sorted((url_to_doc_id[url], count / length) for _, url, count, length in rows)
+
+    storage.write_postings(urls, lemma_postings(), db, db.execute("SELECT COUNT(*) FROM index_documents").fetchone()[0])
+
+def apply_changes(db, current, removed, added):
+
+    """
+    Apply a change of the articles to the state tables, the postings tables and the derived columns of the articles tables,
+    inside the caller's transaction. removed is a list of urls (changed and deleted articles), added a dictionary
+    {url: (PoSTags_cleaned blob, {lemma: count})} of new and changed articles, current the first result of find_changes.
+    Only the rows of these articles and of their lemmas are written.
+    """
+
+    touched = set()
+    for url in removed:
+        touched.update(remove_document(db, url))
+    for url, (cleaned_postags_blob, lemmas) in added.items():
+        add_document(db, url, current[url][0], current[url][1], cleaned_postags_blob, lemmas)
+        touched.update(lemmas)
+
+    if storage.has_tf_postings(db):  # Otherwise update_inverted_index rewrites them once, after the transaction
+        lemma_df = {lemma: 0 for lemma in touched}
+        lemma_df.update(db.execute("SELECT lemma, df FROM index_lemmas WHERE lemma IN (" + ", ".join("?" * len(touched)) + ")", list(touched)))
+        articles_count = db.execute("SELECT COUNT(*) FROM index_documents").fetchone()[0]
+        storage.update_postings(removed, {url: document_tf(db, url) for url in added}, lemma_df, articles_count, db)
+    restore_derived_columns(db, current, added)
+
+def state_lexicon(db):
+
+    """
+    Build the lexicon (lemma ids, df, cf) from the state tables.
+    """
+
+    lemma_df, lemma_cf = {}, {}
+    for lemma, df, cf in db.execute("SELECT lemma, df, cf FROM index_lemmas"):
+        lemma_df[lemma] = df
+        lemma_cf[lemma] = cf
+    return lexicon.Lexicon.from_counts(lemma_df, lemma_cf)
+
+def update_inverted_index(xml_export=False, positional=False, scorers=None, deduplicate=False):
+
+    """
+    Update the inverted index after a crawl, running the NLP stages only for new and changed articles.
+    The updated index is published as a new snapshot, with the xml file if xml_export is set, the positional index if positional is set
+    and the scoring files if scorers is set (see inverted_index.inverted_to_binary).
+    Near-duplicates found by the last detection are not indexed. Set deduplicate to detect them again first (dedup.find_duplicates):
+    indexed articles that became duplicates are removed like deleted articles.
+    The first run (no state yet) processes every article. Return a storage.PostingsTable, the dictionary view of the updated index.
+    """
+
+    stop_words = nltk_resources.stop_words()  # NLTK packages are loaded from the shared data folder, never downloaded
+    lemmatizer = lemma_cache.get_lemma_cache()  # WordNet lemmatizer behind a (word, tag) cache
+
+    db = storage.get_connection()  # Shared connection to the database
+    create_state_tables(db)
+    store = token_store.TokenStore(db)  # Shared word and tag vocabularies
+
+    update_start = time.time()
+    if deduplicate:
+        print(dedup.report(dedup.find_duplicates()))
+    current, new, changed, deleted = find_changes(db)
+
+    with db:  # One transaction, a failed update leaves the previous state untouched
+        added = {}
+        for url in new + changed:
+            table, _, rowid = current[url]
+            content = db.execute("SELECT content FROM " + table + " WHERE rowid = ?", (rowid,)).fetchone()[0]
+            postags = PosTagger.tag_text(content)
+            cleaned_postags = preprocessing.clean_postags(postags, stop_words)
+            added[url] = (store.encode([cleaned_postags])[0], preprocessing.count_lemmas(cleaned_postags, lemmatizer))
+        apply_changes(db, current, changed + deleted, added)
+
+    if not storage.has_tf_postings(db):
+        write_state_postings(db)
+    inverted_index.postings_to_binary(state_lexicon(db), xml_export, positional, scorers)
+    lemmatizer.save()  # Keep the cache for the next run
+
+    print("Incremental update: " + str(len(new)) + " new, " + str(len(changed)) + " changed, " + str(len(deleted)) + " deleted articles in " + str(time.time() - update_start) + " seconds")
+    return storage.PostingsTable()
+
+if __name__ == "__main__":
+    update_inverted_index()
+    print("Inverted index updated!")
@@ -0,0 +1,264 @@
+import sys
+import json
+import time
+import cProfile
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows: no peak RSS
+    resource = None
+
+ACTIVE = None  # Instrumentation of this process, None when instrumentation is off. Set by enable
+PROFILE_MODES = [None, "cprofile", "tracemalloc"]
+
+"""
+INSTRUMENTATION.
+Per stage measurements of the index build. Code marks its stages with
+    with instrumentation.stage("tagging") as record:
+        ...
+        record.add(documents=len(chunk), tokens=tokens)
+When instrumentation is off (the default) stage returns a shared no-op context manager, the only cost is a function call.
+When it is on (enable), every stage records wall and CPU seconds, documents and tokens (and their rate per second),
+the peak RSS of the process and of its finished worker processes, and for top level stages and stages entered with io=True
+the bytes read and written (database reads and writes, from /proc/self/io, Linux only).
+Stages can be nested, a nested stage entered several times (once per chunk for example) adds up into one record. Every top level stage is appended as one JSON line to the metrics file.
+The optional profile modes capture a cProfile file per top level stage, or the peak of Python allocations and the top allocation
+sites with tracemalloc. Both slow the build down, use them to find a slow stage, not to time it.
+"""
+
+def peak_rss_bytes(who=None):
+
+    """
+    Peak resident set size of this process (or of its finished child processes if who is resource.RUSAGE_CHILDREN), None if unknown.
+    """
+
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF if who is None else who).ru_maxrss
+    return maxrss if sys.platform == "darwin" else maxrss * 1024  # Bytes on macOS, kilobytes elsewhere
+
+def io_bytes():
+
+    """
+    (read bytes, written bytes) of this process so far, through read and write calls (so including cached database pages).
+    (None, None) when the system does not report it.
+    """
+
+    try:
+        with open("/proc/self/io") as f:
+            counters = dict(line.split(": ") for line in f.read().splitlines())
+        return int(counters['rchar']), int(counters['wchar'])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+class StageRecord:
+
+    """
+    Measurements of one stage. Nested stages are kept in children by name.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.documents = 0
+        self.tokens = 0
+        self.read_bytes = None
+        self.write_bytes = None
+        self.extra = {}  # Profile results
+        self.children = {}
+
+    def add(self, documents=0, tokens=0):
+        self.documents += documents
+        self.tokens += tokens
+
+    def as_dict(self):
+        record = {
+            'stage': self.name,
+            'calls': self.calls,
+            'seconds': self.seconds,
+            'cpu_seconds': self.cpu_seconds,
+            'documents': self.documents,
+            'tokens': self.tokens,
+            'documents_per_second': self.documents / self.seconds if self.seconds else 0.0,
+            'tokens_per_second': self.tokens / self.seconds if self.seconds else 0.0,
+            'read_bytes': self.read_bytes,
+            'write_bytes': self.write_bytes,
+        }
+        record.update(self.extra)
+        if self.children:
+            record['stages'] = [child.as_dict() for child in self.children.values()]
+        return record
+
+class NullStage:
+
+    """
+    Stage and record used when instrumentation is off. Does nothing.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def add(self, documents=0, tokens=0):
+        pass
+
+NULL_STAGE = NullStage()
+
+class Instrumentation:
+
+    """
+    Collects the stage records of a run and writes them to metrics_path (JSON lines), if given.
+    profile is None, "cprofile" (a <metrics file>.<stage>.prof file per top level stage, open it with pstats or snakeviz)
+    or "tracemalloc" (Python allocation peak and top allocation sites per top level stage).
+    """
+
+    def __init__(self, metrics_path=None, profile=None):
+        if profile not in PROFILE_MODES:
+            raise ValueError("profile must be one of " + str(PROFILE_MODES))
+        self.metrics_path = metrics_path
+        self.profile = profile
+        self.stack = []  # Records of the stages being run, outermost first
+        self.records = []  # Finished top level records
+        self.started = time.perf_counter()
+
+        if profile == "tracemalloc" and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name, io=False):
+        parent = self.stack[-1].children if self.stack else None
+        record = parent.get(name) if parent is not None else None
+        if record is None:
+            record = StageRecord(name)
+            if parent is not None:
+                parent[name] = record
+
+        top_level = not self.stack
+        profiler = None
+        if top_level and self.profile == "cprofile":
+            profiler = cProfile.Profile()
+            profiler.enable()
+        elif top_level and self.profile == "tracemalloc":
+            tracemalloc.reset_peak()
+
+        self.stack.append(record)
+        read_start, write_start = io_bytes() if io or top_level else (None, None)
+        cpu_start = time.process_time()
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record.seconds += time.perf_counter() - start
+            record.cpu_seconds += time.process_time() - cpu_start
+            record.calls += 1
+            if read_start is not None:
+                read_end, write_end = io_bytes()
+                record.read_bytes = (record.read_bytes or 0) + read_end - read_start
+                record.write_bytes = (record.write_bytes or 0) + write_end - write_start
+            self.stack.pop()
+
+            if top_level:
+                if profiler is not None:
+                    profiler.disable()
+                    record.extra['profile'] = self.profile_path(name)
+                    profiler.dump_stats(record.extra['profile'])
+                elif self.profile == "tracemalloc":
+                    record.extra['python_peak_bytes'] = tracemalloc.get_traced_memory()[1]
+                    record.extra['top_allocations'] = [str(statistic) for statistic in tracemalloc.take_snapshot().statistics("lineno")[:5]]
+                self.finish(record)
+
+    def profile_path(self, name):
+        return (self.metrics_path if self.metrics_path is not None else "metrics") + "." + name + ".prof"
+
+    def finish(self, record):
+
+        """
+        Complete a top level record with memory figures and write it to the metrics file.
+        """
+
+        record.extra['peak_rss_bytes'] = peak_rss_bytes()
+        record.extra['children_peak_rss_bytes'] = peak_rss_bytes(resource.RUSAGE_CHILDREN) if resource is not None else None
+        record.extra['time'] = time.time()
+        self.records.append(record)
+        self.write(record.as_dict())
+
+    def write(self, entry):
+        if self.metrics_path is not None:
+            with open(self.metrics_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+
+    def summary(self):
+
+        """
+        Return the summary of the run: total seconds and the seconds of every top level stage.
+        """
+
+        return {
+            'stage': 'summary',
+            'seconds': time.perf_counter() - self.started,
+            'stages': {record.name: record.seconds for record in self.records},
+            'peak_rss_bytes': peak_rss_bytes(),
+        }
+
+    def report(self):
+
+        """
+        Human readable table of the top level stages and their nested stages.
+        """
+
+        lines = []
+        for record in self.records:
+            for depth, stage_record in walk(record):
+                line = "  " * depth + stage_record.name + ": " + str(round(stage_record.seconds, 3)) + " s"
+                if stage_record.documents:
+                    line += ", " + str(round(stage_record.documents / max(stage_record.seconds, 1e-9))) + " documents/s"
+                if stage_record.tokens:
+                    line += ", " + str(round(stage_record.tokens / max(stage_record.seconds, 1e-9))) + " tokens/s"
+                lines.append(line)
+        return "\n".join(lines)
+
+def walk(record, depth=0):
+    yield depth, record
+    for child in record.children.values():
+        yield from walk(child, depth + 1)
+
+def enable(metrics_path=None, profile=None):
+
+    """
+    Turn instrumentation on for this process. Return the Instrumentation.
+    """
+
+    global ACTIVE
+    ACTIVE = Instrumentation(metrics_path, profile)
+    return ACTIVE
+
+def disable():
+
+    """
+    Turn instrumentation off, write the summary line and return the Instrumentation (None if it was off).
+    """
+
+    global ACTIVE
+    instrumentation, ACTIVE = ACTIVE, None
+    if instrumentation is not None:
+        instrumentation.write(instrumentation.summary())
+        if instrumentation.profile == "tracemalloc":
+            tracemalloc.stop()
+    return instrumentation
+
+def stage(name, io=False):
+
+    """
+    Context manager measuring a stage, see the module docstring. A no-op when instrumentation is off.
+    Set io to count the bytes read and written by a nested stage (top level stages always count them).
+    """
+
+    if ACTIVE is None:
+        return NULL_STAGE
+    return ACTIVE.stage(name, io)
@@ -1,10 +1,18 @@
 import os
-import pathlib
-import sqlite3
 import json
 import math
-from xml.dom import minidom
+from xml.sax.saxutils import escape
 import pandas as pd
+import binary_index
+import lexicon
+import snapshot
+import positional_index
+import scoring
+import term_index
+import instrumentation
+import storage
+import token_store
+import paths
 
 DATABASE_TABLES = ["foxnews", "aljazeera", "bcc"]
 
@@ -16,7 +24,7 @@ def get_all_articles():
     Get all articles from the database.
     """
 
-    db = sqlite3.connect(os.path.join(os.path.dirname(pathlib.Path(__file__).parent.resolve()) , "dataA", "db.sqlite3"))  # Establish connection to database
+    db = storage.get_connection()  # Shared connection to the database
     
     fox_news_df = pd.read_sql("SELECT * FROM " + DATABASE_TABLES[0], db)  # Get all articles from the table fox_news
     aljazeera_df = pd.read_sql("SELECT * FROM " + DATABASE_TABLES[1], db)  # Get all articles from the table aljazeera
@@ -44,39 +52,41 @@ def count_docs_containing_lemmas():
                     to_return[lemma] = 1
     return to_return
 
-def test_lemmas_count():
+def tf_idf_weight(lemma_count, document_length, articles_count, lemma_document_count):
 
     """
-    Ensure that tf_idf_dict has as many lemmas as the database
+    TF-IDF weight of a lemma in a document.
+    lemma_count: occurrences of the lemma in the document, document_length: length of the document's PoSTags_cleaned list,
+    articles_count: total number of documents, lemma_document_count: number of documents containing the lemma.
     """
 
-    df = lemmas_tf_idf()
-    lemmas_count_1 = len(df.index)
-    lemmas_count_2 = len(count_docs_containing_lemmas())
-    assert lemmas_count_1 == lemmas_count_2, "Lemmas count are not equal"
+    return (lemma_count / document_length) * (math.log(articles_count / (1 + lemma_document_count)))
 
-def lemmas_tf_idf():
+def lemmas_tf_idf(lemma_in_docs_counter=None):
 
     """
     INVERTED INDEX SYSTEM.
     Run spiders first in order for the database to be populated.
     Then run PoSTagger and Then run preprocessing.
     For every lemma, calculate the tf-idf score and save the infomration to the database.
-    Create new table lemmas. Save tuples (lemma, {doc_id: tf-idf, ...}) to the table.
+    Save the postings (lemma, url, tf-idf) to the lemmas, urls and postings tables (see storage.py).
     TF = (Number of times the word appears in the document) / (Total number of words in the document)
     IDF = log(Total number of documents / Number of documents containing the word)
     We already know the number of documents, the number of times the word appears in each document and the total number of words in each document.
-    The total number of words in each document is equal to the length of PoSTags_cleaned list.
+    The total number of words in each document is equal to the length of PoSTags_cleaned list (token_store.length, nothing is decoded).
     We have only to calculate the Number of documents containing each lemma.
+    lemma_in_docs_counter can be passed if it is already known (pipeline.run_pipeline counts it), otherwise it is counted here.
     """
     
     articles_dfs = get_all_articles()  # Get all articles from the database
 
     # Data needed for tf-idf
     articles_count = len(articles_dfs[0].index) + len(articles_dfs[1].index) + len(articles_dfs[2].index)  # Total number of articles
-    lemma_in_docs_counter = count_docs_containing_lemmas()  # Dictionary {lemma: Number of documents containing lemma}
+    if lemma_in_docs_counter is None:
+        lemma_in_docs_counter = count_docs_containing_lemmas()  # Dictionary {lemma: Number of documents containing lemma}
 
     tf_idf = {}  # Dictionary {lemma: {doc_id: tf-idf, ...}}
+    tf = {}  # Dictionary {lemma: {doc_id: tf, ...}} saved to the postings tables, which apply the idf when reading
 
     for df in articles_dfs:
         for _, row in df.iterrows():
@@ -85,54 +95,192 @@ def lemmas_tf_idf():
             for lemma in lemmas:
                 if lemma not in tf_idf:
                     tf_idf[lemma] = {}  # Create new dictionary for lemma if lemma is not in tf_idf yet
-                
-                # Add tf-idf score to the dictionary for the specific document
-                tf_idf[lemma][row['url']] = (lemmas[lemma] / len(json.loads(row['PoSTags_cleaned']))) * (math.log(articles_count / (1 + lemma_in_docs_counter[lemma])))
-    
-    # Convert tf_idf dictionary to a list of tuples [(lemma, {doc_id: tf-idf, ...}), ...] in order to save it to the database
-    dict_items = tf_idf.items()
-    tf_idf_list = list(dict_items)
-    tf_idf_list = [(lemma, json.dumps(tf_idf)) for lemma, tf_idf in tf_idf_list]
+                    tf[lemma] = {}
 
-    db = sqlite3.connect(os.path.join(os.path.dirname(pathlib.Path(__file__).parent.resolve()) , "dataA", "db.sqlite3"))  # Establish connection to database
+                # Add tf-idf score to the dictionary for the specific document
+                tf_idf[lemma][row['url']] = tf_idf_weight(lemmas[lemma], token_store.length(row['PoSTags_cleaned']), articles_count, lemma_in_docs_counter[lemma])
+                tf[lemma][row['url']] = lemmas[lemma] / token_store.length(row['PoSTags_cleaned'])
 
-    df = pd.DataFrame(tf_idf_list, columns=['lemma', 'tf_idf'])  # Create dataframe of cleaned articles
-    df.to_sql('lemmas', db, if_exists='replace', index=False)  # Insert dataframe to database. Replace table if it exists
+    db = storage.get_connection()  # Shared connection to the database
+    storage.save_postings(tf, db, lemma_in_docs_counter, articles_count)
 
     return tf_idf  # Return list of tuples [(lemma, {doc_id: tf-idf, ...}), ...] to save it as xml file
 
-def inverted_to_xml():
+def lemmas_tf_idf_from_stats():
+
+    """
+    INVERTED INDEX SYSTEM, fast path after pipeline.run_pipeline.
+    Same weights as lemmas_tf_idf, but the number of articles, the document lengths and the document frequencies are read from the
+    doc_stats and lemma_df tables written during lemmatization. Building the index is one pass over the postings
+    (the lemmas_count of every article), every json column is decoded once and no other column is loaded.
+    """
+
+    db = storage.get_connection()  # Shared connection to the database
+
+    articles_count = db.execute("SELECT COUNT(*) FROM doc_stats").fetchone()[0]  # Total number of articles
+    lemma_in_docs_counter = dict(db.execute("SELECT lemma, df FROM lemma_df"))  # Dictionary {lemma: Number of documents containing lemma}
+    tf_idf = {}  # Dictionary {lemma: {doc_id: tf-idf, ...}}
+    tf = {}  # Dictionary {lemma: {doc_id: tf, ...}} saved to the postings tables, which apply the idf when reading
+
+    for table in DATABASE_TABLES:
+        query = "SELECT d.url, d.token_count, t.lemmas_count FROM doc_stats d JOIN " + table + " t ON t.rowid = d.source_rowid WHERE d.source = ? ORDER BY d.doc_id"
+        for url, token_count, lemmas_count in db.execute(query, (table,)):
+            for lemma, count in json.loads(lemmas_count).items():
+                if lemma not in tf_idf:
+                    tf_idf[lemma] = {}  # Create new dictionary for lemma if lemma is not in tf_idf yet
+                    tf[lemma] = {}
+                tf_idf[lemma][url] = tf_idf_weight(count, token_count, articles_count, lemma_in_docs_counter[lemma])
+                tf[lemma][url] = count / token_count
+
+    storage.save_postings(tf, db, lemma_in_docs_counter, articles_count)
+    return tf_idf
+
+def lexicon_from_stats():
 
     """
-    Saves the inverted index to an xml file.
+    Build the lexicon (lemma ids, df, cf) from the lemma_df table written by pipeline.run_pipeline.
     """
 
-    xml_path = os.path.join(os.path.dirname(pathlib.Path(__file__).parent.resolve()) , "dataA", "inverted_index.xml")
-    lemmas_tf_idf_dict = lemmas_tf_idf()  # Get the list of tuples [(lemma, {doc_id: tf-idf, ...}), ...] from the database
+    db = storage.get_connection()  # Shared connection to the database
+    lemma_df, lemma_cf = {}, {}
+
+    for lemma, df, cf in db.execute("SELECT lemma, df, cf FROM lemma_df"):
+        lemma_df[lemma] = df
+        lemma_cf[lemma] = cf
+    return lexicon.Lexicon.from_counts(lemma_df, lemma_cf)
+
+def inverted_to_binary(lemmas_tf_idf_dict=None, lemmas_lexicon=None, xml_export=False, positional=False, scorers=None):
+
+    """
+    Publishes the inverted index as a new snapshot (see snapshot.py): a binary file that can be memory mapped by
+    binary_index.BinaryIndex, its lexicon and, if xml_export is set, the xml file, with the files of publish_snapshot.
+    Return the path of the snapshot.
+    If lemmas_tf_idf_dict is not given, it is computed with lemmas_tf_idf().
+    If lemmas_lexicon is not given, it is built from lemmas_tf_idf_dict (without collection frequencies).
+    """
+
+    if lemmas_tf_idf_dict is None:
+        lemmas_tf_idf_dict = lemmas_tf_idf()  # Get the dictionary {lemma: {doc_id: tf-idf, ...}}
+    if lemmas_lexicon is None:
+        lemmas_lexicon = lexicon.Lexicon.from_tf_idf(lemmas_tf_idf_dict)
+
+    staging_dir = snapshot.create_staging()
+    with instrumentation.stage("binary_index", io=True):
+        binary_index.write_binary_index(lemmas_tf_idf_dict, os.path.join(staging_dir, snapshot.INDEX_FILE), lemmas_lexicon)
+        lemmas_lexicon.save(os.path.join(staging_dir, snapshot.LEXICON_FILE))
+    if xml_export:
+        with instrumentation.stage("xml", io=True):
+            inverted_to_xml(lemmas_tf_idf_dict, os.path.join(staging_dir, snapshot.XML_FILE))
+    return publish_snapshot(staging_dir, lemmas_lexicon, positional, scorers)
+
+def postings_to_binary(lemmas_lexicon, xml_export=False, positional=False, scorers=None):
+
+    """
+    Publishes the postings tables (see storage.py) as a new snapshot, with the same files as inverted_to_binary.
+    The binary index and the xml file are streamed one lemma at a time (storage.PostingsTable.items), the whole index is never in memory.
+    lemmas_lexicon holds the lemmas of the tables. Return the path of the snapshot.
+    """
+
+    postings_table = storage.PostingsTable()
+    urls = postings_table.urls()  # Sorted, the binary index has its own doc ids
+    url_to_doc_id = {url: doc_id for doc_id, url in enumerate(urls)}
+
+    staging_dir = snapshot.create_staging()
+    with instrumentation.stage("binary_index", io=True):
+        index_writer = binary_index.BinaryIndexWriter(os.path.join(staging_dir, snapshot.INDEX_FILE), urls)
+        xml_writer = XmlWriter(os.path.join(staging_dir, snapshot.XML_FILE)) if xml_export else None
+        for lemma, postings in postings_table.items():
+            kept = sorted((url_to_doc_id[url], weight) for url, weight in postings.items())  # Postings sorted by doc id
+            index_writer.add(lemma, [doc_id for doc_id, _ in kept], [weight for _, weight in kept])
+            if xml_writer is not None:
+                xml_writer.add(lemma, [(urls[doc_id], weight) for doc_id, weight in kept])
+        index_writer.close()
+        if xml_writer is not None:
+            xml_writer.close()
+        lemmas_lexicon.save(os.path.join(staging_dir, snapshot.LEXICON_FILE))
+    return publish_snapshot(staging_dir, lemmas_lexicon, positional, scorers)
 
-    root = minidom.Document()  # Create file
-    xml = root.createElement('inverted_index')  # Create root element
-    root.appendChild(xml) 
+def publish_snapshot(staging_dir, lemmas_lexicon, positional=False, scorers=None):
 
+    """
+    Complete a staging snapshot that holds the binary index and its lexicon, and publish it. Adds the trigram index of the lexicon
+    (see term_index.py), if positional is set the positional index (see positional_index.py) built from the PoSTags_cleaned columns and,
+    if scorers is a list of scorer names (scoring.SCORERS, can be empty), the scoring files (counts, document norms and lengths,
+    see scoring.py) with impact ordered postings for every listed scorer. Return the path of the snapshot.
+    """
+
+    with instrumentation.stage("term_index", io=True):
+        term_index.write_term_index(lemmas_lexicon.lemmas, os.path.join(staging_dir, snapshot.TERM_INDEX_FILE))
+    if positional:
+        with instrumentation.stage("positional_index", io=True):
+            positional_index.build_positional_index(os.path.join(staging_dir, snapshot.POSITIONAL_FILE))
+    if scorers is not None:
+        with instrumentation.stage("scoring", io=True):
+            scoring.build_scoring_index(staging_dir, lemmas_lexicon, scorers)
+    return snapshot.publish(staging_dir)
+
+def xml_attribute(value):
+
+    """
+    Quoted and escaped xml attribute value, as minidom writes it.
+    """
+
+    return '"' + escape(value, {'"': "&quot;"}) + '"'
+
+class XmlWriter:
+
+    """
+    Streaming writer of the xml file, one lemma at a time: nothing but the current lemma is kept in memory.
+    Writes the same file as minidom's toprettyxml(indent="\t") of the <inverted_index> document.
+    """
+
+    def __init__(self, xml_path):
+        self.xml_path = xml_path
+        self.empty = True
+        self.f = open(xml_path + ".tmp", "w", encoding="utf-8")
+        self.f.write('<?xml version="1.0" ?>\n')
+
+    def add(self, lemma, postings):
+
+        """
+        Write a lemma and its postings [(url, tf-idf), ...].
+        """
+
+        if self.empty:
+            self.f.write("<inverted_index>\n")
+            self.empty = False
+        if not postings:
+            self.f.write("\t<lemma name=" + xml_attribute(lemma) + "/>\n")
+            return
+
+        self.f.write("\t<lemma name=" + xml_attribute(lemma) + ">\n")
+        for url, weight in postings:
+            self.f.write("\t\t<document id=" + xml_attribute(url) + " weight=" + xml_attribute(str(weight)) + "/>\n")
+        self.f.write("\t</lemma>\n")
+
+    def close(self):
+        self.f.write("<inverted_index/>\n" if self.empty else "</inverted_index>\n")
+        self.f.close()
+        os.replace(self.xml_path + ".tmp", self.xml_path)  # Readers of the old file never see a half-written one
+
+def inverted_to_xml(lemmas_tf_idf_dict=None, xml_path=None):
+
+    """
+    Saves the inverted index to an xml file, inverted_index.xml in the data folder if xml_path is not given.
+    If lemmas_tf_idf_dict is not given, it is computed with lemmas_tf_idf().
+    """
+
+    if xml_path is None:
+        xml_path = paths.data_path("inverted_index.xml")
+
+    if lemmas_tf_idf_dict is None:
+        lemmas_tf_idf_dict = lemmas_tf_idf()  # Get the list of tuples [(lemma, {doc_id: tf-idf, ...}), ...] from the database
+
+    writer = XmlWriter(xml_path)
     for lemma in lemmas_tf_idf_dict:
-        lemma_child = root.createElement('lemma')  # Create child element
-        lemma_child.setAttribute('name', lemma)  # Set name attribute
-
-        # Add all documents containing the lemma
-        for doc in lemmas_tf_idf_dict[lemma]:
-            doc_child = root.createElement('document')  # create child element
-            doc_child.setAttribute('id', doc)  # Set id attribute (url)
-            doc_child.setAttribute('weight', str(lemmas_tf_idf_dict[lemma][doc]))  # Set weight (tf-idf) attribute
-            xml.appendChild(lemma_child)  # append child to parent
-            lemma_child.appendChild(doc_child)  # append child to parent
-        xml.appendChild(lemma_child)  # append child to parent
-
-    xml_str = root.toprettyxml(indent ="\t")
-    
-    with open(xml_path, "w", encoding="utf-8") as f:
-        f.write(xml_str)
+        writer.add(lemma, lemmas_tf_idf_dict[lemma].items())  # All documents containing the lemma
+    writer.close()
 
 if __name__ == "__main__":
-    # test_lemmas_count()  # Test lemmas_tf_idf()
-    inverted_to_xml()
-    print("Inverted index saved to xml file and to the database!")
\ No newline at end of file
+    inverted_to_binary()
+    print("Inverted index snapshot published and saved to the database!")
\ No newline at end of file
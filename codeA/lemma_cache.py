@@ -0,0 +1,107 @@
+import os
+import json
+from collections import OrderedDict
+import nltk
+import paths
+
+CACHE_FILE = "lemma_cache.json"  # In the data folder (paths.py)
+DEFAULT_CACHE = None  # Cache shared by indexing and query preprocessing. Created by get_lemma_cache
+
+class LemmaCache:
+
+    """
+    LEMMATIZATION CACHE.
+    Bounded (word, PoS) -> lemma cache in front of the WordNet lemmatizer. News text repeats the same (word, tag) pairs
+    all the time, so most lookups never reach WordNet. When the cache is full the least recently used pair is evicted.
+    Has the same lemmatize(word, pos) method as nltk.stem.WordNetLemmatizer, so it can be used anywhere a lemmatizer is.
+    """
+
+    def __init__(self, maxsize=200000, path=None, lemmatizer=None):
+        self.maxsize = maxsize
+        self.path = path
+        self.lemmatizer = lemmatizer if lemmatizer is not None else nltk.stem.WordNetLemmatizer()
+        self.cache = OrderedDict()  # {(word, pos): lemma}, least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    def lemmatize(self, word, pos="n"):
+
+        """
+        Return the lemma of the word, from the cache if possible.
+        """
+
+        key = (word, pos)
+        if key in self.cache:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return self.cache[key]
+
+        self.misses += 1
+        lemma = self.lemmatizer.lemmatize(word, pos=pos)
+        self.cache[key] = lemma
+        if len(self.cache) > self.maxsize:
+            self.cache.popitem(last=False)  # Evict the least recently used pair
+            self.evictions += 1
+        return lemma
+
+    def stats(self):
+
+        """
+        Return a dictionary of hit-rate statistics.
+        """
+
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self.cache),
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+    def report(self):
+
+        """
+        One line summary of stats().
+        """
+
+        stats = self.stats()
+        return "Lemma cache: " + str(stats['hits']) + " hits, " + str(stats['misses']) + " misses, " + str(stats['evictions']) + " evictions, hit rate " + str(round(stats['hit_rate'] * 100, 2)) + "%"
+
+    def save(self, path=None):
+
+        """
+        Save the cached pairs to a json file, least recently used first, so that loading keeps the eviction order.
+        """
+
+        path = path if path is not None else self.path
+        temporary_path = path + "." + str(os.getpid()) + ".tmp"  # Processes building shards at the same time save the same cache
+        with open(temporary_path, "w", encoding="utf-8") as f:
+            json.dump([[word, pos, lemma] for (word, pos), lemma in self.cache.items()], f)
+        os.replace(temporary_path, path)
+
+    def load(self, path):
+
+        """
+        Load pairs saved by save(). Only the maxsize most recently used pairs are kept.
+        """
+
+        with open(path, encoding="utf-8") as f:
+            for word, pos, lemma in json.load(f)[-self.maxsize:]:
+                self.cache[(word, pos)] = lemma
+
+def get_lemma_cache():
+
+    """
+    Return the cache shared by indexing and query preprocessing of this process.
+    It is loaded from lemma_cache.json in the data folder if an earlier build saved it there.
+    """
+
+    global DEFAULT_CACHE
+    if DEFAULT_CACHE is None:
+        DEFAULT_CACHE = LemmaCache(path=paths.data_path(CACHE_FILE))
+    return DEFAULT_CACHE
@@ -0,0 +1,113 @@
+import os
+import random
+from bisect import bisect_left
+
+class Lexicon:
+
+    """
+    LEXICON.
+    Vocabulary of the index. Lemmas are sorted and a lemma's position is its integer id, the same id the binary index uses.
+    Keeps the collection statistics of every lemma: df (number of documents containing it) and cf (total number of occurrences).
+    Lookups are O(1) through a dictionary, prefix scans are binary searches on the sorted lemmas.
+    """
+
+    def __init__(self, lemmas, df, cf):
+        self.lemmas = lemmas  # Sorted list of lemmas
+        self.df = df  # df[lemma_id]
+        self.cf = cf  # cf[lemma_id]
+        self.lemma_ids = {lemma: lemma_id for lemma_id, lemma in enumerate(lemmas)}
+
+    @classmethod
+    def from_counts(cls, lemma_df, lemma_cf):
+
+        """
+        Build the lexicon from {lemma: df} and {lemma: cf}.
+        """
+
+        lemmas = sorted(lemma_df)
+        return cls(lemmas, [lemma_df[lemma] for lemma in lemmas], [lemma_cf[lemma] for lemma in lemmas])
+
+    @classmethod
+    def from_tf_idf(cls, tf_idf):
+
+        """
+        Build the lexicon from a tf-idf dictionary {lemma: {url: tf-idf, ...}} when the lemma counts are not available.
+        df is exact, cf is not known and is set to df (its lower bound).
+        """
+
+        lemma_df = {lemma: len(postings) for lemma, postings in tf_idf.items()}
+        return cls.from_counts(lemma_df, lemma_df)
+
+    @classmethod
+    def load(cls, path):
+
+        """
+        Load a lexicon saved by save().
+        """
+
+        lemmas, df, cf = [], [], []
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                lemma, lemma_df, lemma_cf = line.rstrip("\n").split("\t")
+                lemmas.append(lemma)
+                df.append(int(lemma_df))
+                cf.append(int(lemma_cf))
+        return cls(lemmas, df, cf)
+
+    def save(self, path):
+
+        """
+        Save the lexicon as a tab separated file of (lemma, df, cf), one lemma per line in id order.
+        """
+
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            for lemma, lemma_df, lemma_cf in zip(self.lemmas, self.df, self.cf):
+                f.write(lemma + "\t" + str(lemma_df) + "\t" + str(lemma_cf) + "\n")
+        os.replace(path + ".tmp", path)
+
+    def __len__(self):
+        return len(self.lemmas)
+
+    def __contains__(self, lemma):
+        return lemma in self.lemma_ids
+
+    def id(self, lemma):
+
+        """
+        Return the id of the lemma, -1 if the lemma is not in the lexicon.
+        """
+
+        return self.lemma_ids.get(lemma, -1)
+
+    def lemma(self, lemma_id):
+        return self.lemmas[lemma_id]
+
+    def stats(self, lemma):
+
+        """
+        Return (df, cf) of the lemma, (0, 0) if the lemma is not in the lexicon.
+        """
+
+        lemma_id = self.id(lemma)
+        return (self.df[lemma_id], self.cf[lemma_id]) if lemma_id >= 0 else (0, 0)
+
+    def prefix(self, prefix, limit=None):
+
+        """
+        Return the lemmas starting with prefix, in sorted order. At most limit lemmas if limit is given.
+        """
+
+        matches = []
+        for lemma_id in range(bisect_left(self.lemmas, prefix), len(self.lemmas)):
+            if not self.lemmas[lemma_id].startswith(prefix) or (limit is not None and len(matches) >= limit):
+                break
+            matches.append(self.lemmas[lemma_id])
+        return matches
+
+    def sample(self, k, rng=random):
+
+        """
+        Return k distinct random lemmas.
+        """
+
+        return rng.sample(self.lemmas, k)
@@ -1,18 +1,26 @@
 
 import os
-import pathlib
 import time
-import json
-import random
-import nltk
-from collections import defaultdict
 import xml.etree.ElementTree as ET
-import pandas as pd
 from tabulate import tabulate
 import tkinter as tk
-import PosTagger
-import preprocessing
 import inverted_index
+import batch_query
+import incremental_index
+import pipeline
+import spimi
+import lexicon
+import query_cache
+import query_analyzer
+from query_answers import expand_query, answer_query, answer_positional_query, answer_boolean_query
+import positional_index
+import boolean_query
+import snapshot
+import storage
+import instrumentation
+
+QUERY_CACHE = query_cache.QueryCache()  # Answers of the interactive queries, invalidated when the index is rebuilt
+SNAPSHOTS = {}  # Snapshot opened by read_snapshot {path: snapshot.Snapshot}, kept open (and safe from garbage collection) until a newer one is read
 
 """
 Before running this script, go to codeA/crawlers run the following commands:
@@ -22,47 +30,47 @@ scrapy crawl bcc
 in order to populate the database.
 """
 
-def get_all_lemmas():
+def read_lexicon():
 
     """
-    Use existing lemmas to create queries.
+    Read the lexicon of the current index snapshot.
     """
 
-    all_lemmas = []
-    articles_dfs = inverted_index.get_all_articles()  # Get all articles from the database
+    return lexicon.Lexicon.load(os.path.join(snapshot.current_snapshot(), snapshot.LEXICON_FILE))
 
-    for df in articles_dfs:
-        for _, row in df.iterrows():
-            lemmas = json.loads(row['lemmas_count'])
+def get_all_lemmas():
 
-            for lemma in lemmas:
-                if lemma not in all_lemmas:
-                    all_lemmas.append(lemma)
-    return all_lemmas
+    """
+    Use existing lemmas to create queries.
+    """
 
-def create_queries(params):
+    return read_lexicon().lemmas
+
+def create_queries(params, lemmas_lexicon=None):
 
     """
-    Create queries based on the params and the lemmas onb the database
+    Create queries based on the params and the lemmas of the lexicon
     """
     length_of_query, number_of_queries = params
-    all_lemmas = get_all_lemmas()
+    if lemmas_lexicon is None:
+        lemmas_lexicon = read_lexicon()
     queries = []
 
     for i in range(number_of_queries):
-        queries.append(random.sample(all_lemmas, k=length_of_query))
+        queries.append(lemmas_lexicon.sample(length_of_query))
     return queries
 
 def read_xml():
 
     """
-    Read the inverted index xml file.
+    Read the inverted index xml file of the current index snapshot (built with xml_export).
+    Return a dictionary {lemma: {url: weight}} (boolean_query.PostingsDict, which sorts the postings of boolean queries once).
     """
 
-    xml_path = os.path.join(os.path.dirname(pathlib.Path(__file__).parent.resolve()) , "dataA", "inverted_index.xml")
+    xml_path = os.path.join(snapshot.current_snapshot(), snapshot.XML_FILE)
     tree = ET.parse(xml_path)  # Create element tree object
     root = tree.getroot()  # Get root element
-    inverted_index_dict = {}
+    inverted_index_dict = boolean_query.PostingsDict()
 
     for item in root:
         inverted_index_dict[item.attrib['name']] = {}  # Empy dictionary for each lemma
@@ -71,84 +79,144 @@ def read_xml():
             inverted_index_dict[item.attrib['name']][child.attrib['id']] = float(child.attrib['weight'])  # Add urls and weights to dictionary
     return inverted_index_dict
 
-def answer_query(query, inverted_index_dict):
+def read_snapshot():
 
     """
-    Given a query of lemmas, look up the urls that contain those words in the inverted index.
-    If there are more than one word, the weight of a document which contains 2 or more words will be the sum of the two.
-    The ansewer will be returned in descending order.
+    Open the current index snapshot (snapshot.Snapshot) and keep it open: later calls return the same object until a rebuild publishes
+    a new one. Opening the new one closes the snapshots that are no longer current, so they can be garbage collected, and their
+    indexes must not be used anymore. Take every file of a query from one returned object, never from two calls.
     """
 
-    query = [lemma.lower() for lemma in query]
-    answer = defaultdict(int)  # Dictionary of urls and their weights. Use defaultdict to avoid KeyError
-    for lemma in query:
-        if lemma in inverted_index_dict:
-            for url in inverted_index_dict[lemma]:
-                answer[url] += inverted_index_dict[lemma][url]  # Add the weight of the lemma to the answer
+    snapshot_dir = snapshot.current_snapshot()
+    if snapshot_dir in SNAPSHOTS:
+        return SNAPSHOTS[snapshot_dir]
 
-    # Return a dataframe of (url, weight of lemma ..., total weight)
-    final_answer = []  # List of lists [url, weight of lemma ..., total weight]
-    for url in answer:
-        temp_list = [url]
-        for lemma in query:
-            if lemma in inverted_index_dict and url in inverted_index_dict[lemma]:
-                temp_list.append(inverted_index_dict[lemma][url])
-            else:
-                temp_list.append(0)
-        temp_list.append(answer[url])
-        final_answer.append(temp_list)
-    
-    pd.set_option('display.max_colwidth', None)
-    df = pd.DataFrame(final_answer, columns=['url'] + query + ['total_weight'])
-    df = df.sort_values(by=['total_weight'], ascending=False)
-    return df
+    current = snapshot.open_current()
+    for path in [path for path in SNAPSHOTS if path != current.path]:
+        SNAPSHOTS.pop(path).close()  # Releases its reader lock
+    SNAPSHOTS[current.path] = current
+    return current
 
-def create_inverted_index():
+def read_binary_index():
+
+    """
+    Memory map the binary inverted index of the current snapshot. Nothing is parsed up front, postings are read when a query needs them.
+    Lemma ids are looked up in the lexicon.
+    The index stays valid until a read_ function opens a newer snapshot (see read_snapshot).
+    Long running processes should use snapshot.SnapshotReader instead, which waits for the running queries before releasing a snapshot.
+    """
+
+    return read_snapshot().index
+
+def read_positional_index():
+
+    """
+    Positional index (positional_index.PositionalIndex) of the current snapshot, None if it was built without one.
+    """
+
+    return read_snapshot().positional
+
+def read_term_index():
+
+    """
+    Term index (term_index.TermIndex) of the current snapshot, None if the snapshot is older than term indexes.
+    """
+
+    return read_snapshot().terms
+
+def read_scoring_index():
+
+    """
+    Scoring index (scoring.ScoringIndex) of the current snapshot, None if it was built without scoring.
+    """
+
+    return read_snapshot().scoring
+
+def create_inverted_index(xml_export=False, incremental=False, chunk_size=500, workers=1, metrics_path=None, profile=None, positional=False, scorers=None, deduplicate=False, memory_budget=None):
 
     """
     Run all scripts needed after crawling.
+    The inverted index is published as a new snapshot (see snapshot.py) holding the binary file. Set xml_export to also save the old xml file.
+    Set incremental to only process the articles that are new or changed since the last build (see incremental_index.py).
+    A full build streams the articles through pipeline.run_pipeline, chunk_size articles at a time, PoS tagged by workers processes.
+    Set positional to also build the positional index of phrase and proximity queries (see positional_index.py).
+    Set scorers to a list of scorer names (scoring.SCORERS) to also store document norms and impact ordered postings for them (see scoring.py).
+    Set deduplicate to index one article per cluster of near-duplicates (see dedup.py) and print the work and index space it saved.
+    Set memory_budget (bytes) to build the index of a full build with spimi.build_index, which keeps at most that many bytes of postings
+    (and positions, with positional) in memory. The result is the same snapshot, returned as a storage.PostingsTable instead of a dictionary (like an incremental update).
+    Set metrics_path (JSON lines file) and/or profile ("cprofile" or "tracemalloc") to measure every stage of the build (see instrumentation.py).
+    Return the tf-idf dictionary {lemma: {url: tf-idf, ...}}, or its storage.PostingsTable view with memory_budget or incremental.
     """
 
-    # ------------- Preprocessing and creating the inverted index. Inverted index is saved in the data folder as an xml file. -------------
+    # ------------- Preprocessing and creating the inverted index. Inverted index is saved in the data folder as a binary file. -------------
     inverted_index_build_start = time.time()
-    PosTagger.PoSTagger()
-    preprocessing.preprocessing()
-    preprocessing.lemmas_count()
-    inverted_index.inverted_to_xml()
+    instrumented = metrics_path is not None or profile is not None
+    if instrumented:
+        instrumentation.enable(metrics_path, profile)
+
+    try:
+        if incremental:
+            with instrumentation.stage("incremental_update"):
+                lemmas_tf_idf_dict = incremental_index.update_inverted_index(xml_export, positional, scorers, deduplicate)
+        else:
+            with instrumentation.stage("pipeline") as record:
+                articles_count, _ = pipeline.run_pipeline(chunk_size, workers, deduplicate)  # PoS tagging, preprocessing, lemmatization and document statistics in one pass
+                record.add(documents=articles_count)
+            if memory_budget is not None:
+                with instrumentation.stage("snapshot"):
+                    lemmas_tf_idf_dict = spimi.build_index(memory_budget, xml_export, positional, scorers)  # External memory build
+            else:
+                with instrumentation.stage("tf_idf"):
+                    lemmas_tf_idf_dict = inverted_index.lemmas_tf_idf_from_stats()
+                with instrumentation.stage("lexicon"):
+                    lemmas_lexicon = inverted_index.lexicon_from_stats()
+                with instrumentation.stage("snapshot"):
+                    inverted_index.inverted_to_binary(lemmas_tf_idf_dict, lemmas_lexicon, xml_export, positional, scorers)
+            with instrumentation.stage("incremental_state"):
+                incremental_index.record_state()  # Remember what was indexed for the next incremental build
+    finally:
+        if instrumented:
+            measured = instrumentation.disable()  # Also after a failed build, so stages are not recorded for the rest of the process
+
     inverted_index_build_end = time.time()
     print("Inverted index build time: " + str(inverted_index_build_end - inverted_index_build_start) + " seconds")
+    if instrumented:
+        print(measured.report())
+    return lemmas_tf_idf_dict
 
-def preprocess_query(query):
+def compare_batch_throughput(queries, lemmas_tf_idf_dict, batch_engine):
 
     """
-    Preprocess_query:
-    PoSTagging, remove stopwords and lemmatization
+    Answer the queries one by one with answer_query and as one batch with batch_engine (batch_query.BatchQueryEngine).
+    Check that both give exactly the same answers, in the same order, and return the throughput of both (queries per second of the loop, of the batch).
     """
 
-    # Download needed NLTK packages for removing stop words
-    nltk.download('stopwords')
-    nltk.download('averaged_perceptron_tagger')
-    nltk.download('punkt')
-    nltk.download('wordnet')
-    nltk.download('omw-1.4')
-    lemmatizer = nltk.stem.WordNetLemmatizer()
-    stop_words = nltk.corpus.stopwords.words('english')
+    start_time = time.time()
+    loop_answers = [answer_query(query, lemmas_tf_idf_dict, as_dataframe=False) for query in queries]
+    loop_time = time.time() - start_time
+
+    start_time = time.time()
+    batch_answers = batch_engine.answer_queries(queries)
+    batch_time = time.time() - start_time
 
-    to_return = []
-    query = query.split(",")  # Split the query by comma
-    query = [lemma.lower() for lemma in query]  # Convert to lowercase
+    for loop_answer, batch_answer in zip(loop_answers, batch_answers):
+        assert loop_answer == batch_answer, "Batch answers differ from answer_query"
+    return len(queries) / max(loop_time, 1e-9), len(queries) / max(batch_time, 1e-9)
+
+def preprocess_query(query):
 
-    pos_tags = nltk.pos_tag(query)  # Get the part of speech tags
-    query = [item for item in pos_tags if item[0] not in stop_words and item[1] in preprocessing.OPEN_CLASS_CATEGORIES]  # Remove stop words and close categories
+    """
+    Preprocess_query:
+    PoSTagging, remove stopwords and lemmatization.
+    Uses the query analyzer of the process (query_analyzer.QueryAnalyzer), NLTK resources are only loaded for the first query.
+    """
 
-    for item in query:
-        to_return.append(lemmatizer.lemmatize(item[0], pos=preprocessing.POS_TAGS[item[1][0:2]]))  # Lemmatize the words
-    return to_return
+    return query_analyzer.get_query_analyzer().analyze(query)
 
-def user_input_query(xml):
+def user_input_query():
     
         """
-        Create a window for the user to enter the query.
+        Create a window for the user to enter the query. Queries are answered on the current index snapshot.
         """
     
         window = tk.Tk()
@@ -169,7 +237,16 @@ def user_input_query(xml):
             """
     
             query = query_entry.get()
-            answer = answer_query(preprocess_query(query), xml)
+            current = read_snapshot()  # Every file of the query comes from the same snapshot
+            if positional_index.has_operators(query) and current.positional is not None:
+                answer = answer_positional_query(query, current.index, current.positional)  # Phrase ("...") or proximity (NEAR/k) query
+            elif boolean_query.has_operators(query):
+                answer = answer_boolean_query(query, current.index)  # AND, OR, NOT and parentheses
+            else:
+                lemmas = preprocess_query(query)
+                if current.terms is not None:
+                    lemmas = expand_query(lemmas, current.terms)  # Misspelled words are replaced by the closest lemmas
+                answer = answer_query(lemmas, current.index, cache=QUERY_CACHE)
             print("\n\n Query: " + query + "\n\n")
             print(tabulate(answer, headers='keys', tablefmt='psql', showindex=False))
             window.destroy()
@@ -180,19 +257,23 @@ def user_input_query(xml):
 
 if __name__ == "__main__":
 
-    create_inverted_index()  # Create the inverted index and print the time it took to build it
-    inverted_index_dict = read_xml()  # Read the inverted index xml file
+    lemmas_tf_idf_dict = create_inverted_index(workers=os.cpu_count(), positional=True, scorers=["bm25"])  # Create the inverted index and print the time it took to build it
+    inverted_index_dict = read_binary_index()  # Memory map the binary inverted index
 
     # -------------------------------------------------- Create queries and print timings --------------------------------------------------
     user_input = input("Timings or custom input? (t/c): ")
 
     if user_input == "c":
-        user_input_query(inverted_index_dict)  # Create a window for the user to enter the query
+        user_input_query()  # Create a window for the user to enter the query
     elif user_input == "t":
         queries_list = [(1, 20), (2, 20), (3, 30), (4, 30)]  # Tuples of (query length, number of queries)
+        if isinstance(lemmas_tf_idf_dict, storage.PostingsTable):  # Built with a memory budget or incrementally
+            batch_engine = batch_query.BatchQueryEngine.from_database()  # Sparse matrix engine for the batch comparison
+        else:
+            batch_engine = batch_query.BatchQueryEngine(lemmas_tf_idf_dict)
 
         for params in queries_list:
-            queries = create_queries(params)  # Create queries of the given length and number of queries
+            queries = create_queries(params, inverted_index_dict.lexicon)  # Create queries of the given length and number of queries
 
             start_time = time.time()
             for query in queries:
@@ -202,5 +283,8 @@ if __name__ == "__main__":
                 # print("\n")
             end_time = time.time()
             print("Query length: " + str(params[0]) + " | Number of queries: " + str(params[1]) + " | Time: " + str((end_time - start_time) / params[1]) + " seconds")
+
+            loop_throughput, batch_throughput = compare_batch_throughput(queries, lemmas_tf_idf_dict, batch_engine)
+            print("Query length: " + str(params[0]) + " | Loop: " + str(loop_throughput) + " queries/s | Batch: " + str(batch_throughput) + " queries/s")
     else:
         print("Invalid input")
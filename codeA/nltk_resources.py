@@ -0,0 +1,49 @@
+import os
+import sys
+import nltk
+import paths
+
+NLTK_DATA_DIR = os.path.join(paths.DEFAULT_DATA_DIR, "nltk_data")  # Shared by every data folder
+NLTK_PACKAGES = ['stopwords', 'averaged_perceptron_tagger', 'punkt', 'wordnet', 'omw-1.4']
+
+"""
+NLTK RESOURCES.
+The builds (pipeline.py, incremental_index.py, sharded_index.py, PosTagger.py, preprocessing.py) and the query side
+(query_analyzer.py) load the NLTK packages they need from NLTK_DATA_DIR first, then from the usual NLTK data paths, and never
+download at run time: an air-gapped host only needs a copy of the folder. A missing package raises nltk's LookupError.
+Fill the folder on a machine with internet access with python nltk_resources.py download.
+"""
+
+def download_resources(data_dir=NLTK_DATA_DIR):
+
+    """
+    Download the NLTK packages of the builds and the query analyzer to data_dir. Run once on a machine with internet access
+    and copy the folder to the air-gapped machines.
+    """
+
+    for package in NLTK_PACKAGES:
+        nltk.download(package, download_dir=data_dir)
+
+def use_resources(data_dir=NLTK_DATA_DIR):
+
+    """
+    Look up NLTK resources in data_dir before the usual NLTK data paths, without downloading. Safe to call more than once.
+    """
+
+    if data_dir is not None and os.path.isdir(data_dir) and data_dir not in nltk.data.path:
+        nltk.data.path.insert(0, data_dir)
+
+def stop_words(data_dir=NLTK_DATA_DIR):
+
+    """
+    English stop words, as a set.
+    """
+
+    use_resources(data_dir)
+    return set(nltk.corpus.stopwords.words('english'))
+
+if __name__ == "__main__":
+
+    if len(sys.argv) > 1 and sys.argv[1] == "download":
+        download_resources()
+        print("NLTK resources saved to " + NLTK_DATA_DIR)
@@ -0,0 +1,24 @@
+import os
+import pathlib
+
+DEFAULT_DATA_DIR = os.path.join(os.path.dirname(pathlib.Path(__file__).parent.resolve()) , "dataA")
+DATA_DIR = os.environ.get("NLP_DATA_DIR", DEFAULT_DATA_DIR)  # Folder of the database, the index snapshots and the caches
+
+def set_data_dir(data_dir):
+
+    """
+    Use another data folder (for example a synthetic corpus, see benchmark.py) for the rest of this process.
+    Worker processes started afterwards inherit it.
+    """
+
+    global DATA_DIR
+    DATA_DIR = data_dir
+    os.environ["NLP_DATA_DIR"] = data_dir
+
+def data_path(*names):
+
+    """
+    Path of a file or folder in the data folder.
+    """
+
+    return os.path.join(DATA_DIR, *names)
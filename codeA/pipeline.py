@@ -0,0 +1,153 @@
+import os
+import json
+import math
+import nltk_resources
+import PosTagger
+import preprocessing
+import lemma_cache
+import storage
+import token_store
+import instrumentation
+import dedup
+
+DATABASE_TABLES = ["foxnews", "aljazeera", "bcc"]
+OUTPUT_COLUMNS = ["PoSTags_cleaned", "lemmas_count"]  # The only columns that later stages read
+COLUMN_TYPES = {"PoSTags": "BLOB", "PoSTags_cleaned": "BLOB"}  # Encoded (word, tag) lists (see token_store.py), other columns are TEXT
+
+def ensure_columns(db, table, columns):
+
+    """
+    Add the given columns to the table if they don't exist, with their type in COLUMN_TYPES (TEXT by default).
+    """
+
+    existing_columns = [column[1] for column in db.execute("PRAGMA table_info(" + table + ")")]
+
+    for column in columns:
+        if column not in existing_columns:
+            db.execute("ALTER TABLE " + table + " ADD COLUMN " + column + " " + COLUMN_TYPES.get(column, "TEXT"))
+
+def create_stats_tables(db):
+
+    """
+    (Re)create the statistics tables written during lemmatization:
+    doc_stats (doc_id, source, source_rowid, url, token_count, unique_lemmas, norm): one row per article. source and source_rowid
+    point to the article's row, token_count is the length of PoSTags_cleaned and norm is the L2 norm of the lemma counts.
+    lemma_df (lemma, df, cf): number of documents containing each lemma and total number of occurrences of each lemma.
+    """
+
+    db.execute("DROP TABLE IF EXISTS doc_stats")
+    db.execute("DROP TABLE IF EXISTS lemma_df")
+    db.execute("CREATE TABLE doc_stats (doc_id INTEGER PRIMARY KEY, source TEXT, source_rowid INTEGER, url TEXT, token_count INTEGER, unique_lemmas INTEGER, norm REAL)")
+    db.execute("CREATE TABLE lemma_df (lemma TEXT PRIMARY KEY, df INTEGER, cf INTEGER)")
+
+def read_chunks(db, table, chunk_size):
+
+    """
+    Yield the articles of a table as lists of (rowid, url, content) with at most chunk_size articles.
+    Pages are read by rowid (keyset pagination), so only one chunk is in memory and writes between chunks are safe.
+    Articles listed in the duplicates table (see dedup.py) are skipped.
+    """
+
+    dedup.create_duplicates_table(db)
+    last_rowid = 0
+    while True:
+        chunk = db.execute("SELECT rowid, url, content FROM " + table + " WHERE rowid > ? AND url NOT IN (SELECT url FROM duplicates) ORDER BY rowid LIMIT ?", (last_rowid, chunk_size)).fetchall()
+        if not chunk:
+            return
+        yield chunk
+        last_rowid = chunk[-1][0]
+
+def process_tags(postags, stop_words, lemmatizer):
+
+    """
+    Clean and lemmatize the tagged words of one article. Return (cleaned (word, tag) list, {lemma: count}).
+    """
+
+    with instrumentation.stage("preprocessing"):
+        cleaned_postags = preprocessing.clean_postags(postags, stop_words)
+    with instrumentation.stage("lemmatization") as record:
+        lemmas = preprocessing.count_lemmas(cleaned_postags, lemmatizer)
+        record.add(documents=1, tokens=len(cleaned_postags))
+    return cleaned_postags, lemmas
+
+def run_pipeline(chunk_size=500, workers=1, deduplicate=False):
+
+    """
+    STREAMING NLP PIPELINE.
+    Replaces PosTagger.PoSTagger, preprocessing.preprocessing, preprocessing.lemmas_count and inverted_index.count_docs_containing_lemmas
+    with one pass over the articles. Every article is tagged, cleaned, lemmatized and counted in one go, and only the final columns
+    (PoSTags_cleaned as a token_store blob, lemmas_count) are written back, chunk by chunk, with batched UPDATEs. Peak memory is bounded by chunk_size
+    articles plus the document frequency dictionary.
+    The doc_stats and lemma_df tables (see create_stats_tables) are written on the way, for inverted_index.lemmas_tf_idf_from_stats.
+    Set workers > 1 to PoS tag every chunk with a process pool (see PosTagger.tagging_pool).
+    Set deduplicate to detect near-duplicate articles first (dedup.find_duplicates) and index one article per cluster: the others are
+    not tagged, their derived columns are emptied and they are not counted. Otherwise the duplicates of a previous detection are forgotten.
+    Return (number of articles, {lemma: number of documents containing lemma}) for inverted_index.lemmas_tf_idf.
+    """
+
+    stop_words = nltk_resources.stop_words()  # NLTK packages are loaded from the shared data folder, never downloaded
+    lemmatizer = lemma_cache.get_lemma_cache()  # WordNet lemmatizer behind a (word, tag) cache
+
+    db = storage.get_connection()  # Shared connection to the database
+    store = token_store.TokenStore(db)  # Shared word and tag vocabularies
+    articles_count = 0
+    lemma_in_docs_counter = {}  # Dictionary {lemma: Number of documents containing lemma}
+    lemma_collection_counter = {}  # Dictionary {lemma: Number of occurrences of lemma in all documents}
+
+    if deduplicate:
+        with instrumentation.stage("dedup") as record:
+            summary = dedup.find_duplicates()
+            record.add(documents=summary['documents'])
+        print(dedup.report(summary))
+    else:
+        dedup.clear_duplicates(db)
+
+    with db:
+        create_stats_tables(db)
+        for table in DATABASE_TABLES:
+            ensure_columns(db, table, OUTPUT_COLUMNS)
+            db.execute("UPDATE " + table + " SET PoSTags_cleaned = NULL, lemmas_count = NULL WHERE url IN (SELECT url FROM duplicates)")  # Left by a previous build
+
+    with PosTagger.tagging_pool(workers) as pool:  # Workers are stopped even if a chunk fails
+        for table in DATABASE_TABLES:
+
+            chunks = read_chunks(db, table, chunk_size)
+            while True:
+                with instrumentation.stage("db_read", io=True):
+                    chunk = next(chunks, None)
+                if chunk is None:
+                    break
+
+                cleaned_chunk = []  # PoSTags_cleaned of every article
+                updates = []  # Tuples of (lemmas_count, rowid)
+                stats = []  # Rows of doc_stats
+                with instrumentation.stage("tagging") as record:
+                    chunk_tags = PosTagger.tag_texts([content for _, _, content in chunk], pool)
+                    record.add(documents=len(chunk), tokens=sum(len(postags) for postags in chunk_tags))
+
+                for (rowid, url, _), postags in zip(chunk, chunk_tags):
+                    cleaned_postags, lemmas = process_tags(postags, stop_words, lemmatizer)
+                    cleaned_chunk.append(cleaned_postags)
+                    updates.append((json.dumps(lemmas), rowid))
+                    stats.append((articles_count + len(stats), table, rowid, url, len(cleaned_postags), len(lemmas), math.sqrt(sum(count * count for count in lemmas.values()))))
+
+                    for lemma, count in lemmas.items():
+                        lemma_in_docs_counter[lemma] = lemma_in_docs_counter.get(lemma, 0) + 1
+                        lemma_collection_counter[lemma] = lemma_collection_counter.get(lemma, 0) + count
+                articles_count += len(chunk)
+
+                with instrumentation.stage("db_write", io=True), db:  # One transaction per chunk
+                    blobs = store.encode(cleaned_chunk)  # New words get their ids in the same transaction
+                    db.executemany("UPDATE " + table + " SET PoSTags_cleaned = ?, lemmas_count = ? WHERE rowid = ?", [(blob,) + update for blob, update in zip(blobs, updates)])
+                    db.executemany("INSERT INTO doc_stats VALUES (?, ?, ?, ?, ?, ?, ?)", stats)
+
+    with instrumentation.stage("db_write", io=True), db:
+        db.executemany("INSERT INTO lemma_df VALUES (?, ?, ?)", [(lemma, df, lemma_collection_counter[lemma]) for lemma, df in lemma_in_docs_counter.items()])
+
+    lemmatizer.save()  # Keep the cache for the next run
+    print(lemmatizer.report())
+    return articles_count, lemma_in_docs_counter
+
+if __name__ == "__main__":
+    articles_count, _ = run_pipeline(workers=os.cpu_count())
+    print("Pipeline finished successfully for " + str(articles_count) + " articles!")
@@ -0,0 +1,408 @@
+import os
+import re
+import mmap
+import time
+import struct
+import numpy as np
+import preprocessing
+import lemma_cache
+import binary_index
+import storage
+import token_store
+
+MAGIC = b"NLPPOSIX"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<8sIIIq")  # magic, version, n_lemmas, n_docs, created
+SECTIONS = ["lemma_offsets", "lemma_blob", "doc_offsets", "doc_blob", "block_offsets", "blocks"]
+SECTION_TABLE = struct.Struct("<" + "Q" * len(SECTIONS))
+QUERY_TOKENS = re.compile(r'"([^"]*)"|NEAR/(\d+)|([^\s,"]+)')  # Quoted phrase, proximity operator or word. Commas only separate terms
+
+"""
+POSITIONAL INDEX.
+Optional companion of the binary inverted index (built with create_inverted_index(positional=True) and stored in the same snapshot)
+that records where every lemma occurs in every document, for phrase ("prime minister") and proximity (economy NEAR/5 growth) queries.
+Positions count the lemmas of PoSTags_cleaned, so stop words and punctuation are not counted: "bank of america" is the phrase bank america.
+File layout, like binary_index.py (header, section table, sections on 8 byte boundaries):
+
+    lemma offsets       uint64[n_lemmas + 1]  offsets of each lemma inside the lemma blob
+    lemma blob          utf-8 lemmas, sorted, concatenated
+    doc offsets         uint64[n_docs + 1]    offsets of each url inside the doc blob
+    doc blob            utf-8 urls, sorted, concatenated. The position of a url is its doc id
+    block offsets       uint64[n_lemmas + 1]  offsets of each lemma's block inside the blocks
+    blocks              one block per lemma, a stream of varints (7 bits per byte, high bit set on all bytes but the last):
+                        number of documents, doc id gaps, number of positions in every document,
+                        position gaps (the first position of every document is stored as is)
+
+Blocks are decoded with numpy in one go, phrase and proximity matches are computed from the positions only, the text is never read.
+"""
+
+def encode_varints(values):
+
+    """
+    Encode a sequence of non negative integers as varints. Return bytes.
+    """
+
+    values = np.asarray(values, dtype=np.uint64)
+    lengths = np.ones(len(values), dtype=np.int64)  # Number of bytes of every value
+    rest = values >> np.uint64(7)
+    while rest.any():
+        lengths += rest > 0
+        rest >>= np.uint64(7)
+
+    starts = np.cumsum(lengths) - lengths
+    encoded = np.empty(int(lengths.sum()), dtype=np.uint8)
+    for k in range(int(lengths.max()) if len(values) else 0):
+        mask = lengths > k
+        groups = (values[mask] >> np.uint64(7 * k)) & np.uint64(0x7f)
+        continuation = np.where(lengths[mask] > k + 1, 0x80, 0).astype(np.uint64)
+        encoded[starts[mask] + k] = groups | continuation
+    return encoded.tobytes()
+
+def decode_varints(data):
+
+    """
+    Decode a uint8 array (or bytes) of varints. Return a uint64 array.
+    """
+
+    data = np.frombuffer(data, dtype=np.uint8) if isinstance(data, (bytes, bytearray, memoryview)) else data
+    ends = np.flatnonzero(data < 0x80)  # Last byte of every value
+    if len(ends) == 0:
+        return np.zeros(0, dtype=np.uint64)
+
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    shifts = 7 * (np.arange(len(data)) - np.repeat(starts, ends - starts + 1))
+    return np.add.reduceat((data & 0x7f).astype(np.uint64) << shifts.astype(np.uint64), starts)
+
+def encode_block(doc_ids, positions):
+
+    """
+    Encode the postings of one lemma: sorted doc ids and, for every doc, the sorted array of its positions.
+    """
+
+    doc_ids = np.asarray(doc_ids, dtype=np.int64)
+    counts = np.array([len(doc_positions) for doc_positions in positions], dtype=np.int64)
+    position_gaps = [np.diff(doc_positions, prepend=0) for doc_positions in positions]  # First gap is the first position
+    return encode_varints(np.concatenate([[len(doc_ids)], np.diff(doc_ids, prepend=0), counts] + position_gaps))
+
+def decode_block(block):
+
+    """
+    Decode a lemma block. Return (doc ids, counts, positions) int64 arrays: positions holds counts[i] positions for the i-th doc.
+    """
+
+    values = decode_varints(block).astype(np.int64)
+    if len(values) == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty
+
+    n_docs = int(values[0])
+    doc_ids = np.cumsum(values[1:n_docs + 1])
+    counts = values[n_docs + 1:2 * n_docs + 1]
+    gaps = values[2 * n_docs + 1:]
+
+    # Prefix sums restarted at every doc
+    totals = np.cumsum(gaps)
+    doc_starts = np.cumsum(counts) - counts
+    positions = totals - np.repeat(totals[doc_starts] - gaps[doc_starts], counts)
+    return doc_ids, counts, positions
+
+def write_positional_index(lemma_positions, path):
+
+    """
+    Save {lemma: {url: positions}} (lists or arrays, in increasing order) to a positional index file.
+    """
+
+    urls = sorted({url for postings in lemma_positions.values() for url in postings})
+    url_to_doc_id = {url: doc_id for doc_id, url in enumerate(urls)}
+
+    writer = PositionalIndexWriter(path, urls)
+    for lemma in sorted(lemma_positions):
+        postings = sorted((url_to_doc_id[url], positions) for url, positions in lemma_positions[lemma].items())
+        writer.add(lemma, [doc_id for doc_id, _ in postings], [positions for _, positions in postings])
+    writer.close()
+
+class PositionalIndexWriter:
+
+    """
+    Streaming writer of a positional index, for builds whose positions do not fit in memory (see spimi.py).
+    Call add() once per lemma, in sorted lemma order, then close(). Blocks are appended to a temporary file next to path.
+    """
+
+    def __init__(self, path, urls):
+        self.path = path
+        self.urls = urls  # Sorted, the position of a url is its doc id
+        self.lemmas = []
+        self.block_offsets = [0]
+        self._blocks = open(path + ".blocks.tmp", "w+b")
+
+    def add(self, lemma, doc_ids, positions):
+
+        """
+        Append the block of the next lemma: its doc ids, sorted, and the positions in every document.
+        """
+
+        block = encode_block(doc_ids, positions)
+        self.lemmas.append(lemma)
+        self.block_offsets.append(self.block_offsets[-1] + len(block))
+        self._blocks.write(block)
+
+    def close(self):
+
+        """
+        Write the positional index file and remove the temporary file.
+        """
+
+        lemma_offsets, lemma_blob = binary_index._strings_to_blob(self.lemmas)
+        doc_offsets, doc_blob = binary_index._strings_to_blob(self.urls)
+        sections = [lemma_offsets.tobytes(), lemma_blob, doc_offsets.tobytes(), doc_blob, np.array(self.block_offsets, dtype="<u8").tobytes(), self._blocks]
+        try:
+            binary_index.write_sections(self.path, HEADER.pack(MAGIC, FORMAT_VERSION, len(self.lemmas), len(self.urls), time.time_ns()), sections)
+        finally:
+            self._blocks.close()
+            os.remove(self._blocks.name)
+
+def document_positions(chunk_size=500):
+
+    """
+    Rebuild the lemma positions of the articles from the PoSTags_cleaned columns written by the pipeline, one article at a time.
+    Only the word and tag ids are read (see token_store.py), every distinct (word, tag) pair is decoded and lemmatized once.
+    Yield (url, {lemma: positions array}) of every article, in table then rowid order. The dictionary is empty for an article without lemmas.
+    """
+
+    lemmatizer = lemma_cache.get_lemma_cache()  # The cache of the build, lemmas are the ones of lemmas_count
+    db = storage.get_connection()
+    store = token_store.TokenStore(db)
+    pair_lemma_ids = {}  # {word id << 8 | tag id: lemma id}
+    lemmas = []  # Lemma of every lemma id
+    lemma_ids = {}  # {lemma: lemma id}
+
+    for table in preprocessing.DATABASE_TABLES:
+        last_rowid = 0
+        while True:
+            chunk = db.execute("SELECT rowid, url, PoSTags_cleaned FROM " + table + " WHERE rowid > ? AND PoSTags_cleaned IS NOT NULL ORDER BY rowid LIMIT ?", (last_rowid, chunk_size)).fetchall()
+            if not chunk:
+                break
+            last_rowid = chunk[-1][0]
+
+            for _, url, cleaned_postags in chunk:
+                if token_store.length(cleaned_postags) == 0:
+                    yield url, {}
+                    continue
+
+                pairs, inverse = np.unique((token_store.token_ids(cleaned_postags).astype(np.int64) << 8) | token_store.tag_ids(cleaned_postags), return_inverse=True)
+                new_pairs = np.array([pair for pair in pairs.tolist() if pair not in pair_lemma_ids], dtype=np.int64)
+                if len(new_pairs):
+                    new_postags = list(zip(store.tokens.lookup(new_pairs >> 8).tolist(), store.tags.lookup(new_pairs & 0xff).tolist()))
+                    for pair, lemma in zip(new_pairs.tolist(), preprocessing.lemma_sequence(new_postags, lemmatizer)):
+                        if lemma not in lemma_ids:
+                            lemma_ids[lemma] = len(lemmas)
+                            lemmas.append(lemma)
+                        pair_lemma_ids[pair] = lemma_ids[lemma]
+
+                # Group the positions by lemma, every group stays in increasing order
+                doc_lemma_ids = np.array([pair_lemma_ids[pair] for pair in pairs.tolist()], dtype=np.int64)[inverse.reshape(-1)]
+                order = np.argsort(doc_lemma_ids, kind="stable")
+                doc_lemmas, starts = np.unique(doc_lemma_ids[order], return_index=True)
+                yield url, {lemmas[lemma_id]: positions for lemma_id, positions in zip(doc_lemmas.tolist(), np.split(order, starts[1:]))}
+
+def read_lemma_positions(chunk_size=500):
+
+    """
+    Rebuild the lemma positions of every article (see document_positions). Return {lemma: {url: positions array}}.
+    """
+
+    lemma_positions = {}
+    urls = set()
+
+    for url, positions in document_positions(chunk_size):
+        if url in urls:  # The same url can appear twice. Keep the last one like lemmas_tf_idf does
+            for postings in lemma_positions.values():
+                postings.pop(url, None)
+        urls.add(url)
+        for lemma, doc_positions in positions.items():
+            lemma_positions.setdefault(lemma, {})[url] = doc_positions
+    return lemma_positions
+
+def build_positional_index(path, chunk_size=500):
+
+    """
+    Build the positional index of the articles in the database and save it to path.
+    """
+
+    write_positional_index(read_lemma_positions(chunk_size), path)
+
+class PositionalIndex:
+
+    """
+    Read only, memory mapped view of a positional index file. Only the blocks of the queried lemmas are read and decoded.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.n_lemmas, self.n_docs, self.created = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(path + " is not a positional index")
+        if version != FORMAT_VERSION:
+            self.close()
+            raise ValueError("Unsupported positional index format version " + str(version) + ". Rebuild the inverted index")
+        offsets = dict(zip(SECTIONS, SECTION_TABLE.unpack_from(self._mm, HEADER.size)))
+
+        self._lemma_offsets = np.frombuffer(self._mm, dtype="<u8", count=self.n_lemmas + 1, offset=offsets["lemma_offsets"])
+        self._lemma_blob = offsets["lemma_blob"]
+        self._doc_offsets = np.frombuffer(self._mm, dtype="<u8", count=self.n_docs + 1, offset=offsets["doc_offsets"])
+        self._doc_blob = offsets["doc_blob"]
+        self._block_offsets = np.frombuffer(self._mm, dtype="<u8", count=self.n_lemmas + 1, offset=offsets["block_offsets"])
+        self._blocks = offsets["blocks"]
+
+    def close(self):
+        self._lemma_offsets = self._doc_offsets = self._block_offsets = None
+        if getattr(self, "_mm", None) is not None:
+            self._mm.close()
+            self._mm = None
+        self._file.close()
+
+    def _lemma_bytes(self, lemma_id):
+        start = self._lemma_blob + int(self._lemma_offsets[lemma_id])
+        end = self._lemma_blob + int(self._lemma_offsets[lemma_id + 1])
+        return self._mm[start:end]
+
+    def lemma_id(self, lemma):
+
+        """
+        Binary search the sorted lemma dictionary. Return -1 if the lemma is not in the index.
+        """
+
+        key = lemma.encode("utf-8")
+        low, high = 0, self.n_lemmas
+
+        while low < high:
+            middle = (low + high) // 2
+            if self._lemma_bytes(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low if low < self.n_lemmas and self._lemma_bytes(low) == key else -1
+
+    def url(self, doc_id):
+        start = self._doc_blob + int(self._doc_offsets[doc_id])
+        end = self._doc_blob + int(self._doc_offsets[doc_id + 1])
+        return self._mm[start:end].decode("utf-8")
+
+    def positions(self, lemma):
+
+        """
+        Return (doc ids, counts, positions) of the lemma, see decode_block. All empty if the lemma is not in the index.
+        """
+
+        lemma_id = self.lemma_id(lemma)
+        if lemma_id < 0:
+            return decode_block(b"")
+
+        start = self._blocks + int(self._block_offsets[lemma_id])
+        end = self._blocks + int(self._block_offsets[lemma_id + 1])
+        return decode_block(np.frombuffer(self._mm, dtype=np.uint8, count=end - start, offset=start))
+
+    def position_keys(self, lemma):
+
+        """
+        Sorted int64 keys doc id << 32 | position of every occurrence of the lemma.
+        """
+
+        doc_ids, counts, positions = self.positions(lemma)
+        return (np.repeat(doc_ids, counts) << 32) | positions
+
+    def phrase(self, lemmas):
+
+        """
+        Return the sorted doc ids of the documents where the lemmas occur one right after the other.
+        """
+
+        if not lemmas:
+            return np.zeros(0, dtype=np.int64)
+
+        # Occurrence of the i-th lemma at position p starts the phrase at p - i. Shift so that keys stay non negative
+        starts = None
+        for i, lemma in enumerate(lemmas):
+            keys = self.position_keys(lemma) + (len(lemmas) - 1 - i)
+            starts = keys if starts is None else np.intersect1d(starts, keys, assume_unique=True)
+        return np.unique(starts >> 32)
+
+    def near(self, lemmas, distance):
+
+        """
+        Return the sorted doc ids of the documents with an occurrence of every lemma inside a window of distance + 1 positions
+        (the first and the last lemma of the window are at most distance positions apart), in any order.
+        """
+
+        keys = [self.position_keys(lemma) for lemma in dict.fromkeys(lemmas)]
+        if not keys:
+            return np.zeros(0, dtype=np.int64)
+
+        # The first occurrence of a matching window is one of the occurrences: check every occurrence as a window start
+        anchors = np.unique(np.concatenate(keys))
+        matched = np.ones(len(anchors), dtype=bool)
+        for lemma_keys in keys:
+            following = np.searchsorted(lemma_keys, anchors)  # First occurrence at or after the anchor
+            found = following < len(lemma_keys)
+            matched &= found
+            matched[found] &= lemma_keys[following[found]] <= anchors[found] + distance  # Same document too, positions stay below 2 ** 32
+        return np.unique(anchors[matched] >> 32)
+
+    def match(self, constraints):
+
+        """
+        Return the urls of the documents satisfying all the constraints of parse_query, sorted.
+        """
+
+        doc_ids = None
+        for constraint in constraints:
+            if constraint[0] == "phrase":
+                constraint_doc_ids = self.phrase(constraint[1])
+            else:
+                constraint_doc_ids = self.near(constraint[1], constraint[2])
+            doc_ids = constraint_doc_ids if doc_ids is None else np.intersect1d(doc_ids, constraint_doc_ids, assume_unique=True)
+        return [self.url(doc_id) for doc_id in (doc_ids if doc_ids is not None else []).tolist()]
+
+def has_operators(query):
+
+    """
+    Return True if the query text uses a phrase or proximity operator.
+    """
+
+    return '"' in query or re.search(r"NEAR/\d+", query) is not None
+
+def parse_query(query, analyzer):
+
+    """
+    Parse a query with phrase and proximity operators:
+        "prime minister", election          the phrase prime minister and the word election
+        economy NEAR/5 "interest rate"      economy at most 5 positions away from interest and rate
+    Every word and phrase is analyzed with analyzer (query_analyzer.QueryAnalyzer). Commas only separate terms.
+    Return (lemmas of the whole query, constraints), constraints being ("phrase", lemmas) and ("near", lemmas, distance) tuples.
+    """
+
+    lemmas = []
+    constraints = []
+    terms = []  # Lemmas of every word or phrase, in query order
+    near_after = {}  # {index of a term: distance to the next term}
+
+    for phrase, distance, word in QUERY_TOKENS.findall(query):
+        if distance:
+            if terms:
+                near_after[len(terms) - 1] = int(distance)
+            continue
+
+        term_lemmas = analyzer.analyze(phrase if phrase else word)
+        if phrase and term_lemmas:
+            constraints.append(("phrase", term_lemmas))
+        terms.append(term_lemmas)
+        lemmas.extend(term_lemmas)
+
+    for i, distance in near_after.items():
+        if i + 1 < len(terms) and terms[i] and terms[i + 1]:
+            constraints.append(("near", terms[i] + terms[i + 1], distance))
+    return lemmas, constraints
@@ -1,14 +1,15 @@
-import os
-import pathlib
-import sqlite3
 import string
 import nltk
 import json
 import pandas as pd
+import lemma_cache
+import nltk_resources
+import storage
+import token_store
 
 DATABASE_TABLES = ["foxnews", "aljazeera", "bcc"]
 OPEN_CLASS_CATEGORIES = ["JJ", "JJR", "JJS", "RB", "RBR", "RBS", "NN", "NNS", "NNP", "NNPS", "VB", "VBD", "VBG", "VBN", "VBP", "VBZ", "FW"]
-POS_TAGS = {'NN': nltk.corpus.wordnet.NOUN, 'JJ': nltk.corpus.wordnet.ADJ, 'VB': nltk.corpus.wordnet.VERB, 'RB': nltk.corpus.wordnet.ADV, 'FW': nltk.corpus.wordnet.NOUN}
+POS_TAGS = {'NN': nltk.corpus.reader.wordnet.NOUN, 'JJ': nltk.corpus.reader.wordnet.ADJ, 'VB': nltk.corpus.reader.wordnet.VERB, 'RB': nltk.corpus.reader.wordnet.ADV, 'FW': nltk.corpus.reader.wordnet.NOUN}  # Constants only, WordNet itself is loaded on first use
 PANCTUATION = string.punctuation
 
 def get_all_articles():
@@ -19,7 +20,7 @@ def get_all_articles():
     Get all articles from the database.
     """
 
-    db = sqlite3.connect(os.path.join(os.path.dirname(pathlib.Path(__file__).parent.resolve()) , "dataA", "db.sqlite3"))  # Establish connection to database
+    db = storage.get_connection()  # Shared connection to the database
     
     fox_news_df = pd.read_sql("SELECT * FROM " + DATABASE_TABLES[0], db)  # Get all articles from the table fox_news
     aljazeera_df = pd.read_sql("SELECT * FROM " + DATABASE_TABLES[1], db)  # Get all articles from the table aljazeera
@@ -27,6 +28,40 @@ def get_all_articles():
 
     return [fox_news_df, aljazeera_df, bcc_df]
 
+def clean_postags(postags, stop_words):
+
+    """
+    Remove stop words, closed tag category words, punctuation and unicode characters from a list of (word, tag) and convert words to lower case.
+    """
+
+    cleaned_tags = [item for item in postags if item[0] not in stop_words and item[1] in OPEN_CLASS_CATEGORIES]  # Remove stop words and closed tag category words
+    panc_cleaned_tags = [item for item in cleaned_tags if not any(symbol in item[0] for symbol in PANCTUATION)]  # Remove punctuation
+    panc_cleaned_tags = [item for item in panc_cleaned_tags if item[0].encode("ascii", "ignore").decode() != ""]  # Remove unicode characters
+    return [(item[0].lower(), item[1]) for item in panc_cleaned_tags]  # Convert all words to lower case
+
+def lemma_sequence(cleaned_postags, lemmatizer):
+
+    """
+    Lemmatize a list of cleaned (word, tag). Return the list of lemmas, in text order.
+    """
+
+    return [lemmatizer.lemmatize(word, pos=POS_TAGS[tag[0:2]]) for word, tag in cleaned_postags]
+
+def count_lemmas(cleaned_postags, lemmatizer):
+
+    """
+    Lemmatize a list of cleaned (word, tag) and return a dictionary {lemma: number of occurrences}.
+    """
+
+    lemmas = {}
+
+    for lemmatized_word in lemma_sequence(cleaned_postags, lemmatizer):
+        if lemmatized_word in lemmas:
+            lemmas[lemmatized_word] += 1
+        else:
+            lemmas[lemmatized_word] = 1
+    return lemmas
+
 def preprocessing():
 
     """
@@ -36,28 +71,25 @@ def preprocessing():
     Remove stop words, closed tag category words and punctuation and save the infomration to the database.
     """
 
-    # Download needed NLTK packages for removing stop words
-    nltk.download('stopwords')
-    stop_words = nltk.corpus.stopwords.words('english')
+    stop_words = nltk_resources.stop_words()  # NLTK packages are loaded from the shared data folder, never downloaded
 
     article_dfs = get_all_articles()  # Get all articles from the database
+    db = storage.get_connection()  # Shared connection to the database
+    store = token_store.TokenStore(db)  # Shared word and tag vocabularies
 
     for df in article_dfs:
-        current_df_cleaned_tags = []  # Each element is a json object containing a list of tagged words
+        current_df_cleaned_tags = []  # Each element is a list of tagged words
 
         for _, row in df.iterrows():
-            postags = json.loads(row['PoSTags'])  # Get the list of tagged words in list format
-            cleaned_tags = [item for item in postags if item[0] not in stop_words and item[1] in OPEN_CLASS_CATEGORIES]  # Remove stop words and closed tag category words
-            panc_cleaned_tags = [item for item in cleaned_tags if not any(symbol in item[0] for symbol in PANCTUATION)]  # Remove punctuation
-            panc_cleaned_tags = [item for item in panc_cleaned_tags if item[0].encode("ascii", "ignore").decode() != ""]  # Remove unicode characters
-            lower_cleaned_tags = [(item[0].lower(), item[1]) for item in panc_cleaned_tags]  # Convert all words to lower case
-            current_df_cleaned_tags.append(json.dumps(lower_cleaned_tags))  # Convert list to json object and append it
+            postags = store.decode(row['PoSTags'])  # Get the list of tagged words in list format
+            lower_cleaned_tags = clean_postags(postags, stop_words)  # Remove stop words, closed tag category words and punctuation
+            current_df_cleaned_tags.append(lower_cleaned_tags)
         
         assert len(current_df_cleaned_tags) == len(df.index), "Pre-processing Error"  # Check that the list's length of cleaned tagged words is equal to the number of articles
-        df['PoSTags_cleaned'] = current_df_cleaned_tags  # Add the list of cleaned tagged words to the dataframe
+        with db:
+            df['PoSTags_cleaned'] = store.encode(current_df_cleaned_tags)  # Add the encoded lists of cleaned tagged words to the dataframe
     
     # Save the new dataframe to the database
-    db = sqlite3.connect(os.path.join(os.path.dirname(pathlib.Path(__file__).parent.resolve()) , "dataA", "db.sqlite3"))  # Establish connection to database
 
     for df, table in zip(article_dfs, DATABASE_TABLES):
         df.to_sql(table, db, if_exists='replace', index=False)  # Insert dataframe to database. Replace table if it exists
@@ -73,40 +105,32 @@ def lemmas_count():
     Then run PoSTagger.
     """
 
-    # Download needed NLTK packages for lemmatization
-    nltk.download('wordnet')
-    nltk.download('omw-1.4')
-    lemmatizer = nltk.stem.WordNetLemmatizer()
+    nltk_resources.use_resources()  # WordNet is loaded from the shared data folder, never downloaded
+    lemmatizer = lemma_cache.get_lemma_cache()  # WordNet lemmatizer behind a (word, tag) cache
 
     cleaned_dfs = get_all_articles() # Get the new dfs after preprocessing
+    store = token_store.TokenStore()  # Decoder of the PoSTags_cleaned blobs
 
     for df in cleaned_dfs:
         current_df_lemmas_count = []  # A list containing dictionaries of lemmas and their counts for each article
 
         for _, row in df.iterrows():
-            current_article_cleaned_postags = json.loads(row['PoSTags_cleaned'])  # Get the list of cleaned tagged words in list format
-            current_article_lemmas_count = {}  # A dictionary containing lemmas and their counts for each article
-
-            for postag_word in current_article_cleaned_postags:
-                word = postag_word[0]
-                tag = postag_word[1]
-                lemmatized_word = lemmatizer.lemmatize(word, pos=POS_TAGS[tag[0:2]])  # Lemmatize the word
-
-                if lemmatized_word in current_article_lemmas_count:
-                    current_article_lemmas_count[lemmatized_word] += 1
-                else:
-                    current_article_lemmas_count[lemmatized_word] = 1
+            current_article_cleaned_postags = store.decode(row['PoSTags_cleaned'])  # Get the list of cleaned tagged words in list format
+            current_article_lemmas_count = count_lemmas(current_article_cleaned_postags, lemmatizer)  # A dictionary containing lemmas and their counts for each article
             current_df_lemmas_count.append(json.dumps(current_article_lemmas_count))  # Convert dictionary to json object and append it
 
         assert len(current_df_lemmas_count) == len(df.index), "Lemmatizer Error"  # Check that the list's length of lemmas count is equal to the number of articles
         df['lemmas_count'] = current_df_lemmas_count  # Add the list of dictionaries to the dataframe
     
     # Save the new dataframe to the database
-    db = sqlite3.connect(os.path.join(os.path.dirname(pathlib.Path(__file__).parent.resolve()) , "dataA", "db.sqlite3"))  # Establish connection to database
+    db = storage.get_connection()  # Shared connection to the database
 
     for df, table in zip(cleaned_dfs, DATABASE_TABLES):
         df.to_sql(table, db, if_exists='replace', index=False)  # Insert dataframe to database. Replace table if it exists
 
+    lemmatizer.save()  # Keep the cache for the next run
+    print(lemmatizer.report())
+
 if __name__ == "__main__":
     preprocessing()
     lemmas_count()
@@ -0,0 +1,60 @@
+import sys
+import nltk
+import PosTagger
+import preprocessing
+import lemma_cache
+import nltk_resources
+
+NLTK_DATA_DIR = nltk_resources.NLTK_DATA_DIR
+DEFAULT_ANALYZER = None  # Analyzer of this process. Created by get_query_analyzer
+
+class QueryAnalyzer:
+
+    """
+    QUERY PREPROCESSING SYSTEM.
+    Long lived query analyzer. NLTK resources are loaded once, from data_dir (and the usual NLTK data paths), without downloading:
+    the PoS tagger model, the stop words (kept as a set) and WordNet (behind the shared lemma_cache.LemmaCache).
+    A query is analyzed like an article at index time: tagged, cleaned with preprocessing.clean_postags and lemmatized
+    with the same (word, tag) -> WordNet PoS mapping, so a query lemma is always spelled like the lemmas of the index.
+    """
+
+    def __init__(self, data_dir=NLTK_DATA_DIR, lemmatizer=None):
+        self.stop_words = nltk_resources.stop_words(data_dir)  # Puts data_dir on the NLTK data path first
+        self.tagger = PosTagger.get_tagger()
+        self.lemmatizer = lemmatizer if lemmatizer is not None else lemma_cache.get_lemma_cache()
+        self.lemmatizer.lemmatize("warm")  # Load WordNet now instead of on the first query
+
+    def tokenize(self, query):
+
+        """
+        Split a query (words separated by comma) into tokens. preserve_line skips sentence splitting, a query is one line.
+        """
+
+        return [token for part in query.split(",") for token in nltk.word_tokenize(part, preserve_line=True)]
+
+    def analyze(self, query):
+
+        """
+        Return the list of lemmas of the query, in query order.
+        """
+
+        postags = self.tagger.tag(self.tokenize(query)) if query.strip() else []
+        cleaned_postags = preprocessing.clean_postags(postags, self.stop_words)  # Remove stop words, closed tag category words and punctuation
+        return preprocessing.lemma_sequence(cleaned_postags, self.lemmatizer)
+
+def get_query_analyzer():
+
+    """
+    Return the analyzer of this process, creating it the first time.
+    """
+
+    global DEFAULT_ANALYZER
+    if DEFAULT_ANALYZER is None:
+        DEFAULT_ANALYZER = QueryAnalyzer()
+    return DEFAULT_ANALYZER
+
+if __name__ == "__main__":
+
+    if len(sys.argv) > 1 and sys.argv[1] == "download":
+        nltk_resources.download_resources()
+        print("NLTK resources saved to " + NLTK_DATA_DIR)
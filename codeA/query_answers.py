@@ -0,0 +1,166 @@
+import heapq
+from collections import defaultdict
+import pandas as pd
+import binary_index
+import ranking
+import query_analyzer
+import positional_index
+import boolean_query
+import scoring
+
+"""
+QUERY ANSWERING.
+The answer_* functions shared by the interactive window (main.py), the query server (query_server.py) and the benchmarks.
+They only need an open index, no GUI: importing this module does not import tkinter.
+"""
+
+def expand_query(query, terms, max_distance=None, limit=3):
+
+    """
+    Replace the lemmas of a query that are not in the index by their closest lemmas (term_index.TermIndex.expand), so that
+    a misspelled word ("ukrane") still finds documents. Lemmas with no close lemma are kept, they match nothing.
+    Return the expanded list of lemmas.
+    """
+
+    expanded = []
+    for lemma in query:
+        expanded.extend(terms.expand(lemma.lower(), max_distance, limit) or [lemma])
+    return expanded
+
+def answer_query(query, inverted_index_dict, top_k=None, as_dataframe=True, cache=None):
+
+    """
+    Given a query of lemmas, look up the urls that contain those words in the inverted index.
+    If there are more than one word, the weight of a document which contains 2 or more words will be the sum of the two.
+    The ansewer will be returned in descending order.
+    inverted_index_dict is either the dictionary returned by read_xml, a storage.PostingsTable (one indexed query per lemma) or a binary_index.BinaryIndex.
+    Urls with the same total weight are sorted by url, like ranking.max_score_top_k (doc ids are in url order) and
+    batch_query.BatchQueryEngine, so the top_k cutoff selects the same urls in every path.
+    If top_k is given, only the top_k best urls are returned. On a binary index they are found with MaxScore pruning (see ranking.py).
+    If as_dataframe is False, a list of (url, total weight) is returned instead of a dataframe.
+    If a query_cache.QueryCache is given (and the index is a binary index), answers are cached. A cached query is answered as
+    a set of lemmas: order does not matter and a repeated lemma is counted once.
+    """
+
+    query = [lemma.lower() for lemma in query]
+
+    if cache is not None and isinstance(inverted_index_dict, binary_index.BinaryIndex):
+        key = cache.key(query, top_k)
+        answer = cache.get(key, inverted_index_dict.version)
+
+        if answer is None:
+            answer = answer_query(list(key[0]), inverted_index_dict, top_k, as_dataframe=False)  # Answer the normalized query
+            cache.put(key, inverted_index_dict.version, answer)
+        return answer_to_dataframe(query, answer, inverted_index_dict) if as_dataframe else answer
+
+    if top_k is not None and isinstance(inverted_index_dict, binary_index.BinaryIndex):
+        answer = [(inverted_index_dict.url(doc_id), weight) for doc_id, weight in ranking.max_score_top_k(query, inverted_index_dict, top_k)]
+        postings = None
+    else:
+        postings = {lemma: inverted_index_dict[lemma] for lemma in query if lemma in inverted_index_dict}  # Look up every lemma once
+        answer = defaultdict(int)  # Dictionary of urls and their weights. Use defaultdict to avoid KeyError
+        for lemma in query:
+            if lemma in postings:
+                for url in postings[lemma]:
+                    answer[url] += postings[lemma][url]  # Add the weight of the lemma to the answer
+
+        if top_k is None:
+            answer = sorted(answer.items(), key=lambda item: (-item[1], item[0]))
+        else:
+            answer = heapq.nsmallest(top_k, answer.items(), key=lambda item: (-item[1], item[0]))
+
+    if not as_dataframe:
+        return answer
+    return answer_to_dataframe(query, answer, inverted_index_dict, postings)
+
+def answer_positional_query(query, inverted_index_dict, positional, top_k=None, as_dataframe=True):
+
+    """
+    Answer a query text with phrase and proximity operators (see positional_index.parse_query), for example
+    "prime minister" NEAR/10 election
+    Documents must satisfy every phrase and NEAR constraint, checked on positional (positional_index.PositionalIndex).
+    They are ranked like answer_query ranks them: by the sum of the weights of the query lemmas in inverted_index_dict.
+    A query without operators is answered by answer_query.
+    """
+
+    query, constraints = positional_index.parse_query(query, query_analyzer.get_query_analyzer())
+    if not constraints:
+        return answer_query(query, inverted_index_dict, top_k, as_dataframe)
+
+    urls = positional.match(constraints)
+    if isinstance(inverted_index_dict, binary_index.BinaryIndex):
+        postings = None  # Only the weights of the matched documents are looked up
+        answer = [(url, sum(inverted_index_dict.weight(lemma, inverted_index_dict.doc_id(url)) for lemma in query)) for url in urls]
+    else:
+        postings = {lemma: inverted_index_dict[lemma] for lemma in query if lemma in inverted_index_dict}
+        answer = [(url, sum(postings[lemma].get(url, 0) for lemma in query if lemma in postings)) for url in urls]
+    if top_k is None:
+        answer = sorted(answer, key=lambda item: (-item[1], item[0]))  # Ties by url, like answer_query
+    else:
+        answer = heapq.nsmallest(top_k, answer, key=lambda item: (-item[1], item[0]))
+
+    if not as_dataframe:
+        return answer
+    return answer_to_dataframe(query, answer, inverted_index_dict, postings)
+
+def answer_boolean_query(query, inverted_index_dict, top_k=None, as_dataframe=True):
+
+    """
+    Answer a query text with AND, OR, NOT and parentheses (see boolean_query.py), for example
+    (election OR vote) AND minister NOT sport
+    Matching documents are ranked by the sum of the weights of the query lemmas that are not under a NOT.
+    Raises ValueError if the query is malformed.
+    """
+
+    tree = boolean_query.parse_query(query, query_analyzer.get_query_analyzer())
+    answer = boolean_query.BooleanEvaluator(inverted_index_dict).answer(tree, top_k)
+
+    if not as_dataframe:
+        return answer
+    return answer_to_dataframe(boolean_query.query_lemmas(tree), answer, inverted_index_dict)
+
+def answer_scored_query(query, scoring_index, scorer="bm25", top_k=None, as_dataframe=True):
+
+    """
+    Given a query of lemmas, rank the documents with one of the scorers of scoring.SCORERS ("tf_idf", "bm25", "cosine") on scoring_index
+    (read_scoring_index). If top_k is given and the snapshot has impact ordered postings for the scorer, the top_k urls are found with
+    early termination and their scores are the quantized ones (see scoring.py). Otherwise every matching document is scored exactly.
+    If as_dataframe is False, a list of (url, score) is returned instead of a dataframe.
+    """
+
+    query = [lemma.lower() for lemma in query]
+    if scorer not in scoring.SCORERS:
+        raise ValueError("Unknown scorer " + scorer + ", expected one of " + ", ".join(scoring.SCORERS))
+
+    if top_k is not None and scorer in scoring_index.impacts:
+        answer = scoring_index.impact_top_k(query, scorer, top_k)
+    else:
+        answer = scoring_index.score(query, scorer, top_k)
+
+    if not as_dataframe:
+        return answer
+    return answer_to_dataframe(query, answer, None, scoring_index.postings(query, [url for url, _ in answer], scorer))
+
+def answer_to_dataframe(query, answer, inverted_index_dict, postings=None):
+
+    """
+    Presentation of an answer [(url, total weight), ...].
+    Return a dataframe of (url, weight of lemma ..., total weight) in the order of the answer.
+    postings {lemma: {url: weight}} can be passed if it is already loaded, otherwise weights are looked up in the index.
+    """
+
+    final_answer = []  # List of lists [url, weight of lemma ..., total weight]
+    for url, total_weight in answer:
+        temp_list = [url]
+        for lemma in query:
+            if postings is not None:
+                temp_list.append(postings[lemma].get(url, 0) if lemma in postings else 0)
+            elif isinstance(inverted_index_dict, binary_index.BinaryIndex):
+                temp_list.append(inverted_index_dict.weight(lemma, inverted_index_dict.doc_id(url)))
+            else:
+                temp_list.append(inverted_index_dict[lemma].get(url, 0) if lemma in inverted_index_dict else 0)
+        temp_list.append(total_weight)
+        final_answer.append(temp_list)
+
+    pd.set_option('display.max_colwidth', None)
+    return pd.DataFrame(final_answer, columns=['url'] + query + ['total_weight'])
@@ -0,0 +1,85 @@
+import threading
+from collections import OrderedDict
+
+class QueryCache:
+
+    """
+    QUERY RESULT CACHE.
+    Bounded LRU cache of answers [(url, total weight), ...] keyed on the normalized query: lower case lemmas, deduplicated and
+    sorted (so "ukraine,war" and "war,ukraine,war" share an entry), plus top_k.
+    Every entry belongs to one index version (binary_index.BinaryIndex.version, the build time of the index).
+    When a lookup is made with another version, for example after create_inverted_index and read_binary_index, the cache is cleared.
+    """
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self.version = None
+        self.entries = OrderedDict()  # {(lemmas, top_k): answer}, least recently used first
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def key(query, top_k=None):
+
+        """
+        Normalized cache key of a query (list of lemmas).
+        """
+
+        return tuple(sorted(set(lemma.lower() for lemma in query))), top_k
+
+    def _check_version(self, version):
+        if version != self.version:
+            if self.entries:
+                self.invalidations += 1
+            self.entries.clear()
+            self.version = version
+
+    def get(self, key, version):
+
+        """
+        Return the cached answer of the key for this index version, None if it is not cached.
+        """
+
+        with self.lock:
+            self._check_version(version)
+            if key not in self.entries:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return list(self.entries[key])  # Copy, callers may change their answer
+
+    def put(self, key, version, answer):
+
+        """
+        Cache the answer of the key for this index version.
+        """
+
+        with self.lock:
+            self._check_version(version)
+            self.entries[key] = list(answer)
+            self.entries.move_to_end(key)
+
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)  # Evict the least recently used answer
+                self.evictions += 1
+
+    def stats(self):
+
+        """
+        Return a dictionary of cache counters.
+        """
+
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+            'size': len(self.entries),
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
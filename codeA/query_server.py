@@ -0,0 +1,284 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import traceback
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import snapshot
+import query_cache
+import query_analyzer
+import query_answers
+
+WORKER_SNAPSHOTS = None  # snapshot.SnapshotReader of a scoring worker. Opened once per worker by open_worker_snapshots
+
+"""
+QUERY SERVER.
+Long running HTTP/JSON query service on localhost. The index is memory mapped once and queries are answered concurrently.
+When a build publishes a new index snapshot the server switches to it, queries already running finish on the old one.
+    POST /query  {"query": "ukraine,war", "top_k": 10}  ->  {"query": ..., "lemmas": [...], "results": [[url, weight], ...], "cached": ..., "latency_ms": ...}
+    GET  /stats  ->  request counters, latency percentiles and query cache counters
+Query analysis (PoS tagging) runs in a thread of the server so the event loop keeps serving other connections, the result cache
+on the event loop, scoring in a pool of worker processes (or threads). The server does not import the GUI (main.py).
+At most max_pending queries wait for a worker, more are rejected with 503 so that a burst can not grow the queue without bounds.
+A request that fails gets a 500, every connection is closed.
+"""
+
+def open_worker_snapshots(snapshots_dir, check_interval):
+
+    """
+    Initializer of the scoring workers. Memory map the current index snapshot once per worker process.
+    """
+
+    global WORKER_SNAPSHOTS
+    WORKER_SNAPSHOTS = snapshot.SnapshotReader(snapshots_dir, check_interval)
+
+def score_query(lemmas, top_k):
+
+    """
+    Runs in a scoring worker. Return (index version, answer [(url, total weight), ...]) of a list of lemmas.
+    """
+
+    with WORKER_SNAPSHOTS.acquire() as index:
+        return index.version, query_answers.answer_query(lemmas, index, top_k, as_dataframe=False)
+
+def percentile(values, fraction):
+
+    """
+    Nearest rank percentile of a list of numbers, 0 if the list is empty.
+    """
+
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+class QueryServer:
+
+    """
+    Asyncio query server, see the module docstring.
+    Set use_processes to False to score in threads of this process instead (lighter to start, but scoring holds the GIL).
+    analyzer is the query_analyzer.QueryAnalyzer of the process by default, any object with an analyze(text) -> lemmas method works.
+    """
+
+    def __init__(self, snapshots_dir=None, host="127.0.0.1", port=8080, workers=4, max_pending=64, top_k=10, use_processes=True, check_interval=1.0, analyzer=None):
+        self.snapshots_dir = snapshots_dir
+        self.check_interval = check_interval
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.max_pending = max_pending
+        self.top_k = top_k
+        self.use_processes = use_processes
+
+        self.snapshots = snapshot.SnapshotReader(snapshots_dir, check_interval)
+        self.analyzer = analyzer if analyzer is not None else query_analyzer.get_query_analyzer()
+        self.cache = query_cache.QueryCache()
+        self.executor = None
+        self.analysis_executor = ThreadPoolExecutor(1)  # One thread: the tagger and the lemma cache are not thread safe
+        self.server = None
+        self.pending = 0  # Queries waiting for or running in a worker
+        self.requests = 0
+        self.rejected = 0
+        self.latencies = deque(maxlen=10000)  # Latency (ms) of the last queries
+
+    async def start(self):
+
+        """
+        Start the worker pool and listen. Return the port (useful with port=0).
+        """
+
+        if self.use_processes:
+            # Spawned, not forked: a forked worker would inherit the reader locks of the server's open snapshots (see snapshot.py),
+            # which then could never be garbage collected, and the sockets of the open connections
+            self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"), initializer=open_worker_snapshots,
+                                                initargs=(self.snapshots_dir, self.check_interval))
+            await asyncio.get_running_loop().run_in_executor(self.executor, os.getpid)  # Workers are ready before the server listens
+        else:
+            global WORKER_SNAPSHOTS
+            WORKER_SNAPSHOTS = self.snapshots  # Threads share the snapshots of the server
+            self.executor = ThreadPoolExecutor(self.workers)
+
+        self.server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def stop(self):
+
+        """
+        Stop listening, wait for the running queries and shut the pool down.
+        """
+
+        self.server.close()
+        await self.server.wait_closed()
+        self.executor.shutdown(wait=True)
+        self.analysis_executor.shutdown(wait=True)
+        self.snapshots.close()
+
+    async def serve_forever(self):
+        await self.start()
+        print("Query server listening on http://" + self.host + ":" + str(self.port))
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def answer(self, text, top_k):
+
+        """
+        Analyze and answer one query. Return (lemmas, answer, cached).
+        """
+
+        lemmas = await asyncio.get_running_loop().run_in_executor(self.analysis_executor, self.analyzer.analyze, text)
+        key = self.cache.key(lemmas, top_k)
+        with self.snapshots.acquire() as index:
+            version = index.version  # Checks for a new snapshot
+        answer = self.cache.get(key, version)
+        if answer is not None:
+            return lemmas, answer, True
+
+        answer_version, answer = await asyncio.get_running_loop().run_in_executor(self.executor, score_query, list(key[0]), top_k)
+        if answer_version == version:  # While switching, a worker may still answer from the previous snapshot
+            self.cache.put(key, version, answer)
+        return lemmas, answer, False
+
+    def stats(self):
+
+        """
+        Return the server counters as a dictionary.
+        """
+
+        latencies = list(self.latencies)
+        return {
+            'requests': self.requests,
+            'rejected': self.rejected,
+            'pending': self.pending,
+            'index_version': self.snapshots.version,
+            'reloads': self.snapshots.reloads,
+            'latency_ms': {'p50': percentile(latencies, 0.50), 'p95': percentile(latencies, 0.95), 'p99': percentile(latencies, 0.99)},
+            'cache': self.cache.stats(),
+        }
+
+    async def handle_connection(self, reader, writer):
+
+        """
+        Read one HTTP request, answer it and close the connection. An unexpected error is answered with a 500.
+        """
+
+        try:
+            status, payload, headers = await self.respond(reader)
+        except Exception as error:
+            traceback.print_exc()
+            status, payload, headers = 500, {'error': 'internal error: ' + type(error).__name__}, None
+
+        try:
+            await write_response(writer, status, payload, headers)
+        except ConnectionError:
+            pass  # The client is gone
+        finally:
+            writer.close()
+
+    async def respond(self, reader):
+
+        """
+        Read one HTTP request and answer it. Return (status, JSON payload, extra headers or None).
+        """
+
+        start_time = time.perf_counter()
+        try:
+            method, path, body = await read_request(reader)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            return 400, {'error': 'bad request'}, None
+
+        if method == "GET" and path == "/stats":
+            return 200, self.stats(), None
+        if method != "POST" or path != "/query":
+            return 404, {'error': 'not found'}, None
+
+        try:
+            request = json.loads(body or b"{}")
+            text = request['query']
+            top_k = int(request.get('top_k', self.top_k))
+        except (ValueError, KeyError, TypeError):
+            return 400, {'error': 'expected {"query": "word,word", "top_k": 10}'}, None
+
+        self.requests += 1
+        if self.pending >= self.max_pending:
+            self.rejected += 1  # Backpressure: do not queue more work than the workers can catch up with
+            return 503, {'error': 'too many pending queries'}, {'Retry-After': '1'}
+
+        self.pending += 1
+        try:
+            lemmas, answer, cached = await self.answer(text, top_k)
+        finally:
+            self.pending -= 1
+
+        latency = (time.perf_counter() - start_time) * 1000
+        self.latencies.append(latency)
+        response = {'query': text, 'lemmas': lemmas, 'results': answer, 'cached': cached, 'latency_ms': latency}
+        return 200, response, {'X-Latency-Ms': str(round(latency, 3))}
+
+async def read_request(reader):
+
+    """
+    Read an HTTP request. Return (method, path, body).
+    """
+
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    method, path, _ = lines[0].split(" ", 2)
+    headers = {}
+
+    for line in lines[1:]:
+        if ":" in line:
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+
+    body = await reader.readexactly(int(headers.get('content-length', 0)))
+    return method, path, body
+
+async def write_response(writer, status, payload, headers=None):
+
+    """
+    Write a JSON response and close the connection.
+    """
+
+    reasons = {200: "OK", 400: "Bad Request", 404: "Not Found", 500: "Internal Server Error", 503: "Service Unavailable"}
+    body = json.dumps(payload).encode("utf-8")
+    head = "HTTP/1.1 " + str(status) + " " + reasons[status] + "\r\nContent-Type: application/json\r\nContent-Length: " + str(len(body)) + "\r\nConnection: close\r\n"
+
+    for name, value in (headers or {}).items():
+        head += name + ": " + value + "\r\n"
+    writer.write(head.encode("latin-1") + b"\r\n" + body)
+    await writer.drain()
+    writer.close()
+    await writer.wait_closed()
+
+async def request(method, path, payload=None, host="127.0.0.1", port=8080):
+
+    """
+    Minimal client. Send a request to the server and return (status, decoded JSON body).
+    """
+
+    reader, writer = await asyncio.open_connection(host, port)
+    body = json.dumps(payload).encode("utf-8") if payload is not None else b""
+    writer.write((method + " " + path + " HTTP/1.1\r\nHost: " + host + "\r\nContent-Type: application/json\r\nContent-Length: " + str(len(body)) + "\r\n\r\n").encode("latin-1") + body)
+    await writer.drain()
+
+    response = await reader.read()  # The server closes the connection after the response
+    writer.close()
+    await writer.wait_closed()
+    head, response_body = response.split(b"\r\n\r\n", 1)
+    return int(head.split(b" ", 2)[1]), json.loads(response_body)
+
+async def query(text, top_k=10, host="127.0.0.1", port=8080):
+
+    """
+    Send a query to the server and return its JSON answer.
+    """
+
+    _, answer = await request("POST", "/query", {'query': text, 'top_k': top_k}, host, port)
+    return answer
+
+if __name__ == "__main__":
+    asyncio.run(QueryServer(port=int(sys.argv[1]) if len(sys.argv) > 1 else 8080, workers=os.cpu_count()).serve_forever())
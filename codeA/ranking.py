@@ -0,0 +1,75 @@
+import heapq
+import numpy as np
+
+def max_score_top_k(query, index, k):
+
+    """
+    TOP-K QUERY EVALUATION.
+    Return the k documents with the highest total weight for the query as a list of (doc_id, total weight), in descending order.
+    Uses MaxScore dynamic pruning over the doc id sorted postings of a binary_index.BinaryIndex:
+    Query lemmas are sorted by their max weight (upper bound). Once the k-th best score (threshold) is higher than the sum of the
+    upper bounds of the weakest lemmas, those lemmas become non essential. Documents that only contain non essential lemmas are
+    never visited and non essential postings are only probed (binary search) for documents that can still enter the top k.
+    Weights can be negative (idf = log(N / (1 + df)) < 0 for a lemma in every article): a lemma never lowers the upper bound of a
+    document, so its bound is max(0, max weight).
+    The postings stay numpy views of the mapped file, cursors move with searchsorted.
+    Ties are broken in favour of the smaller doc id.
+    """
+
+    if k <= 0:
+        return []
+
+    # One cursor per query lemma: [doc ids, weights, position, upper bound]. Lemmas that are not in the index are skipped
+    cursors = []
+    for lemma in query:
+        lemma_id = index.lemma_id(lemma)
+        if lemma_id >= 0:
+            doc_ids, weights = index.postings(lemma_id)
+            cursors.append([doc_ids, weights, 0, max(0.0, index.max_weight(lemma_id))])
+    cursors.sort(key=lambda cursor: cursor[3])  # Weakest lemma first
+
+    # upper_bounds[i] = sum of the upper bounds of cursors[0..i]
+    upper_bounds = []
+    for cursor in cursors:
+        upper_bounds.append(cursor[3] + (upper_bounds[-1] if upper_bounds else 0))
+
+    heap = []  # Min heap of (total weight, -doc_id). heap[0] is the current k-th best document
+    threshold = float("-inf")
+    first_essential = 0  # cursors[first_essential:] are the essential lemmas
+
+    while first_essential < len(cursors):
+
+        # The next candidate is the smallest doc id among the essential lemmas
+        essential = cursors[first_essential:]
+        current = min((int(cursor[0][cursor[2]]) for cursor in essential if cursor[2] < len(cursor[0])), default=None)
+        if current is None:
+            break
+
+        score = 0
+        for cursor in essential:
+            if cursor[2] < len(cursor[0]) and cursor[0][cursor[2]] == current:
+                score += float(cursor[1][cursor[2]])
+                cursor[2] += 1
+
+        # Probe the non essential lemmas, strongest first, while the document can still enter the top k
+        for i in range(first_essential - 1, -1, -1):
+            if score + upper_bounds[i] <= threshold:
+                break
+            cursor = cursors[i]
+            cursor[2] += int(np.searchsorted(cursor[0][cursor[2]:], current, side="left"))  # Slices of a view are not copied
+            if cursor[2] < len(cursor[0]) and cursor[0][cursor[2]] == current:
+                score += float(cursor[1][cursor[2]])
+
+        if len(heap) < k:
+            heapq.heappush(heap, (score, -current))
+        elif (score, -current) > heap[0]:
+            heapq.heapreplace(heap, (score, -current))
+        else:
+            continue
+
+        if len(heap) == k:
+            threshold = heap[0][0]
+            while first_essential < len(cursors) and upper_bounds[first_essential] <= threshold:
+                first_essential += 1  # This lemma alone (with the weaker ones) can not beat the threshold anymore
+
+    return [(-negative_doc_id, score) for score, negative_doc_id in sorted(heap, reverse=True)]
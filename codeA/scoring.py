@@ -0,0 +1,408 @@
+import os
+import json
+import mmap
+import time
+import struct
+import numpy as np
+import binary_index
+import token_store
+import storage
+
+DATABASE_TABLES = ["foxnews", "aljazeera", "bcc"]
+COUNTS_FILE = "counts.bin"  # binary_index.BinaryIndex of the lemma counts (exact in float32)
+LENGTHS_FILE = "doc_lengths.u4"  # Length of PoSTags_cleaned of every document, in doc id order
+NORMS_FILE = "doc_norms.f8"  # Cosine norm of every document, in doc id order
+STATS_FILE = "scoring.json"  # {"documents": number of articles, "avg_length": ...}
+IMPACTS_FILE = "impacts.{}.bin"  # Impact ordered postings of one scorer
+IMPACT_MAGIC = b"NLPIMPCT"
+IMPACT_FORMAT_VERSION = 2
+IMPACT_HEADER = struct.Struct("<8sIIQdq")  # magic, version, n_lemmas, n_postings, scale, created
+IMPACT_SECTIONS = ["postings_offsets", "doc_ids", "impacts", "lemma_runs", "run_offsets", "doc_impacts"]
+IMPACT_SECTION_TABLE = struct.Struct("<" + "Q" * len(IMPACT_SECTIONS))
+IMPACT_LEVELS = 255  # Impacts are quantized to uint8
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+"""
+PLUGGABLE SCORING.
+The snapshot's binary index stores tf-idf weights. A snapshot built with scoring (create_inverted_index(scorers=[...]))
+also stores what any scoring function needs, computed once at index time:
+the lemma counts of every document (a binary index whose weights are counts), the document lengths and cosine norms,
+and the number of articles. A scorer is a vectorized function of (counts, doc ids, df, stats) registered in SCORERS,
+so tf-idf, BM25 and cosine (or a new scorer) are chosen per query without rebuilding anything.
+
+For the scorers listed at build time, the postings are also stored impact ordered: weights quantized to uint8 impacts
+(one scale for the whole index) and every lemma's postings sorted by decreasing impact. ScoringIndex.impact_top_k
+walks the postings of all query lemmas from the highest impact down, one run of equal impacts at a time (the run offsets
+are stored, so a step costs the run it reads), and stops as soon as the documents left cannot change the top k, usually long
+before the end of the lists. The scores of the top k are then completed by binary search of the k documents in the impacts
+stored in doc id order, next to the counts index postings, instead of scanning the unread postings. Impact scores are the quantized ones.
+"""
+
+class DocumentStats:
+
+    """
+    Collection statistics the scorers use: number of articles, document lengths, average length and cosine norms (by doc id).
+    """
+
+    def __init__(self, documents, lengths, norms):
+        self.documents = documents
+        self.lengths = lengths
+        self.avg_length = float(lengths.mean()) if len(lengths) else 0.0
+        self.norms = norms
+
+def tf_idf(counts, doc_ids, df, stats):
+
+    """
+    The weight of inverted_index.tf_idf_weight: (count / document length) * log(articles / (1 + df)).
+    """
+
+    return counts / stats.lengths[doc_ids] * np.log(stats.documents / (1 + df))
+
+def bm25(counts, doc_ids, df, stats):
+
+    """
+    Okapi BM25 with k1 = BM25_K1 and b = BM25_B, and the idf log(1 + (N - df + 0.5) / (df + 0.5)) that is never negative.
+    """
+
+    idf = np.log(1 + (stats.documents - df + 0.5) / (df + 0.5))
+    length_norm = BM25_K1 * (1 - BM25_B + BM25_B * stats.lengths[doc_ids] / stats.avg_length)
+    return idf * counts * (BM25_K1 + 1) / (counts + length_norm)
+
+def cosine(counts, doc_ids, df, stats):
+
+    """
+    Cosine similarity of (1 + log count) * idf document vectors with idf query vectors. The query norm is the same for
+    every document, so it is left out: the ranking is the cosine ranking.
+    """
+
+    idf = np.log(stats.documents / df)
+    return (1 + np.log(counts)) * idf * idf / stats.norms[doc_ids]
+
+def lemma_postings(counts_index, lemma_id):
+
+    """
+    (doc ids, counts) of a lemma of a counts index, as int64 / float64 arrays.
+    """
+
+    doc_ids, counts = counts_index.postings(lemma_id)
+    return doc_ids.astype(np.int64), counts.astype(np.float64)
+
+def cosine_norms(counts_index, documents):
+
+    """
+    L2 norm of every document's (1 + log count) * idf vector, accumulated one lemma at a time. Documents with a zero vector get norm 1.
+    """
+
+    squares = np.zeros(counts_index.n_docs)
+    for lemma_id in range(counts_index.n_lemmas):
+        doc_ids, counts = lemma_postings(counts_index, lemma_id)
+        weights = (1 + np.log(counts)) * np.log(documents / max(len(doc_ids), 1))
+        squares[doc_ids] += weights * weights  # doc_ids are distinct within a posting list
+    norms = np.sqrt(squares)
+    norms[norms == 0] = 1
+    return norms
+
+SCORERS = {"tf_idf": tf_idf, "bm25": bm25, "cosine": cosine}  # Register new scorers here
+
+def read_counts():
+
+    """
+    Read the lemma counts and the lengths of every article from the lemmas_count and PoSTags_cleaned columns.
+    Return ({lemma: {url: count}}, {url: length}, number of articles).
+    """
+
+    db = storage.get_connection()
+    lemma_counts = {}
+    lengths = {}
+    documents = 0
+
+    for table in DATABASE_TABLES:
+        query = "SELECT url, length(PoSTags_cleaned), lemmas_count FROM " + table + " WHERE lemmas_count IS NOT NULL"
+        for url, blob_length, lemmas_count in db.execute(query):
+            documents += 1
+            if url in lengths:  # The same url can appear twice. Keep the last one like lemmas_tf_idf does
+                for counts in lemma_counts.values():
+                    counts.pop(url, None)
+            lengths[url] = (blob_length or 0) // token_store.BYTES_PER_TOKEN
+            for lemma, count in json.loads(lemmas_count).items():
+                if lemma not in lemma_counts:
+                    lemma_counts[lemma] = {}
+                lemma_counts[lemma][url] = count
+    return lemma_counts, lengths, documents
+
+def write_scoring_index(snapshot_dir, lemma_counts, lengths, documents, lemmas_lexicon=None, impact_scorers=()):
+
+    """
+    Write the scoring files of a snapshot from {lemma: {url: count}} and {url: length}: the counts index, then the files of write_scoring_files.
+    """
+
+    counts_path = os.path.join(snapshot_dir, COUNTS_FILE)
+    binary_index.write_binary_index(lemma_counts, counts_path, lemmas_lexicon)
+
+    with binary_index.BinaryIndex(counts_path) as counts_index:
+        urls = [counts_index.url(doc_id) for doc_id in range(counts_index.n_docs)]
+    write_scoring_files(snapshot_dir, np.array([lengths[url] for url in urls], dtype="<u4"), documents, impact_scorers)
+
+def write_scoring_files(snapshot_dir, doc_lengths, documents, impact_scorers=()):
+
+    """
+    Write the scoring files of a snapshot whose counts index is already written: the document lengths (doc_lengths, in doc id order),
+    norms and statistics, and the impact ordered postings of every scorer in impact_scorers.
+    The counts index is read one lemma at a time, so only arrays of one value per document are kept in memory.
+    """
+
+    with binary_index.BinaryIndex(os.path.join(snapshot_dir, COUNTS_FILE)) as counts_index:
+        norms = cosine_norms(counts_index, documents)
+        stats = DocumentStats(documents, doc_lengths.astype(np.float64), norms)
+
+        for name in impact_scorers:
+            write_impacts(os.path.join(snapshot_dir, IMPACTS_FILE.format(name)), counts_index, SCORERS[name], stats)
+
+    doc_lengths.astype("<u4").tofile(os.path.join(snapshot_dir, LENGTHS_FILE))
+    norms.astype("<f8").tofile(os.path.join(snapshot_dir, NORMS_FILE))
+    with open(os.path.join(snapshot_dir, STATS_FILE), "w", encoding="utf-8") as f:
+        json.dump({'documents': documents, 'avg_length': stats.avg_length, 'impact_scorers': list(impact_scorers)}, f)
+
+def write_impacts(path, counts_index, scorer, stats):
+
+    """
+    Quantize the weights of every posting to uint8 impacts and save the postings of every lemma sorted by decreasing impact
+    (then doc id), the offsets of its runs of equal impacts, and the impacts in doc id order (the order of the counts index).
+    Negative weights (tf-idf of lemmas found in almost every document) get impact 0.
+    Two passes over the counts index, one lemma at a time: the highest weight sets the scale, then the postings are appended
+    to temporary files next to path, like binary_index.BinaryIndexWriter does.
+    """
+
+    def lemma_weights(lemma_id):
+        doc_ids, counts = lemma_postings(counts_index, lemma_id)
+        return doc_ids, np.maximum(scorer(counts, doc_ids, len(doc_ids), stats), 0)
+
+    max_weight = max((float(weights.max()) for _, weights in map(lemma_weights, range(counts_index.n_lemmas)) if len(weights)), default=0.0)
+    scale = IMPACT_LEVELS / max_weight if max_weight > 0 else 1.0
+
+    files = [open(path + "." + name + ".tmp", "w+b") for name in ["doc_ids", "impacts", "doc_impacts"]]
+    lemma_runs = [0]  # First run of every lemma
+    run_offsets = []  # Start of every run, then the number of postings
+    n_postings = 0
+    try:
+        for lemma_id in range(counts_index.n_lemmas):
+            doc_ids, weights = lemma_weights(lemma_id)
+            impacts = np.rint(weights * scale).astype(np.uint8)
+            order = np.lexsort((doc_ids, -impacts.astype(np.int64)))
+            ordered_impacts = impacts[order]
+
+            starts = np.flatnonzero(np.concatenate([[True], ordered_impacts[1:] != ordered_impacts[:-1]]))[:len(impacts)]  # A run starts where the impact changes
+            run_offsets.extend((starts + n_postings).tolist())
+            lemma_runs.append(len(run_offsets))
+            n_postings += len(impacts)
+
+            for f, values in zip(files, [doc_ids[order].astype("<u4"), ordered_impacts, impacts]):
+                f.write(values.tobytes())
+        run_offsets.append(n_postings)
+
+        postings_offsets = np.asarray(counts_index.all_postings()[0], dtype="<u8").tobytes()
+        sections = [postings_offsets, files[0], files[1], np.array(lemma_runs, dtype="<u8").tobytes(), np.array(run_offsets, dtype="<u8").tobytes(), files[2]]
+        header = IMPACT_HEADER.pack(IMPACT_MAGIC, IMPACT_FORMAT_VERSION, counts_index.n_lemmas, n_postings, scale, time.time_ns())
+        binary_index.write_sections(path, header, sections)
+    finally:
+        for f in files:
+            f.close()
+            os.remove(f.name)
+
+def build_scoring_index(snapshot_dir, lemmas_lexicon=None, impact_scorers=()):
+
+    """
+    Build the scoring files of a snapshot from the database.
+    """
+
+    lemma_counts, lengths, documents = read_counts()
+    write_scoring_index(snapshot_dir, lemma_counts, lengths, documents, lemmas_lexicon, impact_scorers)
+
+class ImpactPostings:
+
+    """
+    Memory mapped impact ordered postings of one scorer. Lemma ids are the ones of the counts index.
+    """
+
+    def __init__(self, path):
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.n_lemmas, n_postings, self.scale, self.created = IMPACT_HEADER.unpack_from(self._mm, 0)
+        if magic != IMPACT_MAGIC or version != IMPACT_FORMAT_VERSION:
+            self.close()
+            raise ValueError(path + " is not an impact file of this version. Rebuild the inverted index")
+        offsets = dict(zip(IMPACT_SECTIONS, IMPACT_SECTION_TABLE.unpack_from(self._mm, IMPACT_HEADER.size)))
+
+        self._postings_offsets = np.frombuffer(self._mm, dtype="<u8", count=self.n_lemmas + 1, offset=offsets["postings_offsets"])
+        self._doc_ids = np.frombuffer(self._mm, dtype="<u4", count=n_postings, offset=offsets["doc_ids"])
+        self._impacts = np.frombuffer(self._mm, dtype=np.uint8, count=n_postings, offset=offsets["impacts"])
+        self._lemma_runs = np.frombuffer(self._mm, dtype="<u8", count=self.n_lemmas + 1, offset=offsets["lemma_runs"])
+        self._run_offsets = np.frombuffer(self._mm, dtype="<u8", count=int(self._lemma_runs[-1]) + 1, offset=offsets["run_offsets"])
+        self._doc_impacts = np.frombuffer(self._mm, dtype=np.uint8, count=n_postings, offset=offsets["doc_impacts"])
+
+    def postings(self, lemma_id):
+
+        """
+        (doc ids, impacts) of the lemma, by decreasing impact.
+        """
+
+        start, end = int(self._postings_offsets[lemma_id]), int(self._postings_offsets[lemma_id + 1])
+        return self._doc_ids[start:end], self._impacts[start:end]
+
+    def runs(self, lemma_id):
+
+        """
+        Start of every run of equal impacts in the lemma's postings(), followed by their length. Impacts decrease from run to run.
+        """
+
+        first, last = int(self._lemma_runs[lemma_id]), int(self._lemma_runs[lemma_id + 1])
+        return (self._run_offsets[first:last + 1] - self._postings_offsets[lemma_id]).astype(np.int64)
+
+    def doc_impacts(self, lemma_id):
+
+        """
+        Impacts of the lemma in doc id order, aligned with its postings in the counts index.
+        """
+
+        return self._doc_impacts[int(self._postings_offsets[lemma_id]):int(self._postings_offsets[lemma_id + 1])]
+
+    def close(self):
+        self._postings_offsets = self._doc_ids = self._impacts = self._lemma_runs = self._run_offsets = self._doc_impacts = None
+        if getattr(self, "_mm", None) is not None:
+            self._mm.close()
+            self._mm = None
+        self._file.close()
+
+class ScoringIndex:
+
+    """
+    Scoring files of a snapshot. score() ranks with any scorer of SCORERS, impact_top_k() with the impact ordered postings
+    of the scorers listed at build time. If the snapshot's lexicon.Lexicon is given, lemma ids are looked up in it.
+    """
+
+    def __init__(self, snapshot_dir, lemmas_lexicon=None):
+        self.path = snapshot_dir
+        with open(os.path.join(snapshot_dir, STATS_FILE), encoding="utf-8") as f:
+            info = json.load(f)
+
+        self.counts = binary_index.BinaryIndex(os.path.join(snapshot_dir, COUNTS_FILE), lemmas_lexicon)
+        lengths = np.fromfile(os.path.join(snapshot_dir, LENGTHS_FILE), dtype="<u4").astype(np.float64)
+        self.stats = DocumentStats(info['documents'], lengths, np.fromfile(os.path.join(snapshot_dir, NORMS_FILE), dtype="<f8"))
+        self.impacts = {name: ImpactPostings(os.path.join(snapshot_dir, IMPACTS_FILE.format(name))) for name in info['impact_scorers']}
+
+    def close(self):
+        self.counts.close()
+        for impacts in self.impacts.values():
+            impacts.close()
+
+    def weights(self, lemma, scorer="tf_idf"):
+
+        """
+        (doc ids, float32 weights) of the lemma with the given scorer, sorted by doc id.
+        """
+
+        doc_ids, counts = self.counts.postings(lemma)
+        if len(doc_ids) == 0:
+            return doc_ids, np.zeros(0, dtype=np.float32)
+        return doc_ids, SCORERS[scorer](counts.astype(np.float64), doc_ids, len(doc_ids), self.stats).astype(np.float32)
+
+    def postings(self, query, urls, scorer="tf_idf"):
+
+        """
+        Weights of the query lemmas in the given documents: {lemma: {url: weight}}, for presenting an answer.
+        """
+
+        doc_ids = np.array([self.counts.doc_id(url) for url in urls], dtype=np.int64)
+        postings = {}
+        for lemma in query:
+            lemma_doc_ids, weights = self.weights(lemma, scorer)
+            positions = np.minimum(np.searchsorted(lemma_doc_ids, doc_ids), max(len(lemma_doc_ids) - 1, 0))
+            found = (doc_ids >= 0) & (lemma_doc_ids[positions] == doc_ids) if len(lemma_doc_ids) else np.zeros(len(doc_ids), dtype=bool)
+            postings[lemma] = {url: float(weights[position]) for url, position, is_found in zip(urls, positions.tolist(), found.tolist()) if is_found}
+        return postings
+
+    def score(self, query, scorer="tf_idf", top_k=None):
+
+        """
+        Rank every document containing a query lemma by the sum of its weights. Return [(url, total weight), ...]
+        by descending weight (then url), only the top_k best if given. With tf_idf the totals are the ones of query_answers.answer_query.
+        """
+
+        scores = np.zeros(self.counts.n_docs)
+        matched = np.zeros(self.counts.n_docs, dtype=bool)
+
+        for lemma in query:
+            doc_ids, weights = self.weights(lemma, scorer)
+            scores[doc_ids] += weights  # doc_ids are distinct within a posting list
+            matched[doc_ids] = True
+
+        candidates = np.flatnonzero(matched)
+        order = candidates[np.lexsort((candidates, -scores[candidates]))]
+        if top_k is not None:
+            order = order[:top_k]
+        return [(self.counts.url(doc_id), float(scores[doc_id])) for doc_id in order]
+
+    def impact_top_k(self, query, scorer, k):
+
+        """
+        Top k documents by quantized score, with early termination on the impact ordered postings of the scorer.
+        Return [(url, score), ...] by descending score (then url). Scores are sums of impacts divided by the scale of the index.
+        """
+
+        impact_postings = self.impacts[scorer]
+        lists = []  # [doc ids, impacts, run starts, next run] of every query lemma in the index
+        lemma_ids = []
+        for lemma in query:
+            lemma_id = self.counts.lemma_id(lemma)
+            if lemma_id >= 0:
+                lists.append(list(impact_postings.postings(lemma_id)) + [impact_postings.runs(lemma_id), 0])
+                lemma_ids.append(lemma_id)
+
+        scores = np.zeros(self.counts.n_docs, dtype=np.int64)
+        seen = np.zeros(self.counts.n_docs, dtype=bool)
+        seen_doc_ids = []  # Arrays of the documents seen so far
+        n_seen = 0
+
+        while k > 0:
+            active = [postings for postings in lists if postings[3] < len(postings[2]) - 1]
+            if not active:
+                break
+
+            # Add the highest impact run left, of every list that has it
+            level = max(int(impacts[runs[run]]) for _, impacts, runs, run in active)
+            for postings in active:
+                doc_ids, impacts, runs, run = postings
+                if impacts[runs[run]] == level:
+                    batch = doc_ids[runs[run]:runs[run + 1]]
+                    scores[batch] += level
+                    new = batch[~seen[batch]]
+                    seen[new] = True
+                    seen_doc_ids.append(new)
+                    n_seen += len(new)
+                    postings[3] = run + 1
+
+            # Stop when no document outside the top k can reach the k-th score with what is left
+            if n_seen >= k:
+                remaining = sum(int(impacts[runs[run]]) for _, impacts, runs, run in lists if run < len(runs) - 1)
+                seen_doc_ids = [np.concatenate(seen_doc_ids)]
+                seen_scores = -np.partition(-scores[seen_doc_ids[0]], [k - 1, k] if n_seen > k else k - 1)
+                outside = seen_scores[k] if n_seen > k else 0  # Documents never seen have 0
+                if seen_scores[k - 1] > outside + remaining:
+                    break
+
+        if n_seen == 0:
+            return []
+        candidates = np.concatenate(seen_doc_ids)
+        top = candidates[np.lexsort((candidates, -scores[candidates]))][:k]
+
+        # The top k is known, complete its scores by looking the k documents up in the doc id ordered impacts
+        totals = np.zeros(len(top), dtype=np.int64)
+        for lemma_id in lemma_ids:
+            doc_ids = self.counts.postings(lemma_id)[0]
+            positions = np.minimum(np.searchsorted(doc_ids, top), len(doc_ids) - 1)
+            found = doc_ids[positions] == top
+            totals[found] += impact_postings.doc_impacts(lemma_id)[positions[found]]
+        order = np.lexsort((top, -totals))
+        return [(self.counts.url(doc_id), float(total) / impact_postings.scale) for doc_id, total in zip(top[order].tolist(), totals[order].tolist())]
@@ -0,0 +1,228 @@
+import os
+import sys
+import json
+import math
+import heapq
+import threading
+import multiprocessing
+from itertools import islice
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import nltk_resources
+import PosTagger
+import pipeline
+import binary_index
+import lexicon
+import lemma_cache
+import snapshot
+import storage
+import token_store
+import paths
+
+SHARDS_FOLDER = "shards"  # In the data folder (paths.py), one snapshots folder per source
+LENGTHS_FILE = "doc_lengths.u4"  # Length of PoSTags_cleaned of every document of the shard, in doc id order
+SHARD_FILE = "shard.json"  # {"source": ..., "documents": number of articles, with or without lemmas}
+
+"""
+SOURCE SHARDED INDEX.
+Every source (foxnews, aljazeera, bcc) is indexed as its own shard, built by its own process and published as a snapshot
+in <data folder>/shards/<source> (see snapshot.py), so one shard can be rebuilt when only its spider has run again.
+tf-idf depends on the whole collection (number of articles and document frequencies), so a shard does not store weights:
+it stores the lemma counts (in the weights of a binary_index.BinaryIndex, exact in float32) and the document lengths.
+Queries fan out to the shards in threads. The idf of every query lemma is computed from the statistics of all the shards
+(articles and df add up), so every posting gets exactly the float32 weight a single index build stores and the merged
+scores are identical to query_answers.answer_query on the single index.
+A url crawled by several sources is answered once, from the last source (in sources order) that has it, like the single index
+which keeps the last copy. Difference: the single index keeps the last copy per lemma, so a lemma found only in an earlier copy
+of the article still counts there, while the shards ignore the earlier copies entirely.
+"""
+
+def shard_dir(source):
+    return paths.data_path(SHARDS_FOLDER, source)
+
+def build_shard(source, chunk_size=500):
+
+    """
+    Tag, clean and lemmatize the articles of one source (writing PoSTags_cleaned and lemmas_count like pipeline.run_pipeline)
+    and publish its shard. Return (source, number of articles).
+    """
+
+    stop_words = nltk_resources.stop_words()  # NLTK packages are loaded from the shared data folder, never downloaded
+    lemmatizer = lemma_cache.get_lemma_cache()  # WordNet lemmatizer behind a (word, tag) cache
+
+    db = storage.get_connection()  # Shards are built at the same time, the connection waits for the others' writes
+    store = token_store.TokenStore(db)  # Vocabularies shared with the other shards
+    with db:
+        pipeline.ensure_columns(db, source, pipeline.OUTPUT_COLUMNS)
+
+    lemma_counts = {}  # Dictionary {lemma: {url: count}}
+    lengths = {}  # Dictionary {url: length of PoSTags_cleaned}
+    documents = 0
+
+    for chunk in pipeline.read_chunks(db, source, chunk_size):
+        cleaned_chunk = []  # PoSTags_cleaned of every article
+        updates = []  # Tuples of (lemmas_count, rowid)
+        chunk_tags = PosTagger.tag_texts([content for _, _, content in chunk])
+
+        for (rowid, url, _), postags in zip(chunk, chunk_tags):
+            cleaned_postags, lemmas = pipeline.process_tags(postags, stop_words, lemmatizer)
+            cleaned_chunk.append(cleaned_postags)
+            updates.append((json.dumps(lemmas), rowid))
+            lengths[url] = len(cleaned_postags)
+            for lemma, count in lemmas.items():
+                if lemma not in lemma_counts:
+                    lemma_counts[lemma] = {}
+                lemma_counts[lemma][url] = count
+        documents += len(chunk)
+
+        with db:  # One transaction per chunk
+            blobs = store.encode(cleaned_chunk)
+            db.executemany("UPDATE " + source + " SET PoSTags_cleaned = ?, lemmas_count = ? WHERE rowid = ?", [(blob,) + update for blob, update in zip(blobs, updates)])
+
+    write_shard(source, lemma_counts, lengths, documents)
+    lemmatizer.save()
+    return source, documents
+
+def write_shard(source, lemma_counts, lengths, documents):
+
+    """
+    Publish a shard: the lemma counts {lemma: {url: count}} as a binary index, its lexicon (df and cf within the shard),
+    the document lengths {url: length} and the number of articles.
+    """
+
+    shard_lexicon = lexicon.Lexicon.from_counts({lemma: len(counts) for lemma, counts in lemma_counts.items()},
+                                                {lemma: sum(counts.values()) for lemma, counts in lemma_counts.items()})
+    staging_dir = snapshot.create_staging(shard_dir(source))
+    binary_index.write_binary_index(lemma_counts, os.path.join(staging_dir, snapshot.INDEX_FILE), shard_lexicon)
+    shard_lexicon.save(os.path.join(staging_dir, snapshot.LEXICON_FILE))
+
+    urls = sorted({url for counts in lemma_counts.values() for url in counts})  # The doc ids of write_binary_index
+    np.array([lengths[url] for url in urls], dtype="<u4").tofile(os.path.join(staging_dir, LENGTHS_FILE))
+    with open(os.path.join(staging_dir, SHARD_FILE), "w", encoding="utf-8") as f:
+        json.dump({'source': source, 'documents': documents}, f)
+    snapshot.publish(staging_dir, shard_dir(source))
+
+def build_shards(sources=pipeline.DATABASE_TABLES, chunk_size=500):
+
+    """
+    Build the shards of the given sources in parallel, one process per source. Return {source: number of articles}.
+    """
+
+    nltk_resources.use_resources()  # Forked shard processes inherit the NLTK data path
+
+    if len(sources) == 1:
+        return dict([build_shard(sources[0], chunk_size)])
+
+    with multiprocessing.Pool(len(sources)) as pool:
+        return dict(pool.starmap(build_shard, [(source, chunk_size) for source in sources]))
+
+def score_shard(index, lengths, query, idf, top_k=None, shadowed=None):
+
+    """
+    Answer the query on one shard. Return [(url, total weight), ...] by descending weight (then url), top_k first if given.
+    Weights are computed like inverted_index.tf_idf_weight and rounded to float32 like the binary index, then added in query order.
+    Documents marked in the boolean array shadowed (urls answered by a later shard) are left out.
+    """
+
+    scores = np.zeros(index.n_docs)
+    matched = np.zeros(index.n_docs, dtype=bool)
+
+    for lemma in query:
+        if lemma not in idf or lemma not in index:
+            continue
+        doc_ids, counts = index.postings(lemma)
+        weights = (counts / lengths[doc_ids] * idf[lemma]).astype(np.float32)
+        scores[doc_ids] += weights  # doc_ids are distinct within a posting list
+        matched[doc_ids] = True
+
+    if shadowed is not None:
+        matched &= ~shadowed
+    candidates = np.flatnonzero(matched)
+    order = candidates[np.lexsort((candidates, -scores[candidates]))]  # Doc ids are in url order, so ties are broken by url
+    if top_k is not None:
+        order = order[:top_k]
+    return [(index.url(doc_id), float(scores[doc_id])) for doc_id in order]
+
+class ShardedIndex:
+
+    """
+    Query side of the sharded index. Every shard is read through a snapshot.SnapshotReader, so a rebuilt shard is picked up
+    while queries are running. Thread safe.
+    """
+
+    def __init__(self, sources=pipeline.DATABASE_TABLES, check_interval=1.0):
+        self.sources = list(sources)
+        self.readers = {source: snapshot.SnapshotReader(shard_dir(source), check_interval) for source in self.sources}
+        self.executor = ThreadPoolExecutor(len(self.sources))
+        self.shard_stats = {}  # {snapshot path: (number of articles, document lengths)}
+        self.shadowed = {}  # {index paths of every shard: shadowed documents of every shard}, see shadowed_documents
+        self.lock = threading.Lock()  # Queries run in many threads at once, the caches are filled under the lock
+
+    def load_shard_stats(self, index):
+        snapshot_dir = os.path.dirname(index.path)
+        with self.lock:
+            if snapshot_dir not in self.shard_stats:
+                with open(os.path.join(snapshot_dir, SHARD_FILE), encoding="utf-8") as f:
+                    documents = json.load(f)['documents']
+                self.shard_stats = {path: stats for path, stats in self.shard_stats.items() if os.path.exists(path)}  # Forget collected snapshots
+                self.shard_stats[snapshot_dir] = (documents, np.fromfile(os.path.join(snapshot_dir, LENGTHS_FILE), dtype="<u4").astype(np.float64))
+            return self.shard_stats[snapshot_dir]
+
+    def shadowed_documents(self, indexes):
+
+        """
+        Return one boolean array per shard (in sources order) marking the documents whose url is also in a later shard.
+        Computed once per combination of shard snapshots: every url of every shard is read.
+        """
+
+        key = tuple(index.path for index in indexes)
+        with self.lock:
+            if key not in self.shadowed:
+                later_urls = set()
+                shadowed = []
+                for index in reversed(indexes):
+                    urls = [index.url(doc_id) for doc_id in range(index.n_docs)]
+                    shadowed.append(np.array([url in later_urls for url in urls], dtype=bool))
+                    later_urls.update(urls)
+                self.shadowed = {paths: masks for paths, masks in self.shadowed.items() if all(os.path.exists(path) for path in paths)}  # Forget collected snapshots
+                self.shadowed[key] = shadowed[::-1]
+            return self.shadowed[key]
+
+    def answer_query(self, query, top_k=None):
+
+        """
+        Answer a query (list of lemmas) on all the shards. Return [(url, total weight), ...] by descending weight.
+        """
+
+        query = [lemma.lower() for lemma in query]
+
+        with ExitStack() as stack:
+            indexes = [stack.enter_context(self.readers[source].acquire()) for source in self.sources]
+            stats = [self.load_shard_stats(index) for index in indexes]
+
+            # Global statistics, the same as the ones of a single index build
+            articles_count = sum(documents for documents, _ in stats)
+            idf = {}
+            for lemma in set(query):
+                lemma_document_count = sum(index.lexicon.stats(lemma)[0] for index in indexes)
+                if lemma_document_count:
+                    idf[lemma] = math.log(articles_count / (1 + lemma_document_count))
+
+            shadowed = self.shadowed_documents(indexes)
+            futures = [self.executor.submit(score_shard, index, lengths, query, idf, top_k, shard_shadowed)
+                       for index, (_, lengths), shard_shadowed in zip(indexes, stats, shadowed)]
+            answers = [future.result() for future in futures]
+
+        merged = heapq.merge(*answers, key=lambda item: (-item[1], item[0]))  # Every shard answer is already sorted
+        return list(islice(merged, top_k))
+
+    def close(self):
+        self.executor.shutdown()
+        for reader in self.readers.values():
+            reader.close()
+
+if __name__ == "__main__":
+    sources = sys.argv[1:] or pipeline.DATABASE_TABLES  # python sharded_index.py bcc rebuilds the bcc shard only
+    for source, documents in build_shards(sources).items():
+        print("Shard " + source + ": " + str(documents) + " articles")
@@ -0,0 +1,238 @@
+import os
+import time
+import shutil
+import threading
+from contextlib import contextmanager
+import binary_index
+import lexicon
+import positional_index
+import scoring
+import term_index
+import paths
+
+try:
+    import fcntl
+except ImportError:  # No flock (Windows): snapshots are still published atomically but never garbage collected
+    fcntl = None
+
+SNAPSHOTS_FOLDER = "snapshots"  # In the data folder (paths.py)
+CURRENT_FILE = "CURRENT"  # Name of the published snapshot
+INDEX_FILE = "inverted_index.bin"
+LEXICON_FILE = "lexicon.tsv"
+XML_FILE = "inverted_index.xml"
+POSITIONAL_FILE = "positional_index.bin"  # Only in snapshots built with the positional index
+TERM_INDEX_FILE = "term_index.bin"  # Trigram index of the lexicon, for fuzzy lookups
+SCORING_FILE = scoring.STATS_FILE  # Only in snapshots built with scoring (see scoring.py)
+LOCK_FILE = "readers.lock"  # Every process reading a snapshot holds a shared lock on it
+
+"""
+INDEX SNAPSHOTS.
+Every build writes a new, immutable snapshot directory <data folder>/snapshots/<version> (binary index, lexicon and optionally the xml export
+and the positional index).
+It is written in a staging directory, renamed into place and published by replacing the CURRENT file with os.replace,
+so a reader sees either the old or the new snapshot, never a half-written one.
+Readers (SnapshotReader) notice a new CURRENT and switch over; queries already running keep the snapshot they started with
+until they finish. A snapshot is deleted once it is not current and no process holds its reader lock.
+Functions taking a snapshots_dir use the snapshots folder of the data folder (paths.py) when it is None.
+"""
+
+def snapshots_path(snapshots_dir=None):
+    return snapshots_dir if snapshots_dir is not None else paths.data_path(SNAPSHOTS_FOLDER)
+
+def create_staging(snapshots_dir=None):
+
+    """
+    Create and return an empty staging directory for a new snapshot. Write the snapshot files there and call publish.
+    """
+
+    snapshots_dir = snapshots_path(snapshots_dir)
+
+    os.makedirs(snapshots_dir, exist_ok=True)
+    staging_dir = os.path.join(snapshots_dir, ".staging-" + str(time.time_ns()))
+    os.makedirs(staging_dir)
+    return staging_dir
+
+def publish(staging_dir, snapshots_dir=None):
+
+    """
+    Move the staging directory into place, make it the current snapshot and garbage collect the old ones.
+    Return the path of the snapshot.
+    """
+
+    snapshots_dir = snapshots_path(snapshots_dir)
+
+    snapshot_dir = os.path.join(snapshots_dir, str(time.time_ns()))
+    os.replace(staging_dir, snapshot_dir)
+
+    current_path = os.path.join(snapshots_dir, CURRENT_FILE)
+    with open(current_path + ".tmp", "w", encoding="utf-8") as f:
+        f.write(os.path.basename(snapshot_dir))
+    os.replace(current_path + ".tmp", current_path)  # The atomic swap
+
+    collect_garbage(snapshots_dir)
+    return snapshot_dir
+
+def current_snapshot(snapshots_dir=None):
+
+    """
+    Return the path of the current snapshot, None if nothing was published yet.
+    """
+
+    snapshots_dir = snapshots_path(snapshots_dir)
+
+    try:
+        with open(os.path.join(snapshots_dir, CURRENT_FILE), encoding="utf-8") as f:
+            return os.path.join(snapshots_dir, f.read().strip())
+    except FileNotFoundError:
+        return None
+
+def collect_garbage(snapshots_dir=None):
+
+    """
+    Delete the snapshots that are not current and that no process reads. Return the number of deleted snapshots.
+    A snapshot is read while some process holds a shared lock on its lock file, so being able to lock it exclusively means it is free.
+    """
+
+    snapshots_dir = snapshots_path(snapshots_dir)
+
+    if fcntl is None or not os.path.isdir(snapshots_dir):
+        return 0
+
+    current = current_snapshot(snapshots_dir)
+    deleted = 0
+
+    for name in os.listdir(snapshots_dir):
+        snapshot_dir = os.path.join(snapshots_dir, name)
+        if name.startswith(".") or not os.path.isdir(snapshot_dir) or snapshot_dir == current:
+            continue  # Staging directories belong to a running build
+
+        with open(os.path.join(snapshot_dir, LOCK_FILE), "a") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue  # Still read by some process
+            shutil.rmtree(snapshot_dir)
+            deleted += 1
+    return deleted
+
+class Snapshot:
+
+    """
+    An open snapshot: the memory mapped index, its lexicon, its term_index.TermIndex, its positional index and its scoring.ScoringIndex
+    (None if they were not built),
+    kept alive while refs (queries using it) is not 0.
+    Raises FileNotFoundError if the snapshot was garbage collected before it could be locked.
+    """
+
+    def __init__(self, snapshot_dir):
+        self.path = snapshot_dir
+        self.name = os.path.basename(snapshot_dir)
+        self.refs = 0
+        self.lock = open(os.path.join(snapshot_dir, LOCK_FILE), "a")  # Fails if the snapshot is already deleted
+
+        if fcntl is not None:
+            fcntl.flock(self.lock, fcntl.LOCK_SH)
+        if not os.path.exists(os.path.join(snapshot_dir, INDEX_FILE)):
+            self.lock.close()  # Deleted between open and flock
+            raise FileNotFoundError(snapshot_dir)
+
+        self.lexicon = lexicon.Lexicon.load(os.path.join(snapshot_dir, LEXICON_FILE))
+        self.index = binary_index.BinaryIndex(os.path.join(snapshot_dir, INDEX_FILE), self.lexicon)
+        terms_path = os.path.join(snapshot_dir, TERM_INDEX_FILE)
+        self.terms = term_index.TermIndex(terms_path, self.lexicon) if os.path.exists(terms_path) else None  # Older snapshots have none
+        positional_path = os.path.join(snapshot_dir, POSITIONAL_FILE)
+        self.positional = positional_index.PositionalIndex(positional_path) if os.path.exists(positional_path) else None
+        self.scoring = scoring.ScoringIndex(snapshot_dir, self.lexicon) if os.path.exists(os.path.join(snapshot_dir, SCORING_FILE)) else None
+
+    def close(self):
+        self.index.close()
+        if self.terms is not None:
+            self.terms.close()
+        if self.positional is not None:
+            self.positional.close()
+        if self.scoring is not None:
+            self.scoring.close()
+        self.lock.close()  # Releases the reader lock
+
+def open_current(snapshots_dir=None, retries=5):
+
+    """
+    Open the current snapshot. Retry if it is replaced and deleted while it is being opened.
+    """
+
+    snapshots_dir = snapshots_path(snapshots_dir)
+
+    for _ in range(retries):
+        snapshot_dir = current_snapshot(snapshots_dir)
+        if snapshot_dir is None:
+            raise FileNotFoundError("No index snapshot in " + snapshots_dir + ", run create_inverted_index first")
+        try:
+            return Snapshot(snapshot_dir)
+        except FileNotFoundError:
+            continue
+    raise FileNotFoundError("Index snapshot keeps changing in " + snapshots_dir)
+
+class SnapshotReader:
+
+    """
+    Hot reloading view of the current snapshot for a long running query process.
+    Use acquire() around every query. At most every check_interval seconds it checks CURRENT and switches to a newly published snapshot.
+    The previous snapshot is closed (and garbage collected) when the last query using it is done, so switching never drops a query.
+    Thread safe.
+    """
+
+    def __init__(self, snapshots_dir=None, check_interval=1.0):
+        self.snapshots_dir = snapshots_path(snapshots_dir)
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.snapshot = open_current(self.snapshots_dir)
+        self.checked = time.monotonic()
+        self.reloads = 0
+
+    def refresh(self):
+
+        """
+        Switch to the current snapshot if a new one was published. Return True if it switched.
+        """
+
+        with self.lock:
+            self.checked = time.monotonic()
+            if current_snapshot(self.snapshots_dir) == self.snapshot.path:
+                return False
+
+            old, self.snapshot = self.snapshot, open_current(self.snapshots_dir)
+            self.reloads += 1
+            if old.refs == 0:
+                old.close()  # Otherwise the last query using it closes it
+                collect_garbage(self.snapshots_dir)
+            return True
+
+    @contextmanager
+    def acquire(self):
+
+        """
+        Context manager giving the index (binary_index.BinaryIndex) of the current snapshot for the time of a query.
+        """
+
+        if time.monotonic() - self.checked >= self.check_interval:
+            self.refresh()
+
+        with self.lock:
+            snapshot = self.snapshot
+            snapshot.refs += 1
+        try:
+            yield snapshot.index
+        finally:
+            with self.lock:
+                snapshot.refs -= 1
+                retired = snapshot is not self.snapshot and snapshot.refs == 0
+            if retired:
+                snapshot.close()
+                collect_garbage(self.snapshots_dir)
+
+    @property
+    def version(self):
+        return self.snapshot.index.version
+
+    def close(self):
+        self.snapshot.close()
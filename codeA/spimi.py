@@ -0,0 +1,274 @@
+import os
+import json
+import heapq
+import shutil
+import itertools
+from array import array
+import numpy as np
+import binary_index
+import inverted_index
+import lexicon
+import positional_index
+import scoring
+import snapshot
+import storage
+import instrumentation
+import paths
+
+DATABASE_TABLES = ["foxnews", "aljazeera", "bcc"]
+RUNS_FOLDER = "spimi_runs"  # In the data folder (paths.py), deleted after the build
+MEMORY_BUDGET = 256 * 2 ** 20  # Bytes of postings kept in memory before a run is flushed
+POSTING_BYTES = 16  # (document number, count) as two int64 in an array
+LEMMA_BYTES = 200  # Dictionary entry, lemma string and array of a lemma of the current block
+POSITIONS_BYTES = 120  # Tuple and string of a (document number, positions) posting, without the characters of the positions
+
+"""
+SINGLE-PASS IN-MEMORY INDEXING (SPIMI).
+lemmas_tf_idf keeps every article and the whole {lemma: {url: weight}} dictionary in memory, which does not fit for large archives.
+build_index streams the articles once (the doc_stats rows of pipeline.run_pipeline and their lemmas_count), adding the raw postings
+(document number, count) of every lemma to an in-memory block. When the block reaches memory_budget bytes (estimated), its lemmas
+are sorted and it is flushed to disk as a run of "lemma, document number, count" lines. The runs are then k-way merged
+(heapq.merge): every lemma's postings come out together, in lemma order, so document frequencies are known and the tf-idf
+weights are computed exactly like inverted_index.lemmas_tf_idf_from_stats (same inputs, same inverted_index.tf_idf_weight).
+Each merged lemma is written straight to the binary index (binary_index.BinaryIndexWriter), the postings tables
+(storage.write_postings) and the xml file (inverted_index.XmlWriter) of the snapshot, so only one lemma's postings are in memory.
+What stays in memory for the whole build is the url and length of every document and the document frequency of every lemma.
+With scorers, the lemma counts are written to the counts index of the snapshot during the same merge, and the other scoring files
+are computed from it one lemma at a time (scoring.write_scoring_files). With positional, the positions are inverted the same way:
+a pass over the articles (positional_index.document_positions) flushes runs of "lemma, document number, positions" lines, and their
+merge is written one lemma at a time (positional_index.PositionalIndexWriter). Both give the files of inverted_index.publish_snapshot.
+"""
+
+def read_documents():
+
+    """
+    Yield (url, length of PoSTags_cleaned, {lemma: count}) of every article, in doc_stats order.
+    """
+
+    db = storage.get_connection()  # Shared connection to the database
+
+    for table in DATABASE_TABLES:
+        query = "SELECT d.url, d.token_count, t.lemmas_count FROM doc_stats d JOIN " + table + " t ON t.rowid = d.source_rowid WHERE d.source = ? ORDER BY d.doc_id"
+        for url, token_count, lemmas_count in db.execute(query, (table,)):
+            yield url, token_count, json.loads(lemmas_count)
+
+def write_run(block, path):
+
+    """
+    Flush a block {lemma: array of (document number, count) pairs} to a run file, sorted by lemma then document number.
+    """
+
+    with open(path, "w", encoding="utf-8") as f:
+        for lemma in sorted(block):
+            postings = block[lemma]
+            f.writelines(lemma + "\t" + str(postings[i]) + "\t" + str(postings[i + 1]) + "\n" for i in range(0, len(postings), 2))
+
+def read_run(path):
+
+    """
+    Yield the (lemma, document number, count) postings of a run file, in order.
+    """
+
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            lemma, number, count = line.rstrip("\n").split("\t")
+            yield lemma, int(number), int(count)
+
+def invert(runs_dir, memory_budget=MEMORY_BUDGET):
+
+    """
+    First pass: read the articles and flush sorted runs of raw postings to runs_dir whenever the block reaches memory_budget bytes.
+    Documents are numbered in reading order. Return (run paths, urls, lengths, has_postings) indexed by document number.
+    """
+
+    runs = []
+    urls = []
+    lengths = array("q")
+    has_postings = []
+    block = {}
+    block_bytes = 0
+
+    for url, length, lemmas in read_documents():
+        number = len(urls)
+        urls.append(url)
+        lengths.append(length)
+        has_postings.append(bool(lemmas))
+
+        for lemma, count in lemmas.items():
+            if lemma not in block:
+                block[lemma] = array("q")
+                block_bytes += LEMMA_BYTES
+            block[lemma].extend((number, count))
+            block_bytes += POSTING_BYTES
+
+        if block_bytes >= memory_budget:
+            runs.append(os.path.join(runs_dir, "run" + str(len(runs)) + ".tsv"))
+            write_run(block, runs[-1])
+            block, block_bytes = {}, 0
+
+    if block:
+        runs.append(os.path.join(runs_dir, "run" + str(len(runs)) + ".tsv"))
+        write_run(block, runs[-1])
+    return runs, urls, lengths, has_postings
+
+def merge_runs(runs, read=read_run):
+
+    """
+    Second pass: k-way merge of the runs. Yield (lemma, [(document number, count), ...]) in lemma order, numbers increasing.
+    Documents are numbered in reading order and runs are written in that order, so the merge keeps every lemma's postings sorted.
+    read is the reader of the run files (read_positions_run for the runs of invert_positions).
+    """
+
+    for lemma, postings in itertools.groupby(heapq.merge(*(read(run) for run in runs)), key=lambda posting: posting[0]):
+        yield lemma, [(number, value) for _, number, value in postings]
+
+def write_positions_run(block, path):
+
+    """
+    Flush a block {lemma: [(document number, positions separated by spaces), ...]} to a run file, sorted by lemma then document number.
+    """
+
+    with open(path, "w", encoding="utf-8") as f:
+        for lemma in sorted(block):
+            f.writelines(lemma + "\t" + str(number) + "\t" + positions + "\n" for number, positions in block[lemma])
+
+def read_positions_run(path):
+
+    """
+    Yield the (lemma, document number, positions separated by spaces) postings of a positions run file, in order.
+    """
+
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            lemma, number, positions = line.rstrip("\n").split("\t")
+            yield lemma, int(number), positions
+
+def invert_positions(runs_dir, memory_budget=MEMORY_BUDGET):
+
+    """
+    First pass of the positional index: read the lemma positions of the articles (positional_index.document_positions) and flush
+    sorted runs of (document number, positions) to runs_dir whenever the block reaches memory_budget bytes.
+    Documents are numbered in reading order. Return (run paths, urls, has_positions) indexed by document number.
+    """
+
+    runs = []
+    urls = []
+    has_positions = []
+    block = {}
+    block_bytes = 0
+
+    for url, positions in positional_index.document_positions():
+        number = len(urls)
+        urls.append(url)
+        has_positions.append(bool(positions))
+
+        for lemma, doc_positions in positions.items():
+            if lemma not in block:
+                block[lemma] = []
+                block_bytes += LEMMA_BYTES
+            text = " ".join(map(str, doc_positions.tolist()))
+            block[lemma].append((number, text))
+            block_bytes += POSITIONS_BYTES + len(text)
+
+        if block_bytes >= memory_budget:
+            runs.append(os.path.join(runs_dir, "positions" + str(len(runs)) + ".tsv"))
+            write_positions_run(block, runs[-1])
+            block, block_bytes = {}, 0
+
+    if block:
+        runs.append(os.path.join(runs_dir, "positions" + str(len(runs)) + ".tsv"))
+        write_positions_run(block, runs[-1])
+    return runs, urls, has_positions
+
+def build_positional_index(runs_dir, path, memory_budget=MEMORY_BUDGET):
+
+    """
+    Build the positional index file of positional_index.build_positional_index under a memory budget: invert_positions,
+    then a k-way merge of its runs written one lemma at a time.
+    """
+
+    runs, urls, has_positions = invert_positions(runs_dir, memory_budget)
+    last_numbers = {url: number for number, url in enumerate(urls)}  # The same url can appear twice, keep the last one like positional_index.read_lemma_positions
+    index_urls = sorted(url for url, number in last_numbers.items() if has_positions[number])
+    url_to_doc_id = {url: doc_id for doc_id, url in enumerate(index_urls)}
+
+    writer = positional_index.PositionalIndexWriter(path, index_urls)
+    for lemma, postings in merge_runs(runs, read_positions_run):
+        kept = sorted((url_to_doc_id[urls[number]], positions) for number, positions in postings if last_numbers[urls[number]] == number)
+        writer.add(lemma, [doc_id for doc_id, _ in kept], [[int(position) for position in positions.split()] for _, positions in kept])
+    writer.close()
+
+def build_index(memory_budget=MEMORY_BUDGET, xml_export=False, positional=False, scorers=None):
+
+    """
+    Build and publish the inverted index snapshot from the output of pipeline.run_pipeline under a memory budget (bytes of postings),
+    with the same weights, lexicon and files as inverted_index.lemmas_tf_idf_from_stats followed by inverted_index.inverted_to_binary,
+    including the positional index and the scoring files of positional and scorers. Also saves the postings tables.
+    Return a storage.PostingsTable, the dictionary view of the saved index.
+    """
+
+    runs_dir = paths.data_path(RUNS_FOLDER)
+    shutil.rmtree(runs_dir, ignore_errors=True)  # Left by a failed build
+    os.makedirs(runs_dir)
+
+    try:
+        with instrumentation.stage("spimi_invert", io=True) as record:
+            runs, urls, lengths, has_postings = invert(runs_dir, memory_budget)
+            record.add(documents=len(urls))
+        articles_count = len(urls)  # Total number of articles
+        index_urls = sorted({url for url, indexed in zip(urls, has_postings) if indexed})
+        url_to_doc_id = {url: doc_id for doc_id, url in enumerate(index_urls)}
+
+        staging_dir = snapshot.create_staging()
+        index_writer = binary_index.BinaryIndexWriter(os.path.join(staging_dir, snapshot.INDEX_FILE), index_urls)
+        counts_writer = None
+        if scorers is not None:
+            # scoring.read_counts keeps the whole last copy of a url that appears twice, so the counts index has its own doc ids
+            last_numbers = {url: number for number, url in enumerate(urls)}
+            counts_urls = sorted(url for url, number in last_numbers.items() if has_postings[number])
+            counts_doc_ids = {url: doc_id for doc_id, url in enumerate(counts_urls)}
+            counts_writer = binary_index.BinaryIndexWriter(os.path.join(staging_dir, scoring.COUNTS_FILE), counts_urls)
+        xml_writer = inverted_index.XmlWriter(os.path.join(staging_dir, snapshot.XML_FILE)) if xml_export else None
+        lemma_df, lemma_cf = {}, {}
+
+        def lemma_postings():
+            for lemma, postings in merge_runs(runs):
+                lemma_df[lemma] = len(postings)  # Every article containing the lemma, like pipeline.run_pipeline counts it
+                lemma_cf[lemma] = sum(count for _, count in postings)
+
+                latest = {}  # {url: (count, document number)}. The same url can appear twice, keep the last one like lemmas_tf_idf does
+                for number, count in postings:
+                    latest[urls[number]] = (count, number)
+                kept = sorted((url_to_doc_id[url], count, number) for url, (count, number) in latest.items())
+                doc_ids = [doc_id for doc_id, _, _ in kept]
+                weights = [inverted_index.tf_idf_weight(count, lengths[number], articles_count, lemma_df[lemma]) for _, count, number in kept]
+
+                index_writer.add(lemma, doc_ids, weights)
+                if counts_writer is not None:
+                    counted = sorted((counts_doc_ids[urls[number]], count) for number, count in postings if last_numbers[urls[number]] == number)
+                    counts_writer.add(lemma, [doc_id for doc_id, _ in counted], [count for _, count in counted])
+                if xml_writer is not None:
+                    xml_writer.add(lemma, [(index_urls[doc_id], weight) for doc_id, weight in zip(doc_ids, weights)])
+                yield lemma, lemma_df[lemma], [(doc_id, count / lengths[number]) for doc_id, count, number in kept]  # The postings tables apply the idf when reading
+
+        with instrumentation.stage("spimi_merge", io=True):
+            storage.write_postings(index_urls, lemma_postings(), articles_count=articles_count)
+            index_writer.close()
+            if xml_writer is not None:
+                xml_writer.close()
+            lemmas_lexicon = lexicon.Lexicon.from_counts(lemma_df, lemma_cf)
+            lemmas_lexicon.save(os.path.join(staging_dir, snapshot.LEXICON_FILE))
+
+        if positional:
+            with instrumentation.stage("positional_index", io=True):
+                build_positional_index(runs_dir, os.path.join(staging_dir, snapshot.POSITIONAL_FILE), memory_budget)
+        if counts_writer is not None:
+            with instrumentation.stage("scoring", io=True):
+                counts_writer.close()
+                doc_lengths = np.array([lengths[last_numbers[url]] for url in counts_urls], dtype="<u4")
+                scoring.write_scoring_files(staging_dir, doc_lengths, articles_count, scorers)
+    finally:
+        shutil.rmtree(runs_dir, ignore_errors=True)
+
+    inverted_index.publish_snapshot(staging_dir, lemmas_lexicon)  # The positional index and the scoring files are already written
+    return storage.PostingsTable()
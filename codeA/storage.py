@@ -0,0 +1,277 @@
+import os
+import math
+import atexit
+import itertools
+import sqlite3
+import threading
+import paths
+
+DATABASE_FILE = "db.sqlite3"  # In the data folder (paths.py)
+BUSY_TIMEOUT = 60  # Seconds a connection waits for another process' write (shard builds write at the same time)
+LOCAL = threading.local()  # Shared connections of the current thread: LOCAL.connections {database path: sqlite3.Connection}
+OPEN_CONNECTIONS = []  # Every shared connection opened by this process, closed at exit
+OPEN_CONNECTIONS_LOCK = threading.Lock()
+
+"""
+STORAGE.
+One place to open the SQLite database. Modules call get_connection() instead of sqlite3.connect: every thread of a process
+reuses one connection per database file (SQLite connections must stay in the thread that opened them), and a forked
+process opens its own. Connections use WAL journaling, so readers (the query side, the batch engine) never block the
+writer of a build and the writer never blocks them, with synchronous=NORMAL, which is safe in WAL mode.
+Use the connection as a context manager (with db:) around writes, one transaction per batch of executemany.
+
+The inverted index is stored normalized:
+    lemmas (lemma_id INTEGER PRIMARY KEY, lemma TEXT UNIQUE, df)  lemma ids in sorted lemma order after a full build, like the binary index
+    urls (doc_id INTEGER PRIMARY KEY, url TEXT UNIQUE)            doc ids in sorted url order after a full build, like the binary index
+    postings (lemma_id, doc_id, tf) WITHOUT ROWID                 primary key (lemma_id, doc_id): the table is its own covering
+                                                                  index of lemma lookups
+    postings_by_doc (doc_id, lemma_id, tf)                        covering index of document lookups
+    postings_stats (articles)                                     number of articles N, NULL if tf holds final weights
+so the postings of one lemma are one indexed range scan (PostingsTable) instead of a JSON blob or the whole index.
+tf and idf are stored apart: the weight tf * log(N / (1 + df)) is computed when reading, so an incremental update
+(update_postings) only writes the rows of the documents and lemmas it touches.
+"""
+
+def connect(database_path=None, check_same_thread=True):
+
+    """
+    Open a new connection configured for this project (WAL, busy timeout). Prefer get_connection, the caller closes this one.
+    """
+
+    db = sqlite3.connect(database_path if database_path is not None else paths.data_path(DATABASE_FILE), timeout=BUSY_TIMEOUT, check_same_thread=check_same_thread)
+    db.execute("PRAGMA journal_mode = WAL")  # Persistent, stored in the database file
+    db.execute("PRAGMA synchronous = NORMAL")
+    return db
+
+def get_connection(database_path=None):
+
+    """
+    Return the shared connection of this thread to the database (the data folder's db.sqlite3 if database_path is None).
+    Do not close it, close_connections does at exit.
+    """
+
+    database_path = database_path if database_path is not None else paths.data_path(DATABASE_FILE)
+
+    if getattr(LOCAL, "pid", None) != os.getpid():  # First call of the thread, or a forked process: never use the parent's connections
+        LOCAL.pid = os.getpid()
+        LOCAL.connections = {}
+
+    db = LOCAL.connections.get(database_path)
+    if db is None:
+        db = LOCAL.connections[database_path] = connect(database_path, check_same_thread=False)  # Only its thread uses it, but close_connections may run in another
+        with OPEN_CONNECTIONS_LOCK:
+            OPEN_CONNECTIONS.append((os.getpid(), db))
+    return db
+
+def close_connections():
+
+    """
+    Close the shared connections opened by this process (for example before deleting a temporary data folder).
+    """
+
+    with OPEN_CONNECTIONS_LOCK:
+        for pid, db in OPEN_CONNECTIONS:
+            if pid == os.getpid():
+                db.close()
+        OPEN_CONNECTIONS.clear()
+    LOCAL.pid = None
+
+atexit.register(close_connections)
+
+def idf(articles_count, lemma_document_count):
+
+    """
+    IDF part of the weights of the postings tables, 1.0 when the stored values are final weights (articles_count is None).
+    """
+
+    if articles_count is None:
+        return 1.0
+    return math.log(articles_count / (1 + lemma_document_count))
+
+def save_postings(tf_idf, db=None, lemma_df=None, articles_count=None):
+
+    """
+    Save the inverted index {lemma: {url: tf-idf, ...}} to the lemmas, urls and postings tables.
+    With lemma_df {lemma: number of documents containing it} and articles_count, tf_idf holds the tf part of the weights
+    (count / length) and the idf is applied when reading (see idf), so a change of the number of articles rewrites one row.
+    New tables are loaded with executemany and swapped in with one transaction, readers see the old or the new index, never a half-written one.
+    """
+
+    urls = sorted({url for postings in tf_idf.values() for url in postings})
+    url_to_doc_id = {url: doc_id for doc_id, url in enumerate(urls)}
+    write_postings(urls, ((lemma, lemma_df[lemma] if lemma_df is not None else len(tf_idf[lemma]), sorted((url_to_doc_id[url], weight) for url, weight in tf_idf[lemma].items()))
+                          for lemma in sorted(tf_idf)), db, articles_count)
+
+def write_postings(urls, lemma_postings, db=None, articles_count=None):
+
+    """
+    Streaming form of save_postings: urls is the sorted list of urls (a url's position is its doc id) and lemma_postings yields
+    (lemma, df, [(doc id, tf or tf-idf), ...] sorted by doc id) in sorted lemma order, one lemma at a time.
+    """
+
+    db = db if db is not None else get_connection()
+
+    with db:  # One transaction
+        db.execute("BEGIN")
+        for table in ["lemmas", "urls", "postings", "postings_stats"]:
+            db.execute("DROP TABLE IF EXISTS " + table + "_staging")  # Left by a failed build
+        db.execute("CREATE TABLE lemmas_staging (lemma_id INTEGER PRIMARY KEY, lemma TEXT NOT NULL, df INTEGER NOT NULL)")
+        db.execute("CREATE TABLE urls_staging (doc_id INTEGER PRIMARY KEY, url TEXT NOT NULL)")
+        db.execute("CREATE TABLE postings_staging (lemma_id INTEGER NOT NULL, doc_id INTEGER NOT NULL, tf REAL NOT NULL, PRIMARY KEY (lemma_id, doc_id)) WITHOUT ROWID")
+        db.execute("CREATE TABLE postings_stats_staging (articles INTEGER)")
+
+        db.executemany("INSERT INTO urls_staging VALUES (?, ?)", enumerate(urls))
+        for lemma_id, (lemma, df, postings) in enumerate(lemma_postings):
+            db.execute("INSERT INTO lemmas_staging VALUES (?, ?, ?)", (lemma_id, lemma, df))
+            db.executemany("INSERT INTO postings_staging VALUES (?, ?, ?)", ((lemma_id, doc_id, tf) for doc_id, tf in postings))  # Primary key order, appends only
+        db.execute("INSERT INTO postings_stats_staging VALUES (?)", (articles_count,))
+
+        for table in ["lemmas", "urls", "postings", "postings_stats"]:
+            db.execute("DROP TABLE IF EXISTS " + table)
+            db.execute("ALTER TABLE " + table + "_staging RENAME TO " + table)
+        # Indexes are built once the tables are loaded, faster than updating them on every insert
+        db.execute("CREATE UNIQUE INDEX lemmas_lemma ON lemmas (lemma)")
+        db.execute("CREATE UNIQUE INDEX urls_url ON urls (url)")
+        db.execute("CREATE INDEX postings_by_doc ON postings (doc_id, lemma_id, tf)")
+
+def has_tf_postings(db=None):
+
+    """
+    True if the postings tables exist and store tf values with the number of articles (see save_postings), which update_postings requires.
+    """
+
+    db = db if db is not None else get_connection()
+    if db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'postings_stats'").fetchone() is None:
+        return False
+    return db.execute("SELECT articles FROM postings_stats").fetchone()[0] is not None
+
+def update_postings(removed, added, lemma_df, articles_count, db=None):
+
+    """
+    Apply an incremental change to postings tables saved with the number of articles, inside the caller's transaction.
+    removed is a list of urls whose postings are deleted, added a dictionary {url: {lemma: tf}} of (new or re-added) documents,
+    lemma_df the new document frequency of every lemma of removed and added documents (0 removes the lemma).
+    Only the rows of these documents and lemmas are written: a new url or lemma gets the next free id, so doc ids are
+    no longer in url order after an update (PostingsTable.urls sorts them).
+    """
+
+    db = db if db is not None else get_connection()
+
+    for url in removed:
+        row = db.execute("SELECT doc_id FROM urls WHERE url = ?", (url,)).fetchone()
+        if row is not None:
+            db.execute("DELETE FROM postings WHERE doc_id = ?", row)  # postings_by_doc range
+            if not added.get(url):
+                db.execute("DELETE FROM urls WHERE doc_id = ?", row)
+
+    next_lemma_id = db.execute("SELECT COALESCE(MAX(lemma_id), -1) + 1 FROM lemmas").fetchone()[0]
+    for lemma, df in lemma_df.items():
+        if df > 0:
+            db.execute("INSERT INTO lemmas VALUES (?, ?, ?) ON CONFLICT (lemma) DO UPDATE SET df = excluded.df", (next_lemma_id, lemma, df))
+            next_lemma_id += 1
+        else:
+            db.execute("DELETE FROM lemmas WHERE lemma = ?", (lemma,))  # Its postings were removed with their documents
+
+    next_doc_id = db.execute("SELECT COALESCE(MAX(doc_id), -1) + 1 FROM urls").fetchone()[0]
+    for url, lemma_tfs in added.items():
+        if not lemma_tfs:  # Not in the index, like a document without lemmas in a full build
+            continue
+        row = db.execute("SELECT doc_id FROM urls WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            row = (next_doc_id,)
+            db.execute("INSERT INTO urls VALUES (?, ?)", (next_doc_id, url))
+            next_doc_id += 1
+        lemma_ids = dict(db.execute("SELECT lemma, lemma_id FROM lemmas WHERE lemma IN (" + ", ".join("?" * len(lemma_tfs)) + ")", list(lemma_tfs)))
+        db.executemany("INSERT INTO postings VALUES (?, ?, ?)", ((lemma_ids[lemma], row[0], tf) for lemma, tf in lemma_tfs.items()))
+
+    db.execute("UPDATE postings_stats SET articles = ?", (articles_count,))
+
+def read_postings(db=None):
+
+    """
+    Load the whole inverted index {lemma: {url: tf-idf, ...}} saved by save_postings.
+    """
+
+    db = db if db is not None else get_connection()
+    articles_count = db.execute("SELECT articles FROM postings_stats").fetchone()[0]
+    tf_idf = {}
+    query = "SELECT l.lemma, l.df, u.url, p.tf FROM postings p JOIN lemmas l ON l.lemma_id = p.lemma_id JOIN urls u ON u.doc_id = p.doc_id"
+    for lemma, df, url, tf in db.execute(query):
+        if lemma not in tf_idf:
+            tf_idf[lemma] = {}
+        tf_idf[lemma][url] = tf * idf(articles_count, df)
+    return tf_idf
+
+class PostingsTable:
+
+    """
+    Read only view of the inverted index saved by save_postings. Nothing is loaded up front: every lemma is looked up with one indexed query.
+    Supports the subset of the dictionary interface that query_answers.answer_query uses: lemma in index, index[lemma] -> {url: weight}.
+    """
+
+    def __init__(self, database_path=None):
+        self.database_path = database_path
+
+    def articles_count(self):
+        return get_connection(self.database_path).execute("SELECT articles FROM postings_stats").fetchone()[0]
+
+    def lemma_id(self, lemma):
+
+        """
+        Return the id of the lemma, -1 if the lemma is not in the index.
+        """
+
+        row = get_connection(self.database_path).execute("SELECT lemma_id FROM lemmas WHERE lemma = ?", (lemma,)).fetchone()
+        return row[0] if row is not None else -1
+
+    def df(self, lemma):
+
+        """
+        Return the document frequency of the lemma, 0 if the lemma is not in the index. At least its number of postings.
+        """
+
+        row = get_connection(self.database_path).execute("SELECT df FROM lemmas WHERE lemma = ?", (lemma,)).fetchone()
+        return row[0] if row is not None else 0
+
+    def get(self, lemma, default=None):
+        query = "SELECT l.df, u.url, p.tf FROM lemmas l JOIN postings p ON p.lemma_id = l.lemma_id JOIN urls u ON u.doc_id = p.doc_id WHERE l.lemma = ?"
+        rows = get_connection(self.database_path).execute(query, (lemma,)).fetchall()
+        if not rows:
+            return default
+        lemma_idf = idf(self.articles_count(), rows[0][0])
+        return {url: tf * lemma_idf for _, url, tf in rows}
+
+    def items(self):
+
+        """
+        Yield (lemma, {url: tf-idf, ...}) in sorted lemma order, one lemma at a time (one scan of the tables, no sort).
+        """
+
+        articles_count = self.articles_count()
+        query = "SELECT l.lemma, l.df, u.url, p.tf FROM lemmas l JOIN postings p ON p.lemma_id = l.lemma_id JOIN urls u ON u.doc_id = p.doc_id ORDER BY l.lemma"
+        rows = get_connection(self.database_path).execute(query)
+        for lemma, lemma_rows in itertools.groupby(rows, key=lambda row: row[0]):
+            postings = {}
+            for _, df, url, tf in lemma_rows:
+                postings[url] = tf * idf(articles_count, df)
+            yield lemma, postings
+
+    def urls(self):
+
+        """
+        Return every url of the index, sorted (the position of a url is its doc id in the binary index, not in the urls table).
+        """
+
+        return [url for url, in get_connection(self.database_path).execute("SELECT url FROM urls ORDER BY url")]
+
+    def __contains__(self, lemma):
+        return self.lemma_id(lemma) >= 0
+
+    def __getitem__(self, lemma):
+        postings = self.get(lemma)
+        if postings is None:
+            raise KeyError(lemma)
+        return postings
+
+    def __len__(self):
+        return get_connection(self.database_path).execute("SELECT COUNT(*) FROM lemmas").fetchone()[0]
@@ -0,0 +1,196 @@
+import mmap
+import time
+import struct
+import numpy as np
+import binary_index
+
+MAGIC = b"NLPTERMS"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<8sIIIq")  # magic, version, n_lemmas, n_trigrams, created
+SECTIONS = ["trigram_offsets", "trigram_blob", "postings_offsets", "lemma_ids", "lemma_lengths"]
+SECTION_TABLE = struct.Struct("<" + "Q" * len(SECTIONS))
+PADDING = "$"  # Marks the start and the end of a lemma, so that trigrams also match the first and last letters
+
+"""
+TERM INDEX.
+Trigram index of the lexicon, stored in the snapshot with the inverted index, for misspelled ("ukrane") and partial query words.
+Every lemma is padded ("$$ukraine$") and cut into its distinct trigrams ("$$u", "$uk", "ukr", ..., "ne$"); the file maps
+every trigram to the sorted ids of the lemmas containing it. File layout, like binary_index.py (header, section table, sections on 8 byte boundaries):
+
+    trigram offsets     uint64[n_trigrams + 1]  offsets of each trigram inside the trigram blob
+    trigram blob        utf-8 trigrams, sorted, concatenated
+    postings offsets    uint64[n_trigrams + 1]  trigram i's lemmas are lemma_ids[offsets[i]:offsets[i + 1]]
+    lemma ids           uint32[n_postings]      lexicon ids, sorted per trigram
+    lemma lengths       uint16[n_lemmas]        number of characters of every lemma
+
+One edit removes at most 3 trigrams of a word, so a lemma within edit distance d of a query word of n trigrams shares at least n - 3d
+of them, and its length differs by at most d. Only the lemmas passing both filters (counted with numpy on the query's
+posting lists) get their Levenshtein distance computed, all at once with numpy. Prefix lookups are binary searches on the sorted lexicon.
+"""
+
+def trigrams(word):
+
+    """
+    Distinct trigrams of a padded word, sorted.
+    """
+
+    padded = PADDING * 2 + word + PADDING
+    return sorted({padded[i:i + 3] for i in range(len(padded) - 2)})
+
+def edit_distances(word, words):
+
+    """
+    Levenshtein distance of word to every word of words, as an int64 array. All words are compared at once: one numpy
+    row of the dynamic programming table per character of word, the insertions of a row being a running minimum.
+    """
+
+    if not words:
+        return np.zeros(0, dtype=np.int64)
+    width = max(1, max(len(other) for other in words))
+    codes = np.array(words, dtype="<U" + str(width)).view(np.uint32).reshape(len(words), width)  # Shorter words are padded with 0
+    columns = np.arange(width + 1)
+
+    previous = np.tile(columns, (len(words), 1))
+    for i, char in enumerate(word, 1):
+        current = np.empty_like(previous)
+        current[:, 0] = i
+        current[:, 1:] = np.minimum(previous[:, 1:] + 1, previous[:, :-1] + (codes != ord(char)))  # Deletion or substitution
+        previous = np.minimum.accumulate(current - columns, axis=1) + columns  # Insertion: current[j] = min(current[j], current[j - 1] + 1)
+    return previous[np.arange(len(words)), [len(other) for other in words]]
+
+def default_max_distance(word):
+
+    """
+    Edits allowed for a word: 0 below 3 characters, 1 up to 5 characters, 2 for longer words.
+    """
+
+    if len(word) < 3:
+        return 0
+    return 1 if len(word) <= 5 else 2
+
+def write_term_index(lemmas, path):
+
+    """
+    Save the trigram index of the sorted lemmas of a lexicon.Lexicon (lemma ids are positions in lemmas).
+    The file is written next to path and renamed at the end.
+    """
+
+    trigram_lemmas = {}  # {trigram: [lemma id, ...]}, ids are appended in increasing order
+    for lemma_id, lemma in enumerate(lemmas):
+        for trigram in trigrams(lemma):
+            if trigram not in trigram_lemmas:
+                trigram_lemmas[trigram] = []
+            trigram_lemmas[trigram].append(lemma_id)
+
+    sorted_trigrams = sorted(trigram_lemmas)
+    postings_offsets = np.zeros(len(sorted_trigrams) + 1, dtype="<u8")
+    postings_offsets[1:] = np.cumsum([len(trigram_lemmas[trigram]) for trigram in sorted_trigrams], dtype="<u8")
+    lemma_ids = np.array([lemma_id for trigram in sorted_trigrams for lemma_id in trigram_lemmas[trigram]], dtype="<u4")
+    lemma_lengths = np.array([min(len(lemma), 2 ** 16 - 1) for lemma in lemmas], dtype="<u2")
+
+    trigram_offsets, trigram_blob = binary_index._strings_to_blob(sorted_trigrams)
+    sections = [trigram_offsets.tobytes(), trigram_blob, postings_offsets.tobytes(), lemma_ids.tobytes(), lemma_lengths.tobytes()]
+    binary_index.write_sections(path, HEADER.pack(MAGIC, FORMAT_VERSION, len(lemmas), len(sorted_trigrams), time.time_ns()), sections)
+
+class TermIndex:
+
+    """
+    Read only, memory mapped view of a term index, with the lexicon.Lexicon it was built from (lemma ids are the lexicon's).
+    """
+
+    def __init__(self, path, lexicon):
+        self.path = path
+        self.lexicon = lexicon
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, n_lemmas, self.n_trigrams, self.created = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self.close()
+            raise ValueError(path + " is not a term index of this version. Rebuild the inverted index")
+        if n_lemmas != len(lexicon):
+            self.close()
+            raise ValueError("The lexicon does not belong to " + path)
+        offsets = dict(zip(SECTIONS, SECTION_TABLE.unpack_from(self._mm, HEADER.size)))
+
+        self._trigram_offsets = np.frombuffer(self._mm, dtype="<u8", count=self.n_trigrams + 1, offset=offsets["trigram_offsets"])
+        self._trigram_blob = offsets["trigram_blob"]
+        self._postings_offsets = np.frombuffer(self._mm, dtype="<u8", count=self.n_trigrams + 1, offset=offsets["postings_offsets"])
+        self._lemma_ids = np.frombuffer(self._mm, dtype="<u4", count=int(self._postings_offsets[-1]), offset=offsets["lemma_ids"])
+        self._lemma_lengths = np.frombuffer(self._mm, dtype="<u2", count=n_lemmas, offset=offsets["lemma_lengths"])
+
+    def close(self):
+        self._trigram_offsets = self._postings_offsets = self._lemma_ids = self._lemma_lengths = None
+        if getattr(self, "_mm", None) is not None:
+            self._mm.close()
+            self._mm = None
+        self._file.close()
+
+    def _trigram_bytes(self, trigram_id):
+        start = self._trigram_blob + int(self._trigram_offsets[trigram_id])
+        end = self._trigram_blob + int(self._trigram_offsets[trigram_id + 1])
+        return self._mm[start:end]
+
+    def lemma_ids(self, trigram):
+
+        """
+        Binary search the sorted trigrams. Return the ids of the lemmas containing the trigram (empty if none).
+        """
+
+        key = trigram.encode("utf-8")
+        low, high = 0, self.n_trigrams
+
+        while low < high:
+            middle = (low + high) // 2
+            if self._trigram_bytes(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.n_trigrams and self._trigram_bytes(low) == key:
+            return self._lemma_ids[int(self._postings_offsets[low]):int(self._postings_offsets[low + 1])]
+        return self._lemma_ids[:0]
+
+    def fuzzy(self, word, max_distance=None, limit=None):
+
+        """
+        Return the lemmas within max_distance edits of word (default_max_distance(word) if None) as [(lemma, distance), ...],
+        closest first, then most frequent (df), then in sorted order. At most limit lemmas if limit is given.
+        """
+
+        if max_distance is None:
+            max_distance = default_max_distance(word)
+        word_trigrams = trigrams(word)
+        min_shared = len(word_trigrams) - 3 * max_distance
+
+        lengths = self._lemma_lengths.astype(np.int64)
+        if min_shared > 0:
+            candidates, shared = np.unique(np.concatenate([self.lemma_ids(trigram) for trigram in word_trigrams]), return_counts=True)
+            candidates = candidates[(shared >= min_shared) & (np.abs(lengths[candidates] - len(word)) <= max_distance)]
+        else:  # Too short for the trigram filter, only the length filter applies
+            candidates = np.flatnonzero(np.abs(lengths - len(word)) <= max_distance)
+
+        candidate_lemmas = [self.lexicon.lemmas[lemma_id] for lemma_id in candidates.tolist()]
+        distances = edit_distances(word, candidate_lemmas)
+        matches = sorted((int(distance), -self.lexicon.df[lemma_id], lemma) for lemma_id, lemma, distance
+                         in zip(candidates.tolist(), candidate_lemmas, distances.tolist()) if distance <= max_distance)
+        return [(lemma, distance) for distance, _, lemma in matches[:limit]]
+
+    def prefix(self, prefix, limit=None):
+
+        """
+        Return the lemmas starting with prefix, in sorted order. At most limit lemmas if limit is given.
+        """
+
+        return self.lexicon.prefix(prefix, limit)
+
+    def expand(self, word, max_distance=None, limit=3):
+
+        """
+        Return the lemmas a query word stands for: [word] if it is in the lexicon, otherwise its closest fuzzy matches
+        (at most limit, all at the smallest distance found). Empty if nothing is close enough.
+        """
+
+        if word in self.lexicon:
+            return [word]
+        matches = self.fuzzy(word, max_distance, limit)
+        return [lemma for lemma, distance in matches if distance == matches[0][1]]
@@ -0,0 +1,57 @@
+import os
+import sys
+import json
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # The modules of codeA import each other by name
+
+import paths
+import storage
+import token_store
+
+@pytest.fixture
+def data_dir(tmp_path):
+
+    """
+    Empty data folder (paths.py) for one test, the shared database connections are closed afterwards.
+    """
+
+    previous = paths.DATA_DIR
+    paths.set_data_dir(str(tmp_path))
+    yield str(tmp_path)
+    storage.close_connections()
+    paths.set_data_dir(previous)
+
+def write_articles(articles):
+
+    """
+    Create the article tables of the database with the columns written by the pipeline.
+    articles: {table: [(url, [(word, tag), ...] cleaned, {lemma: count}), ...]}. content is the words joined by spaces.
+    """
+
+    db = storage.get_connection()
+    store = token_store.TokenStore(db)
+    with db:
+        for table, rows in articles.items():
+            db.execute("CREATE TABLE " + table + " (title TEXT, url TEXT, content TEXT, PoSTags_cleaned BLOB, lemmas_count TEXT)")
+            blobs = store.encode([postags for _, postags, _ in rows])
+            db.executemany("INSERT INTO " + table + " VALUES (?, ?, ?, ?, ?)", [("title", url, " ".join(word for word, _ in postags), blob, json.dumps(lemmas))
+                                                                             for (url, postags, lemmas), blob in zip(rows, blobs)])
+
+def random_index(rng, n_lemmas=8, n_docs=40, weights=None):
+
+    """
+    {lemma: {url: weight}} with negative weights, like the idf of a lemma found in every article, and a lemma in every document.
+    If weights is given, every weight is drawn from it instead, so that many documents tie.
+    """
+
+    def weight(low):
+        return rng.choice(weights) if weights is not None else rng.uniform(low, 1.0)
+
+    tf_idf = {}
+    for i in range(n_lemmas):
+        urls = rng.sample(range(n_docs), rng.randint(1, n_docs))
+        low = -0.5 if rng.random() < 0.4 else 0.0
+        tf_idf["lemma" + str(i)] = {"u" + str(doc): weight(low) for doc in urls}
+    tf_idf["everywhere"] = {"u" + str(doc): rng.choice(weights) if weights is not None else rng.uniform(-0.3, 0.0) for doc in range(n_docs)}
+    return tf_idf
@@ -0,0 +1,21 @@
+import random
+import batch_query
+import query_answers
+from conftest import random_index
+
+def test_batch_answers_match_answer_query():
+    rng = random.Random(0)
+
+    for trial in range(50):
+        tf_idf = random_index(rng, n_lemmas=10, n_docs=30, weights=[-0.5, 0.25, 0.5, 1.0])  # Few distinct weights, many ties
+        engine = batch_query.BatchQueryEngine(tf_idf)
+        queries = [rng.sample(sorted(tf_idf), rng.randint(1, 4)) + rng.sample(["missing", "lemma0"], 1) for _ in range(20)]
+
+        for top_k in [None, 1, 3, 10]:
+            expected = [query_answers.answer_query(query, tf_idf, top_k, as_dataframe=False) for query in queries]
+            assert engine.answer_queries(queries, top_k) == expected
+
+def test_ties_are_broken_by_url():
+    engine = batch_query.BatchQueryEngine({"a": {"u3": 1.0, "u1": 1.0, "u2": 1.0}})
+    assert engine.answer_queries([["a"]], top_k=2) == [[("u1", 1.0), ("u2", 1.0)]]
+    assert query_answers.answer_query(["a"], {"a": {"u3": 1.0, "u1": 1.0, "u2": 1.0}}, top_k=2, as_dataframe=False) == [("u1", 1.0), ("u2", 1.0)]
@@ -0,0 +1,49 @@
+import os
+import pytest
+import binary_index
+import boolean_query
+import storage
+
+TF_IDF = {"apple": {"u1": 0.5, "u2": 0.25}, "pear": {"u2": 0.5, "u3": 0.125}}
+
+@pytest.fixture(params=["dictionary", "postings_dict", "postings_table", "binary_index"])
+def index(request, data_dir):
+    if request.param == "dictionary":
+        yield TF_IDF
+    elif request.param == "postings_dict":
+        yield boolean_query.PostingsDict(TF_IDF)
+    elif request.param == "postings_table":
+        storage.save_postings(TF_IDF)
+        yield storage.PostingsTable()
+    else:
+        path = os.path.join(data_dir, "index.bin")
+        binary_index.write_binary_index(TF_IDF, path)
+        with binary_index.BinaryIndex(path) as index:
+            yield index
+
+def test_pure_not(index):
+    assert boolean_query.BooleanEvaluator(index).answer(("not", ("term", "apple"))) == [("u3", 0.0)]
+    assert boolean_query.BooleanEvaluator(index).answer(("not", ("term", "missing"))) == [("u1", 0.0), ("u2", 0.0), ("u3", 0.0)]
+
+def test_and_not_and_or(index):
+    evaluator = boolean_query.BooleanEvaluator(index)
+    assert evaluator.answer(("and", [("term", "pear"), ("not", ("term", "apple"))])) == [("u3", 0.125)]
+    assert evaluator.answer(("or", [("term", "apple"), ("term", "pear")])) == [("u2", 0.75), ("u1", 0.5), ("u3", 0.125)]
+
+def test_every_lemma_is_fetched_once_per_query(data_dir, monkeypatch):
+    storage.save_postings(TF_IDF)
+    fetched = []
+    get = storage.PostingsTable.get
+    monkeypatch.setattr(storage.PostingsTable, "get", lambda self, lemma, default=None: fetched.append(lemma) or get(self, lemma, default))
+
+    query = ("and", [("term", "apple"), ("term", "pear"), ("not", ("term", "missing"))])
+    assert boolean_query.BooleanEvaluator(storage.PostingsTable()).answer(query) == [("u2", 0.75)]
+    assert sorted(fetched) == ["apple", "missing", "pear"]  # Sizes come from the lemmas table, scores reuse the postings
+
+def test_postings_dict_sorts_once():
+    index = boolean_query.PostingsDict(TF_IDF)
+    evaluator = boolean_query.BooleanEvaluator(index)
+    assert evaluator.answer(("term", "apple")) == [("u1", 0.5), ("u2", 0.25)]
+    first = index.sorted["apple"]
+    assert boolean_query.BooleanEvaluator(index).answer(("term", "apple")) == [("u1", 0.5), ("u2", 0.25)]
+    assert index.sorted["apple"] is first
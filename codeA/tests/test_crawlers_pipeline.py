@@ -0,0 +1,65 @@
+import os
+import sys
+import types
+import logging
+import pytest
+
+pytest.importorskip("twisted")
+pytest.importorskip("itemadapter")
+from twisted.internet import task
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "crawlers"))
+from crawlers import pipelines
+import storage
+
+@pytest.fixture
+def clock(monkeypatch):
+
+    """
+    Fake reactor time for the flush timers of the pipeline.
+    """
+
+    clock = task.Clock()
+
+    class ClockLoopingCall(task.LoopingCall):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.clock = clock
+
+    monkeypatch.setattr(pipelines.task, "LoopingCall", ClockLoopingCall)
+    return clock
+
+def saved_urls(table):
+    return [url for url, in storage.get_connection().execute("SELECT url FROM " + table + " ORDER BY url")]
+
+def test_articles_go_to_the_data_folder_database(data_dir, clock):
+    spider = types.SimpleNamespace(name="foxnews", logger=logging.getLogger("foxnews"))
+    pipeline = pipelines.CrawlersPipeline(batch_size=2, flush_interval=5.0)
+    pipeline.open_spider(spider)
+    try:
+        assert pipeline.database_path == os.path.join(data_dir, storage.DATABASE_FILE)
+        assert pipeline.db.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+        pipeline.process_item({'title': "t", 'url': "u1", 'content': "c"}, spider)
+        clock.advance(5)  # Saved by the timer before the batch fills up
+        assert saved_urls("foxnews") == ["u1"]
+    finally:
+        pipeline.close_spider(spider)
+
+def test_a_failed_flush_is_logged_and_the_timer_restarted(data_dir, clock, caplog):
+    spider = types.SimpleNamespace(name="bcc", logger=logging.getLogger("bcc"))
+    pipeline = pipelines.CrawlersPipeline(batch_size=10, flush_interval=5.0)
+    pipeline.open_spider(spider)
+    try:
+        pipeline.process_item({'title': "t", 'url': "u1", 'content': "c"}, spider)
+        pipeline.table = "missing"  # The next flush fails
+        with caplog.at_level(logging.ERROR, logger=pipelines.logger.name):
+            clock.advance(5)
+        assert "Could not save the pending articles" in caplog.text
+        assert pipeline.timer.running and pipeline.pending
+
+        pipeline.table = "bcc"
+        clock.advance(5)
+        assert saved_urls("bcc") == ["u1"] and not pipeline.pending
+    finally:
+        pipeline.close_spider(spider)
@@ -0,0 +1,50 @@
+import random
+import pytest
+import dedup
+import main
+import storage
+
+def article_texts(seed=0, n_words=80):
+
+    """
+    {url: content}: a wire story, a copy with one word changed, a copy under another url and three distinct articles.
+    """
+
+    rng = random.Random(seed)
+    vocabulary = ["word" + str(i) for i in range(500)]
+    story = [rng.choice(vocabulary) for _ in range(n_words)]
+    edited = list(story)
+    edited[n_words // 2] = "changed"
+    texts = {"fox/story": " ".join(story + ["extra"]), "jazeera/story": " ".join(edited), "bcc/story-copy": " ".join(story)}
+    for number in range(3):
+        texts["bcc/other" + str(number)] = " ".join(rng.choice(vocabulary) for _ in range(n_words))
+    return texts
+
+def write_crawl(texts):
+    db = storage.get_connection()
+    with db:
+        for table in dedup.DATABASE_TABLES:
+            db.execute("CREATE TABLE " + table + " (title TEXT, url TEXT, content TEXT)")
+        for url, content in texts.items():
+            table = {"fox": "foxnews", "jazeera": "aljazeera", "bcc": "bcc"}[url.split("/")[0]]
+            db.execute("INSERT INTO " + table + " VALUES ('title', ?, ?)", (url, content))
+
+def test_near_duplicates_collapse_to_the_longest_article(data_dir):
+    write_crawl(article_texts())
+
+    summary = dedup.find_duplicates()
+    duplicates = dict(storage.get_connection().execute("SELECT url, canonical_url FROM duplicates"))
+    assert duplicates == {"jazeera/story": "fox/story", "bcc/story-copy": "fox/story"}  # The distinct articles are all kept
+    assert summary['documents'] == 6 and summary['clusters'] == 1 and summary['duplicates'] == 2
+    assert summary['words_skipped'] == 160
+
+def test_deduplicated_build_drops_the_duplicates_from_the_postings(data_dir):
+    texts = article_texts()
+    write_crawl(texts)
+    try:
+        main.create_inverted_index(deduplicate=True)
+    except LookupError:
+        pytest.skip("NLTK tagger and tokenizer data are not installed")
+
+    indexed = set(storage.PostingsTable().urls())
+    assert indexed == set(texts) - {"jazeera/story", "bcc/story-copy"}
@@ -0,0 +1,91 @@
+import random
+import inverted_index
+import incremental_index
+import storage
+import token_store
+from conftest import write_articles
+
+def random_article(rng, url, n_words):
+    postags = [(rng.choice(["w" + str(i) for i in range(40)]), "NN") for _ in range(n_words)]
+    lemmas = {}
+    for word, _ in postags:
+        lemmas[word] = lemmas.get(word, 0) + 1
+    return url, postags, lemmas
+
+def build(rng, n_docs=60):
+
+    """
+    Articles tables, postings tables and state of a full build of n_docs random articles.
+    """
+
+    articles = {table: [] for table in incremental_index.DATABASE_TABLES}
+    for number in range(n_docs):
+        articles[incremental_index.DATABASE_TABLES[number % 3]].append(random_article(rng, "u" + str(number), rng.randint(5, 12)))
+    write_articles(articles)
+    inverted_index.lemmas_tf_idf()
+    incremental_index.record_state()
+    return storage.get_connection()
+
+def crawl(db, rng, changed=(), deleted=(), new=()):
+
+    """
+    Change the articles tables like a crawl, then apply the change like update_inverted_index with the NLP stages done here.
+    """
+
+    added = {}
+    for url in list(changed) + list(new):
+        url, postags, lemmas = random_article(rng, url, 3)
+        added[url] = (token_store.TokenStore(db).encode([postags])[0], lemmas)
+        content = " ".join(word for word, _ in postags)
+        with db:
+            if url in changed:
+                db.execute("UPDATE bcc SET content = ? WHERE url = ?", (content, url))
+            else:
+                db.execute("INSERT INTO bcc (title, url, content) VALUES ('title', ?, ?)", (url, content))
+    with db:
+        for url in deleted:
+            for table in incremental_index.DATABASE_TABLES:
+                db.execute("DELETE FROM " + table + " WHERE url = ?", (url,))
+
+    current, found_new, found_changed, found_deleted = incremental_index.find_changes(db)
+    assert (sorted(found_new), sorted(found_changed), sorted(found_deleted)) == (sorted(new), sorted(changed), sorted(deleted))
+    with db:
+        incremental_index.apply_changes(db, current, found_changed + found_deleted, {url: added[url] for url in found_new + found_changed})
+
+def rows(db, table):
+    return set(db.execute("SELECT * FROM postings" if table == "postings" else "SELECT rowid, * FROM " + table))  # postings has no rowid
+
+def test_update_of_one_article_leaves_the_other_rows_alone(data_dir):
+    rng = random.Random(0)
+    db = build(rng)
+    tables = incremental_index.DATABASE_TABLES + ["index_documents", "index_postings", "index_lemmas", "lemmas", "urls", "postings"]
+    before = {table: rows(db, table) for table in tables}
+    old_lemmas = {lemma for lemma, in db.execute("SELECT lemma FROM index_postings WHERE url = 'u2'")}
+    doc_id = db.execute("SELECT doc_id FROM urls WHERE url = 'u2'").fetchone()[0]
+    changes = db.total_changes
+
+    crawl(db, rng, changed=["u2"])  # In the bcc table
+    new_lemmas = {lemma for lemma, in db.execute("SELECT lemma FROM index_postings WHERE url = 'u2'")}
+    touched = old_lemmas | new_lemmas
+
+    # The content update of the crawl is one row, the other writes are the rows of u2 and of its lemmas
+    assert db.total_changes - changes <= 1 + 5 * len(touched) + 4 < len(before["postings"])
+    after = {table: rows(db, table) for table in tables}
+    for table in incremental_index.DATABASE_TABLES:
+        assert {row for row in after[table] if row[2] != "u2"} == {row for row in before[table] if row[2] != "u2"}
+    assert after["urls"] == before["urls"]
+    for table, column in [("index_documents", 1), ("index_postings", 2)]:
+        assert {row for row in after[table] if row[column] != "u2"} == {row for row in before[table] if row[column] != "u2"}
+    for table, column in [("index_lemmas", 1), ("lemmas", 2)]:
+        assert {row for row in after[table] if row[column] not in touched} == {row for row in before[table] if row[column] not in touched}
+    # tf and idf are stored apart: the postings of the other articles keep their rows even for the lemmas whose df changed
+    assert {row for row in after["postings"] if row[1] != doc_id} == {row for row in before["postings"] if row[1] != doc_id}
+
+def test_updated_postings_match_a_full_build(data_dir):
+    rng = random.Random(1)
+    db = build(rng)
+
+    crawl(db, rng, changed=["u2", "u5"], deleted=["u8", "u9"], new=["n1", "n2", "n3"])
+    updated = storage.read_postings()
+    assert incremental_index.state_lexicon(db).lemmas == sorted(updated)
+    assert updated == inverted_index.lemmas_tf_idf()  # Full build from the derived columns restored by the update
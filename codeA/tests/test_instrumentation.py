@@ -0,0 +1,15 @@
+import os
+import pytest
+import instrumentation
+import pipeline
+import main
+
+def test_failed_build_turns_instrumentation_off(data_dir, monkeypatch):
+
+    def fail(*args):
+        raise RuntimeError("build failed")
+
+    monkeypatch.setattr(pipeline, "run_pipeline", fail)
+    with pytest.raises(RuntimeError):
+        main.create_inverted_index(metrics_path=os.path.join(data_dir, "metrics.jsonl"))
+    assert instrumentation.ACTIVE is None
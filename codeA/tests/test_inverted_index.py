@@ -0,0 +1,15 @@
+import inverted_index
+from conftest import write_articles
+
+ARTICLES = {
+    "foxnews": [("f1", [("cats", "NNS"), ("run", "VB")], {"cat": 1, "run": 1})],
+    "aljazeera": [("a1", [("cat", "NN"), ("sleeps", "VBZ"), ("cat", "NN")], {"cat": 2, "sleep": 1})],
+    "bcc": [("b1", [("dogs", "NNS")], {"dog": 1}), ("b2", [], {})],
+}
+
+def test_lemmas_tf_idf_has_every_lemma_of_the_database(data_dir):
+    write_articles(ARTICLES)
+
+    tf_idf = inverted_index.lemmas_tf_idf()
+    assert len(tf_idf) == len(inverted_index.count_docs_containing_lemmas()) == 4
+    assert tf_idf["cat"]["a1"] == inverted_index.tf_idf_weight(2, 3, 4, 2)
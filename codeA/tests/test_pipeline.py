@@ -0,0 +1,36 @@
+import multiprocessing
+import pytest
+import PosTagger
+
+TEXTS = [
+    "The minister said the talks would resume on Monday. Officials declined to comment.",
+    "Heavy rain flooded several streets in the capital overnight.",
+    "Stocks rose sharply after the central bank held interest rates steady. Oil prices fell.",
+    "",
+    "A spokesperson confirmed that the summit was postponed.",
+]
+
+def fail(text):
+    raise ValueError("Tagging failed")
+
+def test_parallel_tagging_matches_serial():
+    try:
+        serial_tags = PosTagger.tag_texts(TEXTS)
+    except LookupError:
+        pytest.skip("NLTK tagger and tokenizer data are not installed")
+
+    for workers, chunk_size in [(2, 1), (3, 2)]:
+        with PosTagger.tagging_pool(workers) as pool:
+            assert PosTagger.tag_texts(TEXTS, pool, chunk_size) == serial_tags
+
+def test_tagging_pool_stops_workers_after_a_failure(monkeypatch):
+    monkeypatch.setattr(PosTagger, "get_tagger", lambda: None)  # Workers start without loading the model
+
+    with pytest.raises(ValueError):
+        with PosTagger.tagging_pool(2) as pool:
+            list(pool.imap(fail, TEXTS))
+    assert multiprocessing.active_children() == []
+
+def test_tagging_pool_is_none_for_serial_tagging():
+    with PosTagger.tagging_pool(1) as pool:
+        assert pool is None
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+import positional_index
+
+# Positions of every lemma, with gaps that need 1, 2 and 3 varint bytes
+POSITIONS = {
+    "prime": {"u1": [5, 200, 20000], "u2": [3], "u3": [1], "u4": [7]},
+    "minister": {"u1": [20001], "u2": [5], "u3": [0], "u4": [7]},
+    "election": {"u1": [127], "u2": [4], "u3": [16384]},
+}
+
+@pytest.fixture
+def index(tmp_path):
+    path = str(tmp_path / "positional_index.bin")
+    positional_index.write_positional_index(POSITIONS, path)
+    index = positional_index.PositionalIndex(path)
+    yield index
+    index.close()
+
+def urls(index, doc_ids):
+    return [index.url(doc_id) for doc_id in doc_ids.tolist()]
+
+def test_varints_at_the_7_and_14_bit_boundaries():
+    for value, length in [(0, 1), (127, 1), (128, 2), (16383, 2), (16384, 3), (2 ** 21 - 1, 3), (2 ** 21, 4), (2 ** 63, 10)]:
+        assert len(positional_index.encode_varints([value])) == length
+    values = [0, 1, 127, 128, 129, 16383, 16384, 16385, 2 ** 32, 2 ** 63]
+    assert positional_index.decode_varints(positional_index.encode_varints(values)).tolist() == values
+
+def test_block_round_trip():
+    positions = [np.array([0, 127, 128, 16511]), np.array([16384]), np.array([3, 4])]
+    doc_ids, counts, decoded = positional_index.decode_block(positional_index.encode_block([0, 128, 16512], positions))
+    assert doc_ids.tolist() == [0, 128, 16512] and counts.tolist() == [4, 1, 2]
+    assert decoded.tolist() == np.concatenate(positions).tolist()
+
+def test_phrase_across_position_gaps(index):
+    assert urls(index, index.phrase(["prime", "minister"])) == ["u1"]  # 20000, 20001 after gaps of 195 and 19800
+    assert urls(index, index.phrase(["prime"])) == ["u1", "u2", "u3", "u4"]
+    assert urls(index, index.phrase(["prime", "election", "minister"])) == ["u2"]
+    assert urls(index, index.phrase(["minister", "prime"])) == ["u3"]  # Order matters
+
+def test_near_windows_of_0_and_1(index):
+    assert urls(index, index.near(["prime", "minister"], 0)) == ["u4"]  # Same position only
+    assert urls(index, index.near(["prime", "minister"], 1)) == ["u1", "u3", "u4"]  # Adjacent, in any order
+    assert urls(index, index.near(["prime", "minister"], 2)) == ["u1", "u2", "u3", "u4"]
+    assert urls(index, index.near(["prime", "prime"], 0)) == ["u1", "u2", "u3", "u4"]  # A repeated lemma is one occurrence
+
+def test_lemma_missing_from_the_index(index):
+    assert index.lemma_id("missing") == -1
+    assert all(len(array) == 0 for array in index.positions("missing"))
+    assert len(index.phrase(["prime", "missing"])) == 0
+    assert len(index.near(["prime", "missing"], 10)) == 0
+    assert index.match([("phrase", ["missing"]), ("near", ["prime", "minister"], 1)]) == []
@@ -0,0 +1,127 @@
+import os
+import asyncio
+import threading
+import pytest
+import binary_index
+import lexicon
+import snapshot
+import query_server
+
+TF_IDF = {"ukraine": {"u1": 0.5, "u2": 0.25}, "war": {"u2": 0.5, "u3": 0.125}}
+
+class SplitAnalyzer:
+
+    """
+    Query analyzer without NLTK: lemmas are the comma separated words. analyze blocks while gate is cleared.
+    """
+
+    def __init__(self):
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def analyze(self, text):
+        self.gate.wait()
+        if text == "fail":
+            raise RuntimeError("analysis failed")
+        return [word.strip() for word in text.split(",")]
+
+def publish_index(snapshots_dir):
+    staging_dir = snapshot.create_staging(snapshots_dir)
+    index_lexicon = lexicon.Lexicon.from_counts({lemma: len(postings) for lemma, postings in TF_IDF.items()},
+                                                {lemma: len(postings) for lemma, postings in TF_IDF.items()})
+    binary_index.write_binary_index(TF_IDF, os.path.join(staging_dir, snapshot.INDEX_FILE), index_lexicon)
+    index_lexicon.save(os.path.join(staging_dir, snapshot.LEXICON_FILE))
+    return snapshot.publish(staging_dir, snapshots_dir)
+
+@pytest.fixture
+def snapshots_dir(tmp_path):
+    snapshots_dir = str(tmp_path / "snapshots")
+    publish_index(snapshots_dir)
+    return snapshots_dir
+
+async def start_server(snapshots_dir, **options):
+    server = query_server.QueryServer(snapshots_dir, port=0, workers=2, analyzer=SplitAnalyzer(), **options)
+    port = await server.start()
+    return server, port
+
+@pytest.mark.parametrize("use_processes", [False, True])
+def test_query_and_stats(snapshots_dir, use_processes):
+
+    async def run():
+        server, port = await start_server(snapshots_dir, use_processes=use_processes)
+        try:
+            status, answer = await query_server.request("POST", "/query", {'query': "ukraine,war", 'top_k': 2}, port=port)
+            assert status == 200
+            assert answer['lemmas'] == ["ukraine", "war"]
+            assert answer['results'] == [["u2", 0.75], ["u1", 0.5]]
+            assert not answer['cached']
+            assert (await query_server.query("war,ukraine", 2, port=port))['cached']  # Same set of lemmas
+
+            status, stats = await query_server.request("GET", "/stats", port=port)
+            assert status == 200
+            assert stats['requests'] == 2 and stats['rejected'] == 0 and stats['pending'] == 0
+            assert stats['cache']['hits'] == 1
+
+            assert (await query_server.request("GET", "/missing", port=port))[0] == 404
+            assert (await query_server.request("POST", "/query", {'top_k': 2}, port=port))[0] == 400
+        finally:
+            await server.stop()
+
+    asyncio.run(run())
+
+def test_backpressure_rejects_with_503(snapshots_dir):
+
+    async def run():
+        server, port = await start_server(snapshots_dir, use_processes=False, max_pending=1)
+        try:
+            server.analyzer.gate.clear()  # The first query stays pending
+            first = asyncio.ensure_future(query_server.request("POST", "/query", {'query': "ukraine"}, port=port))
+            while server.pending == 0:
+                await asyncio.sleep(0.01)
+
+            status, answer = await query_server.request("POST", "/query", {'query': "war"}, port=port)
+            assert status == 503
+            assert (await query_server.request("GET", "/stats", port=port))[1]['rejected'] == 1  # The event loop is not blocked
+
+            server.analyzer.gate.set()
+            status, answer = await first
+            assert status == 200 and answer['results'] == [["u1", 0.5], ["u2", 0.25]]
+        finally:
+            server.analyzer.gate.set()
+            await server.stop()
+
+    asyncio.run(run())
+
+def test_failing_query_gets_500_and_the_connection_is_closed(snapshots_dir):
+
+    async def run():
+        server, port = await start_server(snapshots_dir, use_processes=False)
+        try:
+            status, answer = await asyncio.wait_for(query_server.request("POST", "/query", {'query': "fail"}, port=port), 5)
+            assert status == 500
+            assert server.pending == 0
+            assert (await query_server.query("war", port=port))['results'] == [["u2", 0.5], ["u3", 0.125]]
+        finally:
+            await server.stop()
+
+    asyncio.run(run())
+
+@pytest.mark.skipif(snapshot.fcntl is None, reason="Snapshots are only garbage collected with flock")
+def test_scoring_processes_release_replaced_snapshots(snapshots_dir):
+
+    async def run():
+        server = query_server.QueryServer(snapshots_dir, port=0, workers=1, check_interval=0.0, analyzer=SplitAnalyzer())
+        port = await server.start()
+        try:
+            first = snapshot.current_snapshot(snapshots_dir)
+            assert (await query_server.query("war", port=port))['results'] == [["u2", 0.5], ["u3", 0.125]]
+
+            for _ in range(2):  # The server and the worker switch to every new snapshot on their next query
+                publish_index(snapshots_dir)
+                assert (await query_server.query("ukraine", port=port))['results'] == [["u1", 0.5], ["u2", 0.25]]
+            assert not os.path.exists(first)  # No process still holds its reader lock
+            assert sorted(os.listdir(snapshots_dir)) == sorted([snapshot.CURRENT_FILE, os.path.basename(snapshot.current_snapshot(snapshots_dir))])
+        finally:
+            await server.stop()
+
+    asyncio.run(run())
@@ -0,0 +1,32 @@
+import random
+import pytest
+import binary_index
+import ranking
+import query_answers
+from conftest import random_index
+
+def test_max_score_matches_exhaustive_answer_query(tmp_path):
+    rng = random.Random(0)
+
+    for trial in range(200):
+        tf_idf = random_index(rng)
+        path = str(tmp_path / "index.bin")
+        binary_index.write_binary_index(tf_idf, path)
+
+        with binary_index.BinaryIndex(path) as index:
+            for _ in range(5):
+                query = rng.sample(sorted(tf_idf), rng.randint(1, 5))
+                k = rng.randint(1, 10)
+                exhaustive = query_answers.answer_query(query, index, as_dataframe=False)[:k]
+                pruned = query_answers.answer_query(query, index, top_k=k, as_dataframe=False)
+
+                assert [url for url, _ in pruned] == [url for url, _ in exhaustive]
+                assert [weight for _, weight in pruned] == pytest.approx([weight for _, weight in exhaustive], abs=1e-6)
+
+def test_max_score_ties_prefer_smaller_doc_id(tmp_path):
+    path = str(tmp_path / "index.bin")
+    binary_index.write_binary_index({"a": {"u1": 0.5, "u2": 0.5, "u3": 0.5}, "b": {"u3": -0.25}}, path)
+
+    with binary_index.BinaryIndex(path) as index:
+        assert ranking.max_score_top_k(["a", "b"], index, 2) == [(0, 0.5), (1, 0.5)]
+        assert ranking.max_score_top_k(["missing"], index, 2) == []
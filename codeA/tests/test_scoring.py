@@ -0,0 +1,67 @@
+import random
+import numpy as np
+import scoring
+
+def random_counts(rng, n_lemmas=10, n_docs=60):
+
+    """
+    ({lemma: {url: count}}, {url: length}) with small counts, so many postings share an impact.
+    """
+
+    lemma_counts = {}
+    for i in range(n_lemmas):
+        urls = rng.sample(range(n_docs), rng.randint(1, n_docs))
+        lemma_counts["lemma" + str(i)] = {"u" + str(doc): rng.randint(1, 4) for doc in urls}
+    lengths = {"u" + str(doc): rng.randint(5, 50) for doc in range(n_docs)}
+    return lemma_counts, lengths
+
+def exhaustive_impact_top_k(index, query, scorer, k):
+    impact_postings = index.impacts[scorer]
+    totals = {}
+    for lemma in query:
+        lemma_id = index.counts.lemma_id(lemma)
+        if lemma_id >= 0:
+            for doc_id, impact in zip(*(postings.tolist() for postings in impact_postings.postings(lemma_id))):
+                totals[doc_id] = totals.get(doc_id, 0) + impact
+    best = sorted(totals.items(), key=lambda item: (-item[1], item[0]))[:k]
+    return [(index.counts.url(doc_id), total / impact_postings.scale) for doc_id, total in best]
+
+def test_impact_top_k_matches_exhaustive_quantized_scores(tmp_path):
+    rng = random.Random(0)
+
+    for trial in range(20):
+        snapshot_dir = tmp_path / str(trial)
+        snapshot_dir.mkdir()
+        lemma_counts, lengths = random_counts(rng)
+        scoring.write_scoring_index(str(snapshot_dir), lemma_counts, lengths, len(lengths) + 5, impact_scorers=list(scoring.SCORERS))
+
+        index = scoring.ScoringIndex(str(snapshot_dir))
+        try:
+            for _ in range(10):
+                query = rng.sample(sorted(lemma_counts) + ["missing"], rng.randint(1, 4))
+                k = rng.randint(1, 12)
+                for scorer in scoring.SCORERS:
+                    assert index.impact_top_k(query, scorer, k) == exhaustive_impact_top_k(index, query, scorer, k)
+        finally:
+            index.close()
+
+def check_runs(index, impact_postings, lemma_id):
+    doc_ids, impacts = impact_postings.postings(lemma_id)
+    runs = impact_postings.runs(lemma_id)
+    assert runs[0] == 0 and runs[-1] == len(doc_ids)
+    assert all(len(set(impacts[start:end].tolist())) == 1 for start, end in zip(runs[:-1], runs[1:]))
+    assert np.all(np.diff(impacts[runs[:-1]].astype(np.int64)) < 0)
+
+    by_doc = dict(zip(doc_ids.tolist(), impacts.tolist()))
+    assert impact_postings.doc_impacts(lemma_id).tolist() == [by_doc[doc_id] for doc_id in index.counts.postings(lemma_id)[0].tolist()]
+
+def test_impact_runs_cover_the_postings(tmp_path):
+    lemma_counts, lengths = random_counts(random.Random(1))
+    scoring.write_scoring_index(str(tmp_path), lemma_counts, lengths, len(lengths), impact_scorers=["bm25"])
+
+    index = scoring.ScoringIndex(str(tmp_path))
+    try:
+        for lemma_id in range(index.impacts["bm25"].n_lemmas):
+            check_runs(index, index.impacts["bm25"], lemma_id)  # The views are released before close
+    finally:
+        index.close()
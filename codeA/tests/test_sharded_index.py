@@ -0,0 +1,68 @@
+import os
+import random
+import binary_index
+import inverted_index
+import sharded_index
+import query_answers
+
+SOURCES = ["foxnews", "aljazeera", "bcc"]
+
+def random_shards(rng, lemmas, shared_url):
+
+    """
+    {source: (lemma_counts {lemma: {url: count}}, lengths {url: length}, number of articles)}. shared_url is crawled by every
+    source with the same lemmas, the other urls belong to one source. Some articles have no lemmas.
+    """
+
+    shared_lemmas = rng.sample(lemmas, 3)
+    shards = {}
+    for source in SOURCES:
+        lemma_counts, lengths = {}, {}
+        articles = [(source + "/" + str(i), rng.sample(lemmas, rng.randint(1, 5))) for i in range(rng.randint(5, 15))] + [(shared_url, shared_lemmas)]
+        for url, article_lemmas in articles:
+            lengths[url] = rng.randint(len(article_lemmas), 20)
+            for lemma in article_lemmas:
+                lemma_counts.setdefault(lemma, {})[url] = rng.randint(1, 3)
+        shards[source] = (lemma_counts, lengths, len(articles) + rng.randint(0, 2))
+    return shards
+
+def single_index(shards):
+
+    """
+    Weights of a single index build over the articles of every shard: the last copy of a url wins.
+    """
+
+    articles_count = sum(documents for _, _, documents in shards.values())
+    df = {}
+    for lemma_counts, _, _ in shards.values():
+        for lemma, counts in lemma_counts.items():
+            df[lemma] = df.get(lemma, 0) + len(counts)
+
+    tf_idf = {}
+    for source in SOURCES:
+        lemma_counts, lengths, _ = shards[source]
+        for lemma, counts in lemma_counts.items():
+            for url, count in counts.items():
+                tf_idf.setdefault(lemma, {})[url] = inverted_index.tf_idf_weight(count, lengths[url], articles_count, df[lemma])
+    return tf_idf
+
+def test_sharded_answers_match_the_single_index(data_dir):
+    rng = random.Random(0)
+    lemmas = ["lemma" + str(i) for i in range(12)]
+    shards = random_shards(rng, lemmas, "shared/article")
+    for source, (lemma_counts, lengths, documents) in shards.items():
+        sharded_index.write_shard(source, lemma_counts, lengths, documents)
+
+    path = os.path.join(data_dir, "single.bin")
+    binary_index.write_binary_index(single_index(shards), path)
+    index = sharded_index.ShardedIndex(SOURCES)
+    try:
+        with binary_index.BinaryIndex(path) as single:
+            for _ in range(100):
+                query = rng.sample(lemmas, rng.randint(1, 4))
+                top_k = rng.choice([None, 1, 3, 10])
+                answer = index.answer_query(query, top_k)
+                assert answer == query_answers.answer_query(query, single, top_k, as_dataframe=False)
+                assert len({url for url, _ in answer}) == len(answer)  # The shared url is answered once
+    finally:
+        index.close()
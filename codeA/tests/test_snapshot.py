@@ -0,0 +1,75 @@
+import os
+import types
+import pytest
+import binary_index
+import lexicon
+import snapshot
+import main
+
+TF_IDF = {"apple": {"u1": 0.5, "u2": 0.25}}
+
+pytestmark = pytest.mark.skipif(snapshot.fcntl is None, reason="Snapshots are only locked and garbage collected with flock")
+
+def publish_index(snapshots_dir):
+    staging_dir = snapshot.create_staging(snapshots_dir)
+    index_lexicon = lexicon.Lexicon.from_tf_idf(TF_IDF)
+    binary_index.write_binary_index(TF_IDF, os.path.join(staging_dir, snapshot.INDEX_FILE), index_lexicon)
+    index_lexicon.save(os.path.join(staging_dir, snapshot.LEXICON_FILE))
+    return snapshot.publish(staging_dir, snapshots_dir)
+
+def test_publish_replaces_current_atomically(tmp_path, monkeypatch):
+    snapshots_dir = str(tmp_path)
+    first = publish_index(snapshots_dir)
+    replaced = []
+    replace = os.replace
+
+    def recording_replace(source, destination):
+        replaced.append((os.path.basename(source), os.path.basename(destination)))
+        replace(source, destination)
+
+    monkeypatch.setattr(snapshot.os, "replace", recording_replace)
+    second = publish_index(snapshots_dir)
+
+    assert replaced[-1] == (snapshot.CURRENT_FILE + ".tmp", snapshot.CURRENT_FILE)  # The staging directory is renamed first
+    assert snapshot.current_snapshot(snapshots_dir) == second != first
+    assert not os.path.exists(os.path.join(snapshots_dir, snapshot.CURRENT_FILE + ".tmp"))
+
+def test_garbage_collection_waits_for_the_readers(tmp_path):
+    snapshots_dir = str(tmp_path)
+    first = publish_index(snapshots_dir)
+    reader = snapshot.Snapshot(first)  # Shared lock
+    try:
+        publish_index(snapshots_dir)
+        assert os.path.exists(first)  # Skipped by the collection of publish
+        assert snapshot.collect_garbage(snapshots_dir) == 0
+    finally:
+        reader.close()
+
+    assert snapshot.collect_garbage(snapshots_dir) == 1
+    assert not os.path.exists(first)
+
+def test_snapshot_deleted_before_it_is_locked(tmp_path, monkeypatch):
+    snapshot_dir = publish_index(str(tmp_path))
+    flock = snapshot.fcntl.flock
+
+    def collected_flock(lock, operation):
+        os.remove(os.path.join(snapshot_dir, snapshot.INDEX_FILE))  # A collection between open and flock
+        flock(lock, operation)
+
+    monkeypatch.setattr(snapshot, "fcntl", types.SimpleNamespace(flock=collected_flock, LOCK_SH=snapshot.fcntl.LOCK_SH))
+    with pytest.raises(FileNotFoundError):
+        snapshot.Snapshot(snapshot_dir)
+
+def test_main_keeps_only_the_current_snapshot_open(data_dir):
+    first = publish_index(snapshot.snapshots_path())
+    try:
+        current = main.read_snapshot()
+        assert main.read_binary_index() is current.index and main.read_positional_index() is current.positional is None
+
+        second = publish_index(snapshot.snapshots_path())
+        assert os.path.exists(first)  # Still open
+        assert main.read_binary_index() is main.read_snapshot().index and list(main.SNAPSHOTS) == [second]
+        assert snapshot.collect_garbage() == 1 and not os.path.exists(first)
+    finally:
+        while main.SNAPSHOTS:
+            main.SNAPSHOTS.popitem()[1].close()
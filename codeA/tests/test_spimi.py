@@ -0,0 +1,98 @@
+import math
+import random
+import numpy as np
+import inverted_index
+import pipeline
+import positional_index
+import snapshot
+import spimi
+import storage
+from conftest import write_articles
+
+def synthetic_positions(seed=0, n_docs=40):
+
+    """
+    (url, {lemma: positions}) of articles like positional_index.document_positions yields, with a url that appears twice and empty articles.
+    """
+
+    rng = random.Random(seed)
+    documents = []
+    for number in range(n_docs):
+        url = "u3" if number == n_docs - 5 else "u" + str(number)  # The second copy of u3 replaces the first one
+        lemmas = rng.sample(["lemma" + str(i) for i in range(15)], rng.randint(0, 6))
+        documents.append((url, {lemma: np.array(sorted(rng.sample(range(80), rng.randint(1, 5))), dtype=np.int64) for lemma in lemmas}))
+    documents.append(("u7", {}))  # The last copy of u7 has no lemmas
+    return documents
+
+def test_streamed_positional_index_matches_the_in_memory_one(tmp_path, monkeypatch):
+    documents = synthetic_positions()
+    monkeypatch.setattr(positional_index, "document_positions", lambda chunk_size=500: iter(documents))
+
+    in_memory_path, streamed_path = str(tmp_path / "in_memory.bin"), str(tmp_path / "streamed.bin")
+    positional_index.write_positional_index(positional_index.read_lemma_positions(), in_memory_path)
+    runs_dir = tmp_path / "runs"
+    runs_dir.mkdir()
+    spimi.build_positional_index(str(runs_dir), streamed_path, memory_budget=500)  # Several runs
+
+    assert len(list(runs_dir.iterdir())) > 1
+    with open(in_memory_path, "rb") as in_memory, open(streamed_path, "rb") as streamed:
+        created = positional_index.HEADER.size - 8
+        in_memory_bytes, streamed_bytes = in_memory.read(), streamed.read()
+        assert in_memory_bytes[:created] + in_memory_bytes[created + 8:] == streamed_bytes[:created] + streamed_bytes[created + 8:]  # Same file but the creation time
+
+def write_stats_articles(seed=0, n_docs=45):
+
+    """
+    Articles tables with their doc_stats and lemma_df rows, counted like pipeline.run_pipeline does, with a url in two tables
+    and an article without lemmas.
+    """
+
+    rng = random.Random(seed)
+    articles = {table: [] for table in inverted_index.DATABASE_TABLES}
+    for number in range(n_docs):
+        url = "u3" if number == n_docs - 4 else "u" + str(number)  # The copy in bcc comes last and replaces the one in foxnews
+        postags = [(rng.choice(["lemma" + str(i) for i in range(20)]), "NN") for _ in range(rng.randint(0 if number == 7 else 1, 10))]
+        lemmas = {}
+        for word, _ in postags:
+            lemmas[word] = lemmas.get(word, 0) + 1
+        articles[inverted_index.DATABASE_TABLES[number % 3]].append((url, postags, lemmas))
+    write_articles(articles)
+
+    db = storage.get_connection()
+    lemma_df, lemma_cf = {}, {}
+    with db:
+        pipeline.create_stats_tables(db)
+        for table in inverted_index.DATABASE_TABLES:
+            for rowid, (url, postags, lemmas) in enumerate(articles[table], 1):
+                norm = math.sqrt(sum(count * count for count in lemmas.values()))
+                db.execute("INSERT INTO doc_stats (source, source_rowid, url, token_count, unique_lemmas, norm) VALUES (?, ?, ?, ?, ?, ?)",
+                           (table, rowid, url, len(postags), len(lemmas), norm))
+                for lemma, count in lemmas.items():
+                    lemma_df[lemma] = lemma_df.get(lemma, 0) + 1
+                    lemma_cf[lemma] = lemma_cf.get(lemma, 0) + count
+        db.executemany("INSERT INTO lemma_df VALUES (?, ?, ?)", [(lemma, lemma_df[lemma], lemma_cf[lemma]) for lemma in lemma_df])
+
+def current_binary_index():
+    current = snapshot.open_current()
+    try:
+        index = current.index
+        return [(index.lemma(lemma_id), [index.url(doc_id) for doc_id in index.postings(lemma_id)[0].tolist()], index.postings(lemma_id)[1].tolist())
+                for lemma_id in range(index.n_lemmas)]
+    finally:
+        current.close()
+
+def test_budgeted_build_matches_the_in_memory_weights(data_dir, monkeypatch):
+    write_stats_articles()
+    expected = inverted_index.lemmas_tf_idf_from_stats()
+    inverted_index.inverted_to_binary(expected, inverted_index.lexicon_from_stats())
+    expected_binary = current_binary_index()
+
+    runs = []
+    write_run = spimi.write_run
+    monkeypatch.setattr(spimi, "write_run", lambda block, path: runs.append(path) or write_run(block, path))
+    postings_table = spimi.build_index(memory_budget=300)
+
+    assert len(runs) > 1
+    assert dict(postings_table.items()) == expected
+    assert storage.read_postings() == expected
+    assert current_binary_index() == expected_binary
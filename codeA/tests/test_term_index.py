@@ -0,0 +1,60 @@
+import random
+import pytest
+import lexicon
+import term_index
+
+LEMMAS = ["a", "ab", "ox", "cat", "cats", "coat", "dog", "ukraine", "ukrainian", "minister", "ministry", "café", "cafe", "naïve",
+          "straße", "strasse", "über", "uber", "東京", "東京都", "election", "elect"]
+ALPHABET = "abcdeiknorstuéïß東京"
+
+@pytest.fixture
+def terms(tmp_path):
+    rng = random.Random(0)
+    lemmas_lexicon = lexicon.Lexicon.from_counts({lemma: rng.randint(1, 3) for lemma in LEMMAS}, {lemma: 5 for lemma in LEMMAS})
+    path = str(tmp_path / "term_index.bin")
+    term_index.write_term_index(lemmas_lexicon.lemmas, path)
+    terms = term_index.TermIndex(path, lemmas_lexicon)
+    yield terms
+    terms.close()
+
+def levenshtein(word, other):
+    previous = list(range(len(other) + 1))
+    for i, char in enumerate(word, 1):
+        current = [i]
+        for j, other_char in enumerate(other, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char != other_char)))
+        previous = current
+    return previous[-1]
+
+def brute_force_fuzzy(terms, word, max_distance):
+    matches = sorted((levenshtein(word, lemma), -terms.lexicon.df[lemma_id], lemma) for lemma_id, lemma in enumerate(terms.lexicon.lemmas))
+    return [(lemma, distance) for distance, _, lemma in matches if distance <= max_distance]
+
+def misspell(rng, word):
+    position = rng.randint(0, len(word))
+    edit = rng.choice(["insert", "delete", "substitute"])
+    if edit == "insert" or not word:
+        return word[:position] + rng.choice(ALPHABET) + word[position:]
+    position = min(position, len(word) - 1)
+    return word[:position] + (rng.choice(ALPHABET) if edit == "substitute" else "") + word[position + 1:]
+
+def test_fuzzy_matches_brute_force_edit_distance(terms):
+    rng = random.Random(1)
+    words = ["", "a", "b", "x", "ab", "ba", "oxx", "東", "東东"] + LEMMAS
+    for _ in range(200):
+        word = rng.choice(LEMMAS)
+        for _ in range(rng.randint(1, 3)):
+            word = misspell(rng, word)
+        words.append(word)
+
+    for word in words:
+        for max_distance in [0, 1, 2, 3]:
+            assert terms.fuzzy(word, max_distance) == brute_force_fuzzy(terms, word, max_distance), (word, max_distance)
+        assert terms.fuzzy(word) == brute_force_fuzzy(terms, word, term_index.default_max_distance(word)), word
+
+def test_max_distance_boundary(terms):
+    assert ("ministry", 2) in terms.fuzzy("minister", 2) and ("ministry", 2) not in terms.fuzzy("minister", 1)
+    assert terms.fuzzy("xy") == []  # Under 3 characters only exact matches, and "xy" is not a lemma
+    assert terms.fuzzy("ox") == [("ox", 0)]
+    assert sorted(terms.expand("strase")) == ["strasse", "straße"]  # Both one edit away
+    assert terms.expand("ükraine") == ["ukraine"]
@@ -0,0 +1,129 @@
+import numpy as np
+import storage
+
+TOKEN_VOCABULARY = "token_vocabulary"  # (id, value) table of every word seen by the tagger
+TAG_VOCABULARY = "tag_vocabulary"  # (id, value) table of every PoS tag
+TOKEN_DTYPE = np.dtype("<u4")
+TAG_DTYPE = np.dtype("u1")
+BYTES_PER_TOKEN = TOKEN_DTYPE.itemsize + TAG_DTYPE.itemsize
+IN_BATCH = 500  # Values per "IN (...)" lookup, below SQLite's limit of query parameters
+
+"""
+COMPACT TOKEN STORAGE.
+The PoSTags and PoSTags_cleaned columns hold a list of (word, tag) as one blob instead of JSON:
+    uint32[n] word ids, then uint8[n] tag ids
+ids point to the token_vocabulary and tag_vocabulary tables, shared by every article, source and process of a build.
+A blob is 5 bytes per word, its length is len(blob) // 5, and token_ids / tag_ids are zero copy numpy views of it:
+stages that only need the ids or the length never decode anything. decode gives the (word, tag) list back when the words are needed.
+Ids are never reassigned, so blobs stay valid across builds. Columns written as JSON by older builds need a full build.
+"""
+
+def check_blob(blob):
+    if isinstance(blob, str):
+        raise ValueError("Found a JSON PoS tags column written by an older build, run a full build (main.create_inverted_index)")
+    return blob
+
+def length(blob):
+
+    """
+    Number of words of an encoded list of (word, tag).
+    """
+
+    return len(check_blob(blob)) // BYTES_PER_TOKEN
+
+def token_ids(blob):
+
+    """
+    uint32 numpy view of the word ids of a blob, no copy.
+    """
+
+    return np.frombuffer(check_blob(blob), dtype=TOKEN_DTYPE, count=length(blob))
+
+def tag_ids(blob):
+
+    """
+    uint8 numpy view of the tag ids of a blob, no copy.
+    """
+
+    n = length(blob)
+    return np.frombuffer(blob, dtype=TAG_DTYPE, count=n, offset=n * TOKEN_DTYPE.itemsize)
+
+class Vocabulary:
+
+    """
+    Table of (id, value) shared through the database. New values get the next free id, ids never change.
+    """
+
+    def __init__(self, db, table, max_id):
+        self.db = db
+        self.table = table
+        self.max_id = max_id
+        self.ids = {}  # {value: id} of the values this process has seen
+        self.values = np.array([None], dtype=object)  # values[id], loaded when an unknown id is decoded
+        db.execute("CREATE TABLE IF NOT EXISTS " + table + " (id INTEGER PRIMARY KEY, value TEXT NOT NULL UNIQUE)")
+
+    def add(self, values):
+
+        """
+        Make sure that every value has an id, inserting the new ones. Run inside the write transaction of the rows that use them.
+        """
+
+        new_values = list({value for value in values if value not in self.ids})
+        if not new_values:
+            return
+
+        self.db.executemany("INSERT OR IGNORE INTO " + self.table + " (value) VALUES (?)", [(value,) for value in new_values])  # Other processes may have added some
+        for start in range(0, len(new_values), IN_BATCH):
+            batch = new_values[start:start + IN_BATCH]
+            self.ids.update((value, value_id) for value_id, value in self.db.execute("SELECT id, value FROM " + self.table + " WHERE value IN (" + ", ".join("?" * len(batch)) + ")", batch))
+        if max(self.ids[value] for value in new_values) >= self.max_id:
+            raise ValueError("Too many values in " + self.table)
+
+    def lookup(self, ids):
+
+        """
+        Object array of the values of the given ids.
+        """
+
+        if len(ids) and int(ids.max()) >= len(self.values):
+            rows = self.db.execute("SELECT id, value FROM " + self.table).fetchall()
+            self.values = np.empty(max(value_id for value_id, _ in rows) + 1, dtype=object)
+            for value_id, value in rows:
+                self.values[value_id] = value
+        return self.values[ids]
+
+class TokenStore:
+
+    """
+    Encoder and decoder of (word, tag) lists, backed by the shared vocabularies of the database (storage.get_connection() if db is None).
+    """
+
+    def __init__(self, db=None):
+        db = db if db is not None else storage.get_connection()
+        self.tokens = Vocabulary(db, TOKEN_VOCABULARY, 2 ** 32)
+        self.tags = Vocabulary(db, TAG_VOCABULARY, 2 ** 8)
+
+    def encode(self, postags_lists):
+
+        """
+        Encode a list of (word, tag) lists. Return one blob per list. New words and tags are added to the vocabularies,
+        so call it inside the transaction that writes the blobs.
+        """
+
+        self.tokens.add(word for postags in postags_lists for word, _ in postags)
+        self.tags.add(tag for postags in postags_lists for _, tag in postags)
+
+        blobs = []
+        for postags in postags_lists:
+            words = np.array([self.tokens.ids[word] for word, _ in postags], dtype=TOKEN_DTYPE)
+            tags = np.array([self.tags.ids[tag] for _, tag in postags], dtype=TAG_DTYPE)
+            blobs.append(words.tobytes() + tags.tobytes())
+        return blobs
+
+    def decode(self, blob):
+
+        """
+        Return the list of (word, tag) of a blob.
+        """
+
+        return list(zip(self.tokens.lookup(token_ids(blob)).tolist(), self.tags.lookup(tag_ids(blob)).tolist()))